@@ -0,0 +1,215 @@
+// Lightweight SVG charts for the trading page. Served from _static so that lab computers do not need to reach a CDN.
+//
+// A chart is drawn once with setSeries(); afterwards setPoints() only moves the markers, the axes and the line are
+// redrawn only if the markers leave the current axis range. Instead of a line, a chart can show open/high/low/close
+// candles (setCandles). addValue() extends the line or the last candle by one value, e.g. a new trade, and drops the
+// oldest value once there are more than maxValues (setMaxValues).
+(function (global) {
+  'use strict';
+
+  const SVG_NS = 'http://www.w3.org/2000/svg';
+  const WIDTH = 600;
+  const HEIGHT = 320;
+  const PADDING = { top: 30, right: 20, bottom: 50, left: 65 };
+  const COLORS = ['#001C3D', '#E84E10'];
+
+  function createElement(name, attributes, parent) {
+    const element = document.createElementNS(SVG_NS, name);
+    for (const [key, value] of Object.entries(attributes || {})) {
+      element.setAttribute(key, value);
+    }
+    if (parent) parent.appendChild(element);
+    return element;
+  }
+
+  // Round axis steps to 1, 2 or 5 times a power of ten
+  function ticks(min, max, count) {
+    const rawStep = (max - min) / count || 1;
+    const magnitude = Math.pow(10, Math.floor(Math.log10(rawStep)));
+    const step = [1, 2, 5, 10].map(f => f * magnitude).find(s => s >= rawStep);
+    const values = [];
+    for (let value = Math.ceil(min / step) * step; value <= max + step / 1e6; value += step) {
+      values.push(Math.round(value * 1e6) / 1e6);
+    }
+    return values;
+  }
+
+  function extent(points) {
+    let [xMin, xMax, yMin, yMax] = [Infinity, -Infinity, Infinity, -Infinity];
+    for (const [x, y] of points) {
+      xMin = Math.min(xMin, x); xMax = Math.max(xMax, x);
+      yMin = Math.min(yMin, y); yMax = Math.max(yMax, y);
+    }
+    return { xMin, xMax, yMin, yMax };
+  }
+
+  class Chart {
+    constructor(container, options) {
+      this.container = typeof container === 'string' ? document.getElementById(container) : container;
+      this.options = Object.assign({ xMin: null, lineName: '', pointName: '', xTitle: '', yTitle: '',
+                                     maxValues: Infinity }, options);
+      this.series = [];
+      this.candles = [];
+      this.candleWidth = 0;
+      this.points = [];
+      this.domain = null;
+      this.svg = createElement('svg', { viewBox: `0 0 ${WIDTH} ${HEIGHT}`, width: '100%', role: 'img' });
+      this.axes = createElement('g', { 'font-size': 11, fill: '#001C3D' }, this.svg);
+      this.bodies = createElement('g', {}, this.svg);
+      this.line = createElement('path', { fill: 'none', stroke: COLORS[0], 'stroke-width': 2 }, this.svg);
+      this.markers = createElement('g', { fill: COLORS[1] }, this.svg);
+      this.legend = createElement('g', { 'font-size': 12, fill: '#001C3D' }, this.svg);
+      this.container.replaceChildren(this.svg);
+      this.drawLegend();
+    }
+
+    x(value) {
+      const { xMin, xMax } = this.domain;
+      return PADDING.left + (value - xMin) / (xMax - xMin || 1) * (WIDTH - PADDING.left - PADDING.right);
+    }
+
+    y(value) {
+      const { yMin, yMax } = this.domain;
+      return HEIGHT - PADDING.bottom - (value - yMin) / (yMax - yMin || 1) * (HEIGHT - PADDING.top - PADDING.bottom);
+    }
+
+    // Axis range covering the line, the candles and the markers, with some room above and below
+    fitDomain() {
+      const candleCorners = this.candles.flatMap(c => [[c[0], c[3]], [c[0] + this.candleWidth, c[2]]]);
+      const { xMin, xMax, yMin, yMax } = extent(this.series.concat(candleCorners, this.points));
+      if (!isFinite(xMin)) return { xMin: 0, xMax: 1, yMin: 0, yMax: 1 };
+      const margin = (yMax - yMin) * 0.1 || 1;
+      return {
+        xMin: this.options.xMin ?? xMin,
+        xMax: xMax,
+        yMin: yMin - margin,
+        yMax: yMax + margin,
+      };
+    }
+
+    contains(points) {
+      const { xMin, xMax, yMin, yMax } = this.domain;
+      return points.every(([x, y]) => x >= xMin && x <= xMax && y >= yMin && y <= yMax);
+    }
+
+    setSeries(series) {
+      this.series = series || [];
+      this.candles = [];
+      this.candleWidth = 0;
+      this.redraw();
+    }
+
+    // Candles [start, open, high, low, close, number of values] of the given width on the x axis
+    setCandles(candles, width) {
+      this.series = [];
+      this.candles = candles || [];
+      this.candleWidth = width;
+      this.redraw();
+    }
+
+    setMaxValues(maxValues) {
+      this.options.maxValues = maxValues ?? Infinity;
+    }
+
+    addValue(x, y) {
+      if (this.candleWidth) {
+        const start = x - x % this.candleWidth;
+        const last = this.candles[this.candles.length - 1];
+        if (last && last[0] >= start) {
+          last[2] = Math.max(last[2], y);
+          last[3] = Math.min(last[3], y);
+          last[4] = y;
+          last[5] += 1;
+        } else {
+          this.candles.push([start, y, y, y, y, 1]);
+        }
+        if (this.candles.length > this.options.maxValues) this.candles.shift();
+      } else {
+        this.series.push([x, y]);
+        if (this.series.length > this.options.maxValues) this.series.shift();
+      }
+      this.redraw();
+    }
+
+    setPoints(points) {
+      this.points = points || [];
+      if (!this.domain || !this.contains(this.points)) {
+        this.redraw();
+        return;
+      }
+      this.drawMarkers();
+    }
+
+    redraw() {
+      this.domain = this.fitDomain();
+      this.drawAxes();
+      this.drawLine();
+      this.drawCandles();
+      this.drawMarkers();
+    }
+
+    drawAxes() {
+      this.axes.replaceChildren();
+      const { xMin, xMax, yMin, yMax } = this.domain;
+      const bottom = HEIGHT - PADDING.bottom;
+      for (const value of ticks(yMin, yMax, 5)) {
+        createElement('line', { x1: PADDING.left, x2: WIDTH - PADDING.right, y1: this.y(value), y2: this.y(value),
+                                stroke: '#e6e6e6' }, this.axes);
+        createElement('text', { x: PADDING.left - 8, y: this.y(value) + 4, 'text-anchor': 'end' }, this.axes)
+          .textContent = value;
+      }
+      for (const value of ticks(xMin, xMax, 6)) {
+        createElement('text', { x: this.x(value), y: bottom + 16, 'text-anchor': 'middle' }, this.axes)
+          .textContent = value;
+      }
+      createElement('line', { x1: PADDING.left, x2: WIDTH - PADDING.right, y1: bottom, y2: bottom,
+                              stroke: '#001C3D' }, this.axes);
+      createElement('text', { x: (PADDING.left + WIDTH - PADDING.right) / 2, y: HEIGHT - 12,
+                              'text-anchor': 'middle' }, this.axes).textContent = this.options.xTitle;
+      createElement('text', { x: 0, y: 0, 'text-anchor': 'middle',
+                              transform: `translate(14 ${(PADDING.top + bottom) / 2}) rotate(-90)` }, this.axes)
+        .textContent = this.options.yTitle;
+    }
+
+    drawLine() {
+      this.line.setAttribute('d', this.series.map(([x, y], i) => `${i ? 'L' : 'M'}${this.x(x)},${this.y(y)}`).join(''));
+    }
+
+    drawCandles() {
+      this.bodies.replaceChildren();
+      for (const [start, open, high, low, close] of this.candles) {
+        const left = this.x(start);
+        const width = Math.max(1, this.x(start + this.candleWidth) - left - 1);
+        const color = close >= open ? COLORS[0] : COLORS[1];
+        createElement('line', { x1: left + width / 2, x2: left + width / 2, y1: this.y(high), y2: this.y(low),
+                                stroke: color }, this.bodies);
+        createElement('rect', { x: left, y: Math.min(this.y(open), this.y(close)), width: width,
+                                height: Math.max(1, Math.abs(this.y(open) - this.y(close))), fill: color },
+                      this.bodies);
+      }
+    }
+
+    drawMarkers() {
+      const markers = this.markers.children;
+      while (markers.length > this.points.length) this.markers.lastChild.remove();
+      while (markers.length < this.points.length) createElement('circle', { r: 5 }, this.markers);
+      this.points.forEach(([x, y], i) => {
+        markers[i].setAttribute('cx', this.x(x));
+        markers[i].setAttribute('cy', this.y(y));
+      });
+    }
+
+    drawLegend() {
+      const entries = [[this.options.lineName, COLORS[0]], [this.options.pointName, COLORS[1]]].filter(e => e[0]);
+      let offset = PADDING.left;
+      for (const [name, color] of entries) {
+        createElement('rect', { x: offset, y: 8, width: 10, height: 10, fill: color }, this.legend);
+        const label = createElement('text', { x: offset + 14, y: 17 }, this.legend);
+        label.textContent = name;
+        offset += 24 + name.length * 7;
+      }
+    }
+  }
+
+  global.MarketCharts = { Chart };
+})(window);
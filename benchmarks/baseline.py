@@ -0,0 +1,769 @@
+# live_method of the double_auction app as of its first version (commit 1dd1dc0), the reference of differential.py.
+#
+# Everything below the imports is copied verbatim from double_auction/__init__.py of that commit: the functions for
+# marginal costs/utilities, flatten, the constants, find_match and live_method. Only what live_method needs is
+# copied; numpy and the oTree models are not. The module globals time, datetime and Transaction are set by the
+# caller (see ReferenceEngine in differential.py), which runs live_method on plain stand-ins for the players, their
+# participants, the group and the session, with a simulated clock, and records the trades that Transaction.create()
+# is called with.
+from __future__ import annotations  # The Player annotation of live_method is not evaluated
+
+from otree.api import BaseConstants
+import time
+from datetime import datetime
+import sys
+
+Transaction = None  # Set by the caller, anything with a create(**fields) method
+
+def marginal_production_costs(t_1, t_2, t_3, min_mc, step, production_time):
+    t = t_1 + t_2 + t_3
+    if t == 0:
+        c = min_mc
+    elif t <= 1 * production_time:
+        c = (t / production_time) * (min_mc + step) + \
+            ((production_time - t) / production_time) * min_mc
+    elif t <= 2 * production_time:
+        c = ((t - production_time) / production_time) * (min_mc + 2 * step) + \
+            ((production_time - (t - production_time) ) / production_time) * (min_mc + step)
+    else:
+        c = min_mc + 2 * step
+    return c
+
+
+def marginal_consumption_utility(t_1, t_2, t_3, max_mu, step, consumption_time):
+    t = t_1 + t_2 + t_3
+    if t == 0:
+        u = max_mu
+    elif t <= 1 * consumption_time:
+        u = (t / consumption_time) * (max_mu - step) + \
+            ((consumption_time - t) / consumption_time) * max_mu
+    elif t <= 2 * consumption_time:
+        u = ((t - consumption_time) / consumption_time) * (max_mu - 2 * step) + \
+            ((consumption_time - (t - consumption_time)) / consumption_time) * (max_mu - step)
+    else:
+        u = max_mu - 2 * step
+    return u
+
+
+# Define other general functions
+
+
+def flatten(list_of_lists):  # Python function to unlist lists
+    if len(list_of_lists) == 0:
+        return list_of_lists
+    if isinstance(list_of_lists[0], list):
+        return flatten(list_of_lists[0]) + flatten(list_of_lists[1:])
+    return list_of_lists[:1] + flatten(list_of_lists[1:])
+
+
+class C(BaseConstants):
+    NAME_IN_URL = 'double_auction'
+    PLAYERS_PER_GROUP = None
+    NUM_ROUNDS = 1
+    BID_MIN = -sys.maxsize
+    ASK_MAX = sys.maxsize
+    TIME_PER_UNIT = 60  # Time to produce/consume one unit is 1 minutes, i.e. 1*60=60 seconds
+    # TIME_PER_UNIT = 600  # Time to produce/consume one unit is 10 minutes, i.e. 10*60=600 seconds
+    MIN_TIMESTAMP = datetime(2000, 1, 1, 0, 0, 0, 0).timestamp()
+    MAX_TIMESTAMP = datetime(3001, 1, 1, 0, 0, 0, 0).timestamp()
+
+
+def find_match(buyers, sellers):
+    for buyer in buyers:
+        for seller in sellers:
+            if seller.current_offer <= buyer.current_offer:
+                # return as soon as we find a match (the rest of the loop will be skipped)
+                return [buyer, seller]
+
+
+def live_method(player: Player, data):
+    group = player.group
+    players = group.get_players()
+    buyers = [p for p in players if p.is_buyer]
+    sellers = [p for p in players if not p.is_buyer and p.is_admin != 1]
+    player.participant.news = None
+    market_news = None
+    # Details on market structure
+    currency_unit = str(player.session.config['currency_unit'])
+    seller_tax = float(player.subsession.session.seller_tax)
+    buyer_tax = float(player.subsession.session.buyer_tax)
+    price_floor = float(player.subsession.session.price_floor)
+    price_ceiling = float(player.subsession.session.price_ceiling)
+    # Details on participants
+    participant = player.participant
+    # offers = participant.offers
+    offer_times = participant.offer_times  # List of tuples of offers and respective timestamp
+    participant.error = None  # Empty all error messages
+    if data:
+        if data['type'] == 'offer':
+            # Check if offer violates price restrictions
+            if player.is_buyer \
+                    and round(float(data['offer']), 2) < price_floor:
+                player.participant.error = dict(
+                    message="You are not allowed to bid below the price floor.",
+                    time=str(datetime.today().ctime())
+                )
+                player.participant.notifications.insert(0,
+                                                        {"message": "You are not allowed to bid below the price floor.",
+                                                         "time": str(datetime.today().ctime()),
+                                                         "type": "error"})
+            elif player.is_buyer \
+                    and round(float(data['offer']), 2) > price_ceiling:
+                player.participant.error = dict(
+                    message="You are not allowed to bid above the price ceiling.",
+                    time=str(datetime.today().ctime())
+                )
+                player.participant.notifications.insert(0,
+                                                        {
+                                                            "message": "You are not allowed to bid above the price "
+                                                                       "ceiling.",
+                                                            "time": str(datetime.today().ctime()),
+                                                            "type": "error"})
+            elif player.is_buyer == 0 \
+                    and round(float(data['offer']), 2) > price_ceiling:
+                player.participant.error = dict(
+                    message="You are not allowed to ask above the price ceiling.",
+                    time=str(datetime.today().ctime())
+                )
+                player.participant.notifications.insert(0,
+                                                        {
+                                                            "message": "You are not allowed to ask above the price "
+                                                                       "ceiling.",
+                                                            "time": str(datetime.today().ctime()),
+                                                            "type": "error"})
+            elif player.is_buyer == 0 \
+                     and round(float(data['offer']), 2) < price_floor:
+                player.participant.error = dict(
+                    message="You are not allowed to ask below the price floor.",
+                    time=str(datetime.today().ctime())
+                )
+                player.participant.notifications.insert(0,
+                                                        {
+                                                            "message": "You are not allowed to ask below the price "
+                                                                       "floor.",
+                                                            "time": str(datetime.today().ctime()),
+                                                            "type": "error"})
+            # Process offer
+            else:
+                offer_times.append((round(float(data['offer']), 2), datetime.today().timestamp()))
+                if player.is_buyer:
+                    offer_times.sort(key=lambda x: x[0],
+                                     reverse=True)  # Sort such that highest bid is first list element
+                    player.current_offer = offer_times[0][0]
+                elif player.is_buyer == 0 and player.is_admin != 1:
+                    offer_times.sort(key=lambda x: x[0],
+                                     reverse=False)  # Sort such that lowest ask is first list element
+                    player.current_offer = offer_times[0][0]
+                participant.offer_times = offer_times
+                player.current_offer_time = offer_times[0][1]
+                # Search for matching offers
+                if player.is_buyer:
+                    match = find_match(buyers=[player], sellers=sellers)
+                elif player.is_buyer == 0 and player.is_admin != 1:
+                    match = find_match(buyers=buyers, sellers=[player])
+                if match:
+                    [buyer, seller] = match
+                    if buyer.current_offer_time < seller.current_offer_time:
+                        price = buyer.current_offer
+                    else:
+                        price = seller.current_offer
+                    buyer_trading_history = buyer.participant.trading_history
+                    seller_trading_history = seller.participant.trading_history
+                    trade_time = str(datetime.today().ctime())
+                    Transaction.create(
+                        description=player.session.config['description'],
+                        group=group,
+                        buyer=buyer,
+                        seller=seller,
+                        price=price,
+                        seconds=int(time.time() - time.mktime(
+                            time.strptime(player.session.config['market_opening'], "%d %b %Y %X"))),
+                        buyer_valuation=buyer.participant.marginal_evaluation,
+                        seller_costs=seller.participant.marginal_evaluation,
+                        buyer_profits=buyer.participant.marginal_evaluation - price - (buyer_tax * price),
+                        seller_profits=price - seller.participant.marginal_evaluation - (seller_tax * price),
+                        buyer_balance=buyer.balance + buyer.participant.marginal_evaluation - price - (
+                                buyer_tax * price),
+                        seller_balance=seller.balance + price - seller.participant.marginal_evaluation - (
+                                seller_tax * price),
+                        buyer_tax=buyer_tax,
+                        seller_tax=seller_tax,
+                        price_floor=price_floor,
+                        price_ceiling=price_ceiling,
+                    )
+                    # Calculate new balances
+                    buyer.balance += buyer.participant.marginal_evaluation - price - (buyer_tax * price)
+                    seller.balance += price - seller.participant.marginal_evaluation - (seller_tax * price)
+                    # Create message about effected trade
+                    if player.session.config['anonymity']:
+                        buyer.participant.news = dict(
+                            message="You bought one unit at price "
+                                    + str('{:.2f}'.format((round(float(price), 2))))
+                                    + " "
+                                    + currency_unit,
+                            time=str(datetime.today().ctime())
+                        )
+                        buyer.participant.notifications.insert(0,
+                                                               {"message": "You bought one unit at price "
+                                                                           + str(
+                                                                   '{:.2f}'.format((round(float(price), 2))))
+                                                                           + " "
+                                                                           + currency_unit,
+                                                                "time": str(datetime.today().ctime()),
+                                                                "type": "news"})
+
+                        seller.participant.news = dict(
+                            message="You sold one unit at price "
+                                    + str('{:.2f}'.format((round(float(price), 2))))
+                                    + " "
+                                    + currency_unit,
+                            time=str(datetime.today().ctime())
+                        )
+                        seller.participant.notifications.insert(0,
+                                                                {"message": "You sold one unit at price "
+                                                                            + str(
+                                                                    '{:.2f}'.format((round(float(price), 2))))
+                                                                            + " "
+                                                                            + currency_unit,
+                                                                 "time": str(datetime.today().ctime()),
+                                                                 "type": "news"})
+                    else:
+                        buyer.participant.news = dict(
+                            message="You bought one unit at price "
+                                    + str('{:.2f}'.format((round(float(price), 2))))
+                                    + " "
+                                    + currency_unit
+                                    + " from Seller "
+                                    + str(seller.id_in_group),
+                            time=str(datetime.today().ctime())
+                        )
+                        buyer.participant.notifications.insert(0,
+                                                               {"message": "You bought one unit at price "
+                                                                           + str(
+                                                                   '{:.2f}'.format((round(float(price), 2))))
+                                                                           + " "
+                                                                           + currency_unit
+                                                                           + " from Seller "
+                                                                           + str(seller.id_in_group),
+                                                                "time": str(datetime.today().ctime()),
+                                                                "type": "news"})
+
+                        seller.participant.news = dict(
+                            message="You sold one unit at price "
+                                    + str('{:.2f}'.format((round(float(price), 2))))
+                                    + " "
+                                    + currency_unit
+                                    + " to Buyer "
+                                    + str(buyer.id_in_group),
+                            time=str(datetime.today().ctime())
+                        )
+                        seller.participant.notifications.insert(0,
+                                                                {"message": "You sold one unit at price "
+                                                                            + str(
+                                                                    '{:.2f}'.format((round(float(price), 2))))
+                                                                            + " "
+                                                                            + currency_unit
+                                                                            + " to Buyer "
+                                                                            + str(buyer.id_in_group),
+                                                                 "time": str(datetime.today().ctime()),
+                                                                 "type": "news"})
+
+                    # Delete bids/asks of effected trade from bid/ask cue
+                    buyer.participant.offer_times = buyer.participant.offer_times[1:]
+                    seller.participant.offer_times = seller.participant.offer_times[1:]
+                    if len(buyer.participant.offer_times) >= 1:
+                        buyer.current_offer = buyer.participant.offer_times[0][0]
+                        buyer.current_offer_time = buyer.participant.offer_times[0][1]
+                    else:
+                        buyer.current_offer = C.BID_MIN
+                        buyer.current_offer_time = C.MAX_TIMESTAMP
+                    if len(seller.participant.offer_times) >= 1:
+                        seller.current_offer = seller.participant.offer_times[0][0]
+                        seller.current_offer_time = seller.participant.offer_times[0][1]
+                    else:
+                        seller.current_offer = C.ASK_MAX
+                        seller.current_offer_time = C.MAX_TIMESTAMP
+                    # Trading history
+                    buyer_trading_history.insert(0, {"price": str('{:.2f}'.format((round(float(price), 2)))) + " "
+                                                              + currency_unit,
+                                                     "time": trade_time,
+                                                     "tax_on_buyer": str(buyer_tax * 100) + " %",
+                                                     "tax_on_seller": str(seller_tax * 100) + " %",
+                                                     "price_floor": str('{:.2f}'.format(round(price_floor, 2))) + " "
+                                                                    + currency_unit,
+                                                     "price_ceiling": str('{:.2f}'.format(round(price_ceiling, 2)))
+                                                                      + " " + currency_unit,
+                                                     "profit_from_trade": str('{:.2f}'.format(round(
+                                                         buyer.participant.marginal_evaluation - price -
+                                                         (buyer_tax * price), 2))) + " " + currency_unit,
+                                                     }),
+                    buyer.participant.trading_history = buyer_trading_history
+                    seller_trading_history.insert(0, {"price": str('{:.2f}'.format(round(float(price), 2))) + " "
+                                                               + currency_unit,
+                                                      "time": trade_time,
+                                                      "tax_on_buyer": str(buyer_tax * 100) + " %",
+                                                      "tax_on_seller": str(seller_tax * 100) + " %",
+                                                      "price_floor": str('{:.2f}'.format(round(price_floor, 2))) + " "
+                                                                     + currency_unit,
+                                                      "price_ceiling": str('{:.2f}'.format(round(price_ceiling, 2)))
+                                                                       + " " + currency_unit,
+                                                      "profit_from_trade": str('{:.2f}'.format(round(
+                                                          price - seller.participant.marginal_evaluation -
+                                                          (seller_tax * price), 2))) + " " + currency_unit,
+                                                      }),
+                    seller.participant.trading_history = seller_trading_history
+
+                    # Update remaining time needed for production/consumption
+                    # For buyers
+                    if buyer.participant.time_needed_1 == 0:
+                        buyer.participant.time_needed_1 += buyer.consumption_time
+                    elif buyer.participant.time_needed_2 == 0:
+                        buyer.participant.time_needed_2 += buyer.consumption_time
+                    else:
+                        buyer.participant.time_needed_3 += buyer.consumption_time
+                    # For sellers
+                    if seller.participant.time_needed_1 == 0:
+                        seller.participant.time_needed_1 += seller.production_time
+                    elif seller.participant.time_needed_2 == 0:
+                        seller.participant.time_needed_2 += seller.consumption_time
+                    else:
+                        seller.participant.time_needed_3 += seller.production_time
+
+                    # Update current offer history, i.e. still standing offers after trade
+                    buyer.participant.offer_history = []  # Empty offer history before recreating based on most recent info
+                    for x in buyer.participant.offer_times:
+                        buyer.participant.offer_history.insert(0,
+                                                               {"offer": str('{:.2f}'.format(round(x[0], 2))) + " "
+                                                                         + currency_unit,
+                                                                "offer_time": datetime.fromtimestamp(x[1]).ctime()})
+                    seller.participant.offer_history = []  # Empty offer history before recreating based on most recent info
+                    for x in seller.participant.offer_times:
+                        seller.participant.offer_history.append({"offer": str('{:.2f}'.format(round(x[0], 2))) + " " +
+                                                                          currency_unit,
+                                                                 "offer_time": datetime.fromtimestamp(x[1]).ctime()})
+            # Update current offer history, i.e. standing offers after new offer has been made
+            player.participant.offer_history = []  # Empty offer history before recreating based on most recent info
+            for x in player.participant.offer_times:
+                player.participant.offer_history.append({"offer": str('{:.2f}'.format(round(x[0], 2))) + " " +
+                                                                  currency_unit,
+                                                         "offer_time": datetime.fromtimestamp(x[1]).ctime()})
+        elif data['type'] == 'withdrawal':
+            withdrawal = data['withdrawal'].split(" ", 1)[0]
+            if float(withdrawal) in [i[0] for i in offer_times]:
+                del offer_times[([i[0] for i in offer_times]).index(float(withdrawal))]
+                # offer_times = [x for x in offer_times if x[0] in offers]
+            # participant.offers = offers
+            participant.offer_times = offer_times
+            if player.is_buyer:
+                offer_times.sort(key=lambda x: x[0], reverse=True)  # Sort such that highest bid is first list element
+                if len(offer_times) >= 1:
+                    player.current_offer = offer_times[0][0]
+                    player.current_offer_time = offer_times[0][1]
+                else:
+                    player.current_offer = C.BID_MIN
+                    player.current_offer_time = C.MAX_TIMESTAMP
+            elif player.is_buyer == 0 and player.is_admin != 1:
+                offer_times.sort(key=lambda x: x[0], reverse=False)  # Sort such that lowest ask is first list element
+                if len(offer_times) >= 1:
+                    player.current_offer = offer_times[0][0]
+                    player.current_offer_time = offer_times[0][1]
+                else:
+                    player.current_offer = C.ASK_MAX
+                    player.current_offer_time = C.MAX_TIMESTAMP
+            # Current offer history, i.e. still standing offers
+            player.participant.offer_history = []  # Empty offer history before recreating based on most recent info
+            for x in player.participant.offer_times:
+                player.participant.offer_history.append({"offer": str('{:.2f}'.format(round(x[0], 2))) + " " +
+                                                                  currency_unit,
+                                                         "offer_time": datetime.fromtimestamp(x[1]).ctime()})
+        elif data['type'] == 'time_update':
+            for p in players:
+                # Update remaining time needed for production/consumption
+                p.participant.current_timestamp = time.time()
+                if p.participant.time_needed_1 <= 1:
+                    if p.is_buyer:
+                        p.participant.time_needed_1 += min(p.participant.time_needed_2, p.consumption_time)
+                        p.participant.time_needed_2 -= p.participant.time_needed_1
+                    elif p.is_buyer == 0 and p.is_admin != 1:
+                        p.participant.time_needed_1 += min(p.participant.time_needed_2, p.production_time)
+                        p.participant.time_needed_2 -= p.participant.time_needed_1
+                if p.participant.time_needed_2 <= 1:
+                    if p.is_buyer:
+                        p.participant.time_needed_2 += min(p.participant.time_needed_3, p.consumption_time)
+                        p.participant.time_needed_3 -= p.participant.time_needed_2
+                    elif p.is_buyer == 0 and p.is_admin != 1:
+                        p.participant.time_needed_2 += min(p.participant.time_needed_3, p.production_time)
+                        p.participant.time_needed_3 -= p.participant.time_needed_2
+
+                p.participant.time_needed_1 = round(max(0, p.participant.time_needed_1 -
+                                                        (p.participant.current_timestamp -
+                                                         p.participant.previous_timestamp)), 0)
+                p.participant.time_needed_2 = round(max(0, p.participant.time_needed_2 -
+                                                        (p.participant.current_timestamp -
+                                                         p.participant.previous_timestamp)), 0)
+                p.participant.time_needed_3 = round(max(0, p.participant.time_needed_3 -
+                                                        (p.participant.current_timestamp -
+                                                         p.participant.previous_timestamp)), 0)
+                p.participant.previous_timestamp = p.participant.current_timestamp
+                # Update marginal utility/costs
+                if p.is_buyer:
+                    p.participant.marginal_evaluation = marginal_consumption_utility(
+                        p.participant.time_needed_1,
+                        p.participant.time_needed_2,
+                        p.participant.time_needed_3,
+                        p.max_mu,
+                        p.step_mu,
+                        p.consumption_time
+                    )
+                elif p.is_buyer == 0 and p.is_admin != 1:
+                    p.participant.marginal_evaluation = marginal_production_costs(p.participant.time_needed_1,
+                                                                                  p.participant.time_needed_2,
+                                                                                  p.participant.time_needed_3,
+                                                                                  p.min_mc,
+                                                                                  p.step_mc,
+                                                                                  p.production_time
+                                                                                  )
+        # Admin update of market structure
+        elif data['type'] == 'market_update':
+            # Check which parameters are updated
+            new_market_params = [
+                player.subsession.session.buyer_tax != round(float(data['buyer_tax_admin']) / 100, 3),
+                player.subsession.session.seller_tax != round(float(data['seller_tax_admin']) / 100, 3),
+                player.subsession.session.price_floor != round(float(data['price_floor_admin']), 2),
+                player.subsession.session.price_ceiling != round(float(data['price_ceiling_admin']), 2)
+            ]
+            # Write updated parameters into session variable
+            player.subsession.session.buyer_tax = round(float(data['buyer_tax_admin']) / 100, 3)
+            player.subsession.session.seller_tax = round(float(data['seller_tax_admin']) / 100, 3)
+            player.subsession.session.price_floor = round(float(data['price_floor_admin']), 2)
+            player.subsession.session.price_ceiling = round(float(data['price_ceiling_admin']), 2)
+            # Check whether there really was a change
+            if new_market_params == [False, False, False, False]:
+                market_news = None
+            else:
+                # Clear all standing asks and bids
+                for p in players:
+                    p.participant.offer_history = []
+                    p.participant.offer_times = []
+                    p.participant.offers = []
+                    if p.is_buyer:
+                        offer_times.sort(key=lambda x: x[0],
+                                         reverse=True)  # Sort such that highest bid is first list element
+                        if len(offer_times) >= 1:
+                            p.current_offer = offer_times[0][0]
+                            p.current_offer_time = offer_times[0][1]
+                        else:
+                            p.current_offer = C.BID_MIN
+                            p.current_offer_time = C.MAX_TIMESTAMP
+                    elif p.is_buyer == 0 and p.is_admin != 1:
+                        offer_times.sort(key=lambda x: x[0],
+                                         reverse=False)  # Sort such that lowest ask is first list element
+                        if len(offer_times) >= 1:
+                            p.current_offer = offer_times[0][0]
+                            p.current_offer_time = offer_times[0][1]
+                        else:
+                            p.current_offer = C.ASK_MAX
+                            p.current_offer_time = C.MAX_TIMESTAMP
+
+                # Create messages on market updates
+                if new_market_params == [True, False, False, False]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 1)) + " %. All standing bids and asks have "
+                                                                                  "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [False, True, False, False]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1)) + " %. All standing bids and asks have"
+                                                                                   " been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [False, False, True, False]:
+                    market_news = dict(
+                        message="A market intervention took place! The price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [False, False, False, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [True, True, False, False]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 1))
+                                + " % and the tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1)) + " %. All standing bids and asks have"
+                                                                                   " been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [True, False, True, False]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 1))
+                                + " % and the price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [True, False, False, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 1))
+                                + " % and the price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [False, True, True, False]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1))
+                                + " % and the price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [False, True, False, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1))
+                                + " % and the price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [False, False, True, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit'])
+                                + " and the price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [True, True, True, False]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 1))
+                                + " %, the tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1))
+                                + " % and the price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [True, False, True, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 1))
+                                + " %, the price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit'])
+                                + " and the price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [True, True, False, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 1))
+                                + " %, the tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1))
+                                + " % and the price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [False, True, True, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1))
+                                + " %, the price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit'])
+                                + " and the price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                elif new_market_params == [True, True, True, True]:
+                    market_news = dict(
+                        message="A market intervention took place! The tax on buyers has changed to "
+                                + str(round(float(data['buyer_tax_admin']), 11))
+                                + " %, the tax on sellers has changed to "
+                                + str(round(float(data['seller_tax_admin']), 1))
+                                + " %, the price floor has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit'])
+                                + " and the price ceiling has changed to "
+                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
+                                                                                "been deleted.",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                else:
+                    market_news = dict(
+                        message="The market has been updated",
+                        time=str(datetime.today().ctime()),
+                        type="market_news"
+                    )
+                for p in players:
+                    p.participant.notifications.insert(0, market_news)
+        elif data['type'] == 'notification_deletion':
+            notifications = player.participant.notifications
+            # reversed_notifications = list(reversed(notifications))
+            deletion = data['deletion']
+            del notifications[deletion]
+            # notifications = list(reversed(reversed_notifications))
+            player.participant.notifications = notifications
+
+    # Create lists of all asks/bids by all sellers/buyers
+    raw_bids = [[i[0] for i in p.participant.offer_times] for p in buyers]  # Collect bids from all buyers
+    raw_bidders = [[p.id_in_group for i in p.participant.offer_times] for p in buyers]  # Collect bidders
+    bids = flatten(raw_bids)  # Unnest list of bids
+    bidders = flatten(raw_bidders)  # Unnest list of bidders
+    # Dictionary of bid amount and bidder
+    bid_keys = ["bid" for i in range(len(bids))]
+    bidder_keys = ["bidder" for i in range(len(bidders))]
+    overall_bids_dict_list = [[bid_keys[i], bids[i], bidder_keys[i], bidders[i]] for i in range(len(bids))]
+    overall_bids = [
+        {
+            overall_bids_dict_list[i][0]: str('{:.2f}'.format(round(overall_bids_dict_list[i][1], 2))),
+            overall_bids_dict_list[i][2]: overall_bids_dict_list[i][3]
+        }
+        for i in range(len(overall_bids_dict_list))
+    ]
+    bids.sort(reverse=True)
+
+    # Collect asks from all sellers
+    raw_asks = [[i[0] for i in p.participant.offer_times] for p in sellers]  # Collect asks from all sellers
+    raw_askers = [[p.id_in_group for i in p.participant.offer_times] for p in sellers]  # Collect sellers
+    asks = flatten(raw_asks)  # Unnest list
+    askers = flatten(raw_askers)  # Unnest list of sellers
+    # Dictionary of ask amount and asker
+    ask_keys = ["ask" for i in range(len(asks))]
+    asker_keys = ["asker" for i in range(len(askers))]
+    overall_asks_dict_list = [[ask_keys[i], asks[i], asker_keys[i], askers[i]] for i in range(len(asks))]
+    overall_asks = [
+        {
+            overall_asks_dict_list[i][0]: str('{:.2f}'.format(round(overall_asks_dict_list[i][1], 2))),
+            overall_asks_dict_list[i][2]: overall_asks_dict_list[i][3]
+        }
+        for i in range(len(overall_asks_dict_list))
+    ]
+    asks.sort(reverse=False)
+
+    live_data = {}
+    for p in players:
+        live_data[p.id_in_group] = dict(
+            current_offer=str('{:.2f}'.format(round(p.current_offer, 2))) + " " + str(
+                player.session.config['currency_unit']),
+            current_offer_time=datetime.fromtimestamp(p.current_offer_time).ctime(),
+            balance=str('{:.2f}'.format(round(p.balance, 2))) + " " + str(player.session.config['currency_unit']),
+            bids=overall_bids,  # json.dumps(overall_bids_dict),
+            asks=overall_asks,  # json.dumps(overall_asks_dict),
+            cost_chart_series=p.participant.cost_chart_series,
+            utility_chart_series=p.participant.utility_chart_series,
+            chart_point=[
+                [(p.participant.time_needed_1 + p.participant.time_needed_2 + p.participant.time_needed_3), p.participant.marginal_evaluation]],
+            offers=[str('{:.2f}'.format(round(i[0], 2))) for i in p.participant.offer_times],
+            offer_times=[datetime.fromtimestamp(tup[1]).ctime() for tup in p.participant.offer_times],
+            offer_history=p.participant.offer_history,  # json.dumps(dict(offers=p.participant.offer_history)),
+            time_needed_1=p.participant.time_needed_1,
+            time_needed_2=p.participant.time_needed_2,
+            time_needed_3=p.participant.time_needed_3,
+            marginal_evaluation=str('{:.2f}'.format(round(p.participant.marginal_evaluation, 2))) + " " + str(
+                player.session.config['currency_unit']),
+            trading_history=p.participant.trading_history,  # json.dumps(dict(trades=p.participant.trading_history)),
+            buyer_tax=str('{:.1f}'.format(buyer_tax * 100)) + " " + str('%'),
+            seller_tax=str('{:.1f}'.format(seller_tax * 100)) + " " + str('%'),
+            price_floor=str('{:.2f}'.format(round(price_floor, 2))) + " " + str(
+                player.session.config['currency_unit']),
+            price_ceiling=str('{:.2f}'.format(round(price_ceiling, 2))) + " " + str(
+                player.session.config['currency_unit']),
+            buyer_tax_admin=buyer_tax * 100,
+            seller_tax_admin=seller_tax * 100,
+            price_floor_admin=round(price_floor, 2),
+            price_ceiling_admin=round(price_ceiling, 2),
+            currency_unit=currency_unit,
+            time_unit='seconds',  # str(player.session.config['time_unit']),
+            error=p.participant.error,
+            market_news=market_news,
+            news=p.participant.news,
+            notifications=p.participant.notifications,
+        )
+
+    # return {
+    #     p.id_in_group: dict(
+    #         current_offer=str('{:.2f}'.format(round(p.current_offer, 2))) + " " + str(
+    #             player.session.config['currency_unit']),
+    #         current_offer_time=datetime.fromtimestamp(p.current_offer_time).ctime(),
+    #         balance=str('{:.2f}'.format(round(p.balance, 2))) + " " + str(player.session.config['currency_unit']),
+    #         bids=overall_bids,  # json.dumps(overall_bids_dict),
+    #         asks=overall_asks,  # json.dumps(overall_asks_dict),
+    #         cost_chart_series=p.participant.cost_chart_series,
+    #         utility_chart_series=p.participant.utility_chart_series,
+    #         chart_point=[[p.participant.time_needed, p.participant.marginal_evaluation]],
+    #         offers=[str('{:.2f}'.format(round(i[0], 2))) for i in p.participant.offer_times],
+    #         offer_times=[datetime.fromtimestamp(tup[1]).ctime() for tup in p.participant.offer_times],
+    #         offer_history=p.participant.offer_history,  # json.dumps(dict(offers=p.participant.offer_history)),
+    #         time_needed=p.participant.time_needed,
+    #         marginal_evaluation=str('{:.2f}'.format(round(p.participant.marginal_evaluation, 2))) + " " + str(
+    #             player.session.config['currency_unit']),
+    #         trading_history=p.participant.trading_history,  # json.dumps(dict(trades=p.participant.trading_history)),
+    #         buyer_tax=str('{:.1f}'.format(buyer_tax * 100)) + " " + str('%'),
+    #         seller_tax=str('{:.1f}'.format(seller_tax * 100)) + " " + str('%'),
+    #         price_floor=str('{:.2f}'.format(round(price_floor, 2))) + " " + str(
+    #             player.session.config['currency_unit']),
+    #         price_ceiling=str('{:.2f}'.format(round(price_ceiling, 2))) + " " + str(
+    #             player.session.config['currency_unit']),
+    #         buyer_tax_admin=buyer_tax * 100,
+    #         seller_tax_admin=seller_tax * 100,
+    #         price_floor_admin=round(price_floor, 2),
+    #         price_ceiling_admin=round(price_ceiling, 2),
+    #         currency_unit=currency_unit,
+    #         time_unit='seconds'  # str(player.session.config['time_unit']),
+    #         error=p.participant.error,
+    #         market_news=market_news,
+    #         news=p.participant.news,
+    #         notifications=p.participant.notifications,
+    #     )
+    #     for p in players  # if p.is_admin is False
+    # }
+
+    return live_data
@@ -0,0 +1,40 @@
+# Shared helpers for the scripts in this folder, which run the double_auction app outside of a web server.
+# They are run from the project folder, e.g. `python benchmarks/startup.py`, and use an in-memory database unless
+# DATABASE_URL points somewhere else.
+import os
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_otree():  # Load settings and all apps like `otree devserver` does, returns the time it took in seconds
+    os.chdir(PROJECT_DIR)
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    if not os.environ.get('DATABASE_URL'):
+        os.environ.setdefault('OTREE_IN_MEMORY', '1')
+    start = time.perf_counter()
+    from otree.main import setup
+    setup()
+    return time.perf_counter() - start
+
+
+def create_session(num_participants, **config):  # Creates a double_auction session, must run inside session_scope()
+    import otree.session
+    # The market only takes offers while it is open, so it opens now and stays open for a day unless configured
+    now = time.time()
+    config.setdefault('market_opening', time.strftime("%d %b %Y %X", time.localtime(now)))
+    config.setdefault('market_closing', time.strftime("%d %b %Y %X", time.localtime(now + 24 * 60 * 60)))
+    return otree.session.create_session(
+        'double_auction',
+        num_participants=num_participants,
+        modified_session_config_fields=config,
+    )
+
+
+def percentile(values, share):  # Nearest-rank percentile of a list of numbers
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
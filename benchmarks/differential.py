@@ -0,0 +1,495 @@
+# Differential correctness harness for the matching engine.
+#
+# Generates seeded random event streams for one group (offers, withdrawals, time updates and market updates) and
+# runs each stream through the original live_method and through every candidate engine. Trades, standing offers,
+# current offers, clocks and balances have to agree; the first divergent event of a stream is reported together with
+# the seed that reproduces it. The time each engine spends on the events is summed up and reported relative to the
+# reference:
+#   python benchmarks/differential.py --streams 100000 --events 200 --traders 12 --seed 1 --jobs 8
+# Exits with status 1 if any candidate diverges.
+#
+# The reference is the live_method of the first version of the app, copied verbatim into baseline.py and run on plain
+# stand-ins for the players, participants, group and session, with a simulated clock. Its quirks are part of the
+# reference: a new offer trades with the first crossing counterparty in id order, the price of the earlier of both
+# offers wins (the ask's on equal timestamps), buyer and seller taxes are charged on each side, and a trade refills
+# the first empty production/consumption slot, where the second slot of a seller is refilled with its consumption
+# time. It works on floats. The candidates keep money in cents and round the marginal evaluation and the taxes of each
+# trade to cents, so balances may differ by up to one cent per trade of a player; everything else has to be identical.
+#
+# The speeds do not compare like with like: the reference time includes everything the original live_method does per
+# message, i.e. rebuilding the order book lists and the response of every player, while the candidates only run the
+# matching and clock functions. Against a model of the original matching logic alone on plain dicts, as this harness
+# used before, the candidates ran at about 0.7x. Use replay.py for the latency of the whole live_method.
+#
+# Candidates are the functions live_method uses (book) and the same functions applied through the market store of
+# MARKET_STORE_URL, i.e. in memory or in Redis (store). A new engine is compared by adding a subclass of BookEngine
+# to CANDIDATES.
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+
+from common import setup_otree
+
+START = 1600000000.0  # Timestamp of the first event of every stream
+
+
+# Event streams
+
+
+def generate_stream(seed, stream, num_events, max_traders):
+    # Market setup and events of one stream, the same for the same arguments
+    rng = random.Random('{}:{}'.format(seed, stream))
+    buyer_share = rng.choice([2, 3])
+    traders = []
+    for id_in_group in range(2, rng.randint(3, max_traders + 1) + 1):  # id_in_group 1 is the admin, who does not trade
+        traders.append(dict(
+            id_in_group=id_in_group,
+            is_buyer=id_in_group % buyer_share == 0,
+            min_mc=rng.randint(10, 40),
+            max_mu=rng.randint(60, 90),
+            step_mc=rng.randint(1, 10),
+            step_mu=rng.randint(1, 10),
+            production_time=rng.choice([5, 10, 60]),
+            consumption_time=rng.choice([5, 10, 60]),
+        ))
+    market = dict(traders=traders, parameters=random_parameters(rng))
+    events = []
+    offered = {t['id_in_group']: [] for t in traders}  # Prices offered by each trader, candidates for withdrawals
+    now = START
+    center = rng.uniform(30, 70)
+    for _ in range(num_events):
+        now += rng.choice([0, 0, 0.25, 1, 1, 3, 17])  # Equal timestamps test the tie between a bid and an ask
+        kind = rng.random()
+        trader = rng.choice(traders)['id_in_group']
+        if kind < 0.6:
+            price = rng.gauss(center, 15)
+            text = str(int(round(price))) if rng.random() < 0.7 else '{:.2f}'.format(price)
+            offered[trader].append(text)
+            events.append(('offer', trader, text, now))
+        elif kind < 0.75:
+            if offered[trader] and rng.random() < 0.9:
+                text = '{:.2f}'.format(float(rng.choice(offered[trader])))
+            else:
+                text = '{:.2f}'.format(rng.randint(0, 100))
+            events.append(('withdrawal', trader, text))
+        elif kind < 0.95:
+            events.append(('time_update', now))
+        elif rng.random() < 0.8:
+            events.append(('market_update', random_parameters(rng)))
+        else:
+            events.append(('market_update', dict(market['parameters'])))  # Possibly unchanged parameters
+    return market, events
+
+
+def random_parameters(rng):  # Market parameters as sent by the admin page
+    return dict(
+        buyer_tax_admin=rng.choice(['0', '5', '10', '12.5', '20']),
+        seller_tax_admin=rng.choice(['0', '5', '10', '12.5', '20']),
+        price_floor_admin=rng.choice(['0', '10', '20', '25.5']),
+        price_ceiling_admin=rng.choice(['70', '80', '100', '1000']),
+    )
+
+
+# Engines
+
+
+class Engine:
+
+    def handle(self, event):  # Returns the trade (buyer, seller, price in cents) of an offer, the error or None
+        return getattr(self, event[0])(*event[1:])
+
+    def close(self):  # Release the state of the engine
+        pass
+
+
+class SimulatedClock:  # Stands in for the time module and the datetime class in baseline.py
+
+    def __init__(self, now):
+        self.now = now
+        clock = self
+
+        class SimulatedDatetime(datetime):
+
+            @classmethod
+            def today(cls):
+                return datetime.fromtimestamp(clock.now)
+
+        self.datetime = SimulatedDatetime
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):  # Everything else, e.g. time.mktime, comes from the time module
+        return getattr(time, name)
+
+
+class ReferenceEngine(Engine):  # The original live_method (see baseline.py) on plain objects, without database
+    name = 'reference'
+
+    def __init__(self, market):
+        import baseline
+        import double_auction
+        self.baseline = baseline
+        self.C = baseline.C  # Placeholders of players without standing offers
+        self.errors = {message: key for key, (message, kind) in double_auction.NOTIFICATIONS.items()}
+        self.clock = SimulatedClock(START)
+        self.trades = []  # Fields of every Transaction.create() call
+        parameters = self.parse_parameters(market['parameters'])
+        config = dict(description='differential', currency_unit='&euro;', anonymity=True,
+                      market_opening=time.strftime("%d %b %Y %X", time.localtime(START)))
+        session = SimpleNamespace(config=config, buyer_tax=parameters[0], seller_tax=parameters[1],
+                                  price_floor=parameters[2], price_ceiling=parameters[3])
+        players = []
+        group = SimpleNamespace(get_players=lambda: players)
+        # As set up by creating_session of the original app, the admin is id_in_group 1 and neither buys nor sells
+        for t in [dict(id_in_group=1, is_buyer=False, min_mc=0, max_mu=0, step_mc=0, step_mu=0, production_time=0,
+                       consumption_time=0)] + market['traders']:
+            if t['is_buyer']:
+                evaluation = baseline.marginal_consumption_utility(0, 0, 0, t['max_mu'], t['step_mu'],
+                                                                   t['consumption_time'])
+            else:
+                evaluation = baseline.marginal_production_costs(0, 0, 0, t['min_mc'], t['step_mc'],
+                                                                t['production_time'])
+            participant = SimpleNamespace(
+                marginal_evaluation=evaluation, offers=[], offer_times=[], offer_history=[], trading_history=[],
+                time_needed_1=0, time_needed_2=0, time_needed_3=0, previous_timestamp=START, current_timestamp=START,
+                error=None, news=None, notifications=[], cost_chart_series=[], utility_chart_series=[])
+            players.append(SimpleNamespace(
+                **t, is_admin=t['id_in_group'] == 1, balance=0, current_offer_time=self.C.MAX_TIMESTAMP,
+                current_offer=self.C.BID_MIN if t['is_buyer'] else self.C.ASK_MAX, participant=participant,
+                session=session, subsession=SimpleNamespace(session=session), group=group))
+        self.players = {p.id_in_group: p for p in players}
+
+    @staticmethod
+    def parse_parameters(data):  # Market parameters as live_method stores them in the session
+        return (round(float(data['buyer_tax_admin']) / 100, 3), round(float(data['seller_tax_admin']) / 100, 3),
+                round(float(data['price_floor_admin']), 2), round(float(data['price_ceiling_admin']), 2))
+
+    def send(self, id_in_group, data, now=None):  # Call live_method at the simulated time now
+        if now is not None:
+            self.clock.now = now
+        baseline = self.baseline
+        baseline.time, baseline.datetime, baseline.Transaction = self.clock, self.clock.datetime, self
+        baseline.live_method(self.players[id_in_group], data)
+
+    def create(self, **fields):  # Transaction.create() of live_method
+        self.trades.append(fields)
+
+    def offer(self, trader, text, timestamp):
+        trades = len(self.trades)
+        self.send(trader, dict(type='offer', offer=text), timestamp)
+        error = self.players[trader].participant.error
+        if error:
+            return self.errors[error['message']]
+        if len(self.trades) == trades:
+            return None
+        trade = self.trades[-1]
+        return trade['buyer'].id_in_group, trade['seller'].id_in_group, int(round(trade['price'] * 100))
+
+    def withdrawal(self, trader, text):
+        self.send(trader, dict(type='withdrawal', withdrawal=text))
+
+    def time_update(self, now):
+        self.send(1, dict(type='time_update'), now)
+
+    def market_update(self, data):
+        self.send(1, dict(data, type='market_update'))
+
+    def state(self):  # Per trader: standing offers, current offer, balance and number of trades, clock
+        trades = Counter()
+        for trade in self.trades:
+            trades[trade['buyer'].id_in_group] += 1
+            trades[trade['seller'].id_in_group] += 1
+        return {
+            trader: dict(
+                offers=[(int(round(price * 100)), timestamp) for price, timestamp in p.participant.offer_times],
+                current_offer=(p.current_offer if p.current_offer in (self.C.BID_MIN, self.C.ASK_MAX)
+                               else int(round(p.current_offer * 100)), p.current_offer_time),
+                balance=p.balance,
+                trades=trades[trader],
+                clock=(p.participant.time_needed_1, p.participant.time_needed_2, p.participant.time_needed_3,
+                       p.participant.marginal_evaluation),
+            )
+            for trader, p in self.players.items() if trader != 1
+        }
+
+
+class BookEngine(Engine):  # The order book and clock functions of live_method, applied directly
+    name = 'book'
+
+    def __init__(self, market):
+        import double_auction
+        self.double_auction = da = double_auction
+        self.traders = {t['id_in_group']: t for t in market['traders']}
+        self.epoch = None
+        self.market_update(market['parameters'])
+        book = da.new_book(buyers=[t['id_in_group'] for t in market['traders'] if t['is_buyer']],
+                           sellers=[t['id_in_group'] for t in market['traders'] if not t['is_buyer']],
+                           epoch=self.epoch)
+        clocks = {}
+        for t in market['traders']:
+            clock = dict(t, is_admin=False, time_needed_1=0, time_needed_2=0, time_needed_3=0,
+                         previous_timestamp=START, current_timestamp=START)
+            del clock['id_in_group']
+            if t['is_buyer']:
+                clock['marginal_evaluation'] = da.marginal_consumption_utility(0, 0, 0, t['max_mu'], t['step_mu'],
+                                                                               t['consumption_time'])
+            else:
+                clock['marginal_evaluation'] = da.marginal_production_costs(0, 0, 0, t['min_mc'], t['step_mc'],
+                                                                            t['production_time'])
+            clocks[t['id_in_group']] = clock
+        self.trades = {trader: 0 for trader in self.traders}
+        self.load(book, {trader: 0 for trader in self.traders}, clocks)
+
+    # State of the market, kept in this object
+
+    def load(self, book, balances, clocks):
+        self.book, self.balances, self.clocks = book, balances, clocks
+
+    def update_book(self, change):
+        return change(self.book)
+
+    def update_clocks(self, change):
+        return change(self.clocks)
+
+    def add_balance(self, trader, amount):
+        self.balances[trader] += amount
+
+    def read(self):
+        return self.book, self.balances, self.clocks
+
+    # Events, as handled by live_method
+
+    def offer(self, trader, text, timestamp):
+        da = self.double_auction
+        is_buyer = self.traders[trader]['is_buyer']
+        offer = da.to_cents(text)
+        violation = da.price_limit_violation(is_buyer, offer, self.epoch['price_floor'], self.epoch['price_ceiling'])
+        if violation:
+            return violation
+        match, epoch = self.update_book(lambda book: (da.submit_offer(book, trader, is_buyer, offer, timestamp),
+                                                      book['epoch']))
+        if not match:
+            return None
+        buyer, seller, price = match
+
+        def add_units(clocks):
+            da.add_traded_units(clocks, buyer, seller)
+            return clocks[buyer]['marginal_evaluation'], clocks[seller]['marginal_evaluation']
+
+        buyer_evaluation, seller_evaluation = self.update_clocks(add_units)
+        buyer_profits, seller_profits = da.trade_profits(epoch, buyer_evaluation, seller_evaluation, price)
+        self.add_balance(buyer, buyer_profits)
+        self.add_balance(seller, seller_profits)
+        self.trades[buyer] += 1
+        self.trades[seller] += 1
+        return buyer, seller, price
+
+    def withdrawal(self, trader, text):
+        da = self.double_auction
+        withdrawal = da.to_cents(text.split(" ", 1)[0])
+        self.update_book(lambda book: da.withdraw_offer(book, trader, self.traders[trader]['is_buyer'], withdrawal))
+
+    def time_update(self, now):
+        self.update_clocks(lambda clocks: self.double_auction.advance_clocks(clocks, now))
+
+    def market_update(self, data):
+        epoch = dict(buyer_tax=round(float(data['buyer_tax_admin']) / 100, 3),
+                     seller_tax=round(float(data['seller_tax_admin']) / 100, 3),
+                     price_floor=round(float(data['price_floor_admin']), 2),
+                     price_ceiling=round(float(data['price_ceiling_admin']), 2))
+        if self.epoch is None:
+            self.epoch = dict(epoch, id=0, number=0)
+        elif any(self.epoch[key] != value for key, value in epoch.items()):
+            self.epoch = dict(epoch, id=self.epoch['id'] + 1, number=self.epoch['number'] + 1)
+            self.update_book(lambda book: self.double_auction.start_epoch(book, self.epoch))
+
+    def state(self):
+        da = self.double_auction
+        book, balances, clocks = self.read()
+        return {
+            trader: dict(
+                offers=list(book['offers'].get(trader, [])),
+                current_offer=tuple(da.best_offer(book, trader, t['is_buyer'])),
+                balance=balances[trader] / 100,
+                trades=self.trades[trader],
+                clock=tuple(clocks[trader][key] for key in ['time_needed_1', 'time_needed_2', 'time_needed_3',
+                                                            'marginal_evaluation']),
+            )
+            for trader, t in self.traders.items()
+        }
+
+
+class StoreEngine(BookEngine):  # The same functions applied through the market store, as in live_method
+    name = 'store'
+    markets = 0
+
+    def load(self, book, balances, clocks):
+        StoreEngine.markets += 1
+        self.store = self.double_auction.get_market_store()
+        self.market = 'differential:{}:{}'.format(id(self), StoreEngine.markets)
+        self.store.load_market(self.market, book, balances, clocks)
+
+    def update_book(self, change):
+        return self.store.update_book(self.market, change)
+
+    def update_clocks(self, change):
+        return self.store.update_clocks(self.market, change)
+
+    def add_balance(self, trader, amount):
+        self.store.add_balance(self.market, trader, amount)
+
+    def read(self):
+        return (self.store.read_book(self.market), self.store.read_balances(self.market),
+                self.store.read_clocks(self.market))
+
+    def close(self):
+        self.store.drop_market(self.market)
+
+
+CANDIDATES = {engine.name: engine for engine in [BookEngine, StoreEngine]}
+
+
+# Comparison
+
+
+def differences(reference, candidate):  # Differences between the states of two engines, as readable lines
+    lines = []
+    for trader, expected in reference.items():
+        actual = candidate[trader]
+        for key in ['offers', 'current_offer', 'trades', 'clock']:
+            if expected[key] != actual[key]:
+                lines.append('trader {} {}: expected {}, got {}'.format(trader, key, expected[key], actual[key]))
+        # Candidates round each trade to cents, see the top of this file
+        if abs(expected['balance'] - actual['balance']) > 0.01 * expected['trades'] + 1e-9:
+            lines.append('trader {} balance: expected {:.4f}, got {:.4f} after {} trades'.format(
+                trader, expected['balance'], actual['balance'], expected['trades']))
+    return lines
+
+
+def run_engine(engine_class, market, events):  # Outputs of all events, final state and seconds spent on the events
+    engine = engine_class(market)
+    handle = engine.handle
+    outputs = []
+    start = time.perf_counter()
+    for event in events:
+        outputs.append(handle(event))
+    elapsed = time.perf_counter() - start
+    state = engine.state()
+    engine.close()
+    return outputs, state, elapsed
+
+
+def first_divergence(engine_class, market, events):  # Index and description of the first divergent event
+    reference = ReferenceEngine(market)
+    candidate = engine_class(market)
+    try:
+        for i, event in enumerate(events):
+            expected = reference.handle(event)
+            actual = candidate.handle(event)
+            lines = differences(reference.state(), candidate.state())
+            if expected != actual:
+                lines.insert(0, 'output: expected {}, got {}'.format(expected, actual))
+            if lines:
+                return i, lines
+    finally:
+        candidate.close()
+    return None, ['final states differ']
+
+
+def check_streams(seed, streams, num_events, max_traders, candidates):
+    # Totals per engine, divergences, number of events and number of trades of a range of streams
+    totals = {name: dict(seconds=0.0, divergent=0) for name in ['reference'] + candidates}
+    divergences = []
+    events_run = 0
+    trades = 0
+    for stream in streams:
+        market, events = generate_stream(seed, stream, num_events, max_traders)
+        events_run += len(events)
+        expected_outputs, expected_state, seconds = run_engine(ReferenceEngine, market, events)
+        totals['reference']['seconds'] += seconds
+        trades += sum(1 for output in expected_outputs if isinstance(output, tuple))
+        for name in candidates:
+            outputs, state, seconds = run_engine(CANDIDATES[name], market, events)
+            totals[name]['seconds'] += seconds
+            if outputs != expected_outputs or differences(expected_state, state):
+                totals[name]['divergent'] += 1
+                index, lines = first_divergence(CANDIDATES[name], market, events)
+                divergences.append(dict(candidate=name, stream=stream, index=index,
+                                        event=events[index] if index is not None else None, lines=lines))
+    return totals, divergences, events_run, trades
+
+
+def init_worker():
+    if 'double_auction' not in sys.modules:  # Already loaded in forked workers
+        setup_otree()
+
+
+def check_chunk(args):
+    return check_streams(*args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the matching engine with the original live_method')
+    parser.add_argument('--streams', type=int, default=1000, help='Number of random event streams')
+    parser.add_argument('--events', type=int, default=200, help='Events per stream')
+    parser.add_argument('--traders', type=int, default=12, help='Maximum number of buyers and sellers per stream')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the streams, the same seed gives the same streams')
+    parser.add_argument('--stream', type=int, help='Only run this stream, e.g. to reproduce a divergence')
+    parser.add_argument('--candidates', nargs='+', choices=sorted(CANDIDATES), default=sorted(CANDIDATES),
+                        help='Engines compared with the reference')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--max-reports', type=int, default=10, help='Number of divergences printed in detail')
+    args = parser.parse_args()
+
+    setup_otree()
+    import double_auction  # Loaded before the workers are forked
+
+    streams = [args.stream] if args.stream is not None else list(range(args.streams))
+    chunk_size = max(1, min(1000, len(streams) // (args.jobs * 4) or 1))
+    chunks = [(args.seed, streams[i:i + chunk_size], args.events, args.traders, args.candidates)
+              for i in range(0, len(streams), chunk_size)]
+    totals = {name: dict(seconds=0.0, divergent=0) for name in ['reference'] + args.candidates}
+    divergences = []
+    events_run = 0
+    trades = 0
+    started = time.perf_counter()
+    if args.jobs > 1:
+        with multiprocessing.Pool(args.jobs, initializer=init_worker) as pool:
+            results = list(pool.imap_unordered(check_chunk, chunks))
+    else:
+        results = [check_chunk(chunk) for chunk in chunks]
+    for chunk_totals, chunk_divergences, chunk_events, chunk_trades in results:
+        for name, values in chunk_totals.items():
+            totals[name]['seconds'] += values['seconds']
+            totals[name]['divergent'] += values['divergent']
+        divergences += chunk_divergences
+        events_run += chunk_events
+        trades += chunk_trades
+
+    print('{} streams, {} events, {} trades, seed {}, {:.1f} s'.format(len(streams), events_run, trades, args.seed,
+                                                                      time.perf_counter() - started))
+    reference_seconds = totals['reference']['seconds']
+    for name, values in totals.items():
+        print('  {:<10} {:>10.0f} events/s  {:>6.2f}x  {} divergent streams'.format(
+            name, events_run / values['seconds'] if values['seconds'] else 0,
+            reference_seconds / values['seconds'] if values['seconds'] else 0,
+            '-' if name == 'reference' else values['divergent']))
+    divergences.sort(key=lambda d: (d['candidate'], d['stream']))
+    for d in divergences[:args.max_reports]:
+        print()
+        print('{} diverges in stream {} at event {} {} (rerun with --seed {} --stream {})'.format(
+            d['candidate'], d['stream'], d['index'], d['event'], args.seed, d['stream']))
+        for line in d['lines'][:10]:
+            print('  ' + line)
+    if divergences:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
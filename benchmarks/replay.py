@@ -0,0 +1,160 @@
+# Replay benchmark based on the trades of a real session.
+#
+# Turns a custom_export CSV of the double_auction app (Data > Custom exports in the oTree admin) into a timed
+# workload and replays it against live_method at several speeds, measuring latency and throughput:
+#   python benchmarks/replay.py export.csv --speeds 1 10 100
+# Every exported trade becomes an ask by its seller followed by a bid by its buyer at the trade price, so the replay
+# reproduces the exported trades. Changes of taxes or price limits between two trades become a market_update by the
+# admin, the admin page's time update every 5 seconds is added, and all participants load the trading page at market
+# opening. The export contains neither withdrawn nor unmatched offers, so the replayed load is a lower bound of the
+# original one. Each event is a database transaction of its own, which loads its player and commits, like a
+# message of the live socket. Set DATABASE_URL to replay against a local database instead of an in-memory one.
+import argparse
+import csv
+import sys
+import time
+from collections import defaultdict
+
+from common import setup_otree, create_session, percentile
+
+TIME_UPDATE_INTERVAL = 5  # Seconds between time updates of the admin page, see Trading.html
+BURST_WINDOW = 60  # Seconds after market opening and after each market update that count as a burst
+
+
+def read_trades(path, session_code=None):  # Trades of one session from a custom_export CSV, in order of time
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        sys.exit('No trades in ' + path)
+    session_code = session_code or rows[0]['session']
+    trades = [row for row in rows if row['session'] == session_code]
+    if not trades:
+        sys.exit('No trades of session ' + session_code + ' in ' + path)
+    trades.sort(key=lambda row: int(row['seconds']))
+    return session_code, trades
+
+
+def market_parameters(row):  # Taxes in percent and price limits of a trade, as sent by the admin page
+    return dict(
+        buyer_tax_admin=str(round(float(row['buyer_tax']) * 100, 1)),
+        seller_tax_admin=str(round(float(row['seller_tax']) * 100, 1)),
+        price_floor_admin=str(round(float(row['price_floor']), 2)),
+        price_ceiling_admin=str(round(float(row['price_ceiling']), 2)),
+    )
+
+
+def build_workload(trades, num_participants):
+    # List of (seconds since market opening, id_in_group, live_method data, event type), in order of time
+    start = int(trades[0]['seconds'])
+    events = [(0, i, {}, 'page load') for i in range(1, num_participants + 1)]
+    parameters = market_parameters(trades[0])
+    for row in trades:
+        seconds = int(row['seconds']) - start
+        if market_parameters(row) != parameters:
+            parameters = market_parameters(row)
+            events.append((seconds, 1, dict(parameters, type='market_update'), 'market update'))
+        price = str(round(float(row['price']), 2))
+        events.append((seconds, int(row['seller']), {'type': 'offer', 'offer': price}, 'offer'))
+        events.append((seconds, int(row['buyer']), {'type': 'offer', 'offer': price}, 'offer'))
+    end = events[-1][0]
+    events += [(seconds, 1, {'type': 'time_update'}, 'time update')
+               for seconds in range(0, end + 1, TIME_UPDATE_INTERVAL)]
+    events.sort(key=lambda event: event[0])  # Stable, so the ask of a trade stays in front of its bid
+    return events
+
+
+def replay(events, trades, num_participants, speed):
+    from otree.database import session_scope
+    import double_auction
+
+    first = trades[0]
+    with session_scope():
+        session = create_session(
+            num_participants,
+            buyer_tax=float(first['buyer_tax']) * 100,
+            seller_tax=float(first['seller_tax']) * 100,
+            price_floor=float(first['price_floor']),
+            price_ceiling=float(first['price_ceiling']),
+        )
+        group = session.get_subsessions()[0].get_groups()[0]
+        players = {p.id_in_group: p for p in group.get_players()}
+        for row in trades:
+            if not players[int(row['buyer'])].is_buyer or players[int(row['seller'])].is_buyer:
+                sys.exit('Buyers and sellers of the export do not match the session config (see buyer_share)')
+        player_ids = {id_in_group: p.id for id_in_group, p in players.items()}
+        group_id = group.id
+
+    latencies = defaultdict(list)
+    bursts = [0] + [seconds for seconds, _, _, kind in events if kind == 'market update']
+    burst_latencies = []
+    other_latencies = []
+    max_lag = 0
+    started = time.perf_counter()
+    for seconds, id_in_group, data, kind in events:
+        scheduled = started + seconds / speed
+        now = time.perf_counter()
+        if now < scheduled:
+            time.sleep(scheduled - now)
+        else:
+            max_lag = max(max_lag, now - scheduled)
+        # The latency includes loading the player and committing the transaction
+        start = time.perf_counter()
+        with session_scope():
+            double_auction.live_method(double_auction.Player.objects_get(id=player_ids[id_in_group]), data)
+        latency = time.perf_counter() - start
+        latencies[kind].append(latency)
+        if any(0 <= seconds - burst < BURST_WINDOW for burst in bursts):
+            burst_latencies.append(latency)
+        else:
+            other_latencies.append(latency)
+    elapsed = time.perf_counter() - started
+    with session_scope():
+        replayed_trades = len(double_auction.Transaction.filter(group=double_auction.Group.objects_get(id=group_id)))
+
+    return dict(elapsed=elapsed, latencies=latencies, burst_latencies=burst_latencies,
+                other_latencies=other_latencies, max_lag=max_lag, trades=replayed_trades)
+
+
+def latency_summary(values):
+    if not values:
+        return '-'
+    return 'p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+        percentile(values, 0.5) * 1000, percentile(values, 0.95) * 1000, percentile(values, 0.99) * 1000,
+        max(values) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the trades of a custom_export CSV against live_method')
+    parser.add_argument('export', help='CSV file downloaded from the custom export of double_auction')
+    parser.add_argument('--session', help='Session code to replay (default: the first session in the file)')
+    parser.add_argument('--speeds', type=float, nargs='+', default=[10, 100],
+                        help='Replay speeds relative to the original session, e.g. 1 10 100')
+    parser.add_argument('--participants', type=int,
+                        help='Participants in the replay session (default: highest id_in_group in the export)')
+    args = parser.parse_args()
+
+    session_code, trades = read_trades(args.export, args.session)
+    num_participants = args.participants or max(max(int(row['buyer']), int(row['seller'])) for row in trades)
+    events = build_workload(trades, num_participants)
+    duration = events[-1][0]
+    print('Session {}: {} trades, {} participants, {} events over {} s'.format(
+        session_code, len(trades), num_participants, len(events), duration))
+
+    setup_otree()
+    for speed in args.speeds:
+        result = replay(events, trades, num_participants, speed)
+        print()
+        print('Speed {:g}x: {} events in {:.1f} s, {:.1f} events/s, {} of {} trades reproduced, '
+              'max lag behind schedule {:.1f} ms'.format(
+                speed, len(events), result['elapsed'], len(events) / result['elapsed'], result['trades'],
+                len(trades), result['max_lag'] * 1000))
+        for kind, values in result['latencies'].items():
+            print('  {:<14} {:>6} x  {}'.format(kind, len(values), latency_summary(values)))
+        print('  {:<14} {:>6} x  {}'.format('in bursts', len(result['burst_latencies']),
+                                           latency_summary(result['burst_latencies'])))
+        print('  {:<14} {:>6} x  {}'.format('otherwise', len(result['other_latencies']),
+                                           latency_summary(result['other_latencies'])))
+
+
+if __name__ == '__main__':
+    main()
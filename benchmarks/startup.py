@@ -0,0 +1,65 @@
+# Startup-time budget check for worker restarts.
+#
+# Measures in a fresh interpreter how long loading oTree with the double_auction app takes, which heavy libraries
+# that pulls in, and how long the first live_method calls of a freshly loaded worker take. Exits with status 1 if a
+# budget is exceeded, so it can run in CI or before a deployment:
+#   python benchmarks/startup.py --import-budget 3 --request-budget 0.25
+import argparse
+import sys
+import time
+
+from common import setup_otree, create_session
+
+HEAVY_MODULES = ['numpy', 'matplotlib', 'pandas', 'scipy']  # Libraries that must not be loaded at worker startup
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup-time budget check for worker restarts')
+    parser.add_argument('--import-budget', type=float, default=3.0,
+                        help='Maximum seconds for loading oTree with all apps')
+    parser.add_argument('--request-budget', type=float, default=0.25,
+                        help='Maximum seconds for each of the first live_method calls')
+    parser.add_argument('--participants', type=int, default=40, help='Participants in the test session')
+    args = parser.parse_args()
+
+    import_seconds = setup_otree()
+    heavy_modules = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    from otree.database import session_scope
+    import double_auction
+
+    with session_scope():
+        session = create_session(args.participants)
+        players = session.get_subsessions()[0].get_players()
+        admin = players[0]
+        buyer = next(p for p in players if p.is_buyer)
+        seller = next(p for p in players if not p.is_buyer and not p.is_admin)
+        requests = [
+            ('first offer', buyer, {'type': 'offer', 'offer': '60'}),
+            ('matching offer', seller, {'type': 'offer', 'offer': '50'}),
+            ('time update', admin, {'type': 'time_update'}),
+        ]
+        request_seconds = []
+        for name, player, data in requests:
+            start = time.perf_counter()
+            double_auction.live_method(player, data)
+            request_seconds.append((name, time.perf_counter() - start))
+
+    failures = []
+    print('Loading oTree and apps: {:.3f} s (budget {:.3f} s)'.format(import_seconds, args.import_budget))
+    if import_seconds > args.import_budget:
+        failures.append('loading oTree and apps')
+    print('Heavy libraries loaded at startup: ' + (', '.join(heavy_modules) or 'none'))
+    if heavy_modules:
+        failures.append('heavy libraries loaded at startup')
+    for name, seconds in request_seconds:
+        print('{}: {:.3f} s (budget {:.3f} s)'.format(name, seconds, args.request_budget))
+        if seconds > args.request_budget:
+            failures.append(name)
+    if failures:
+        print('Startup budget exceeded: ' + ', '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
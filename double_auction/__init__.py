@@ -1,9 +1,26 @@
 from otree.api import *
+import asyncio
 import time
 from datetime import datetime
-import numpy as np
 import json  # Module to convert python dictionaries into JSON objects
+import math
 import sys
+import hashlib
+import bisect
+import functools
+from contextlib import contextmanager
+import os
+import pickle
+import secrets
+from array import array
+from collections import OrderedDict
+from otree.database import db
+from sqlalchemy import Index, event, func, or_, text
+from sqlalchemy.orm import Session as DatabaseSession, aliased
+from . import market_feed, price_history
+from .market_store import create_store
+from .participant_state import ParticipantStates, VarsState
+from .scheduler import TimerWheel
 
 
 def marginal_production_costs(t_1, t_2, t_3, min_mc, step, production_time):
@@ -36,15 +53,162 @@ def marginal_consumption_utility(t_1, t_2, t_3, max_mu, step, consumption_time):
     return u
 
 
+def marginal_cost_schedule(min_mc, step, production_time):
+    # Vectorized version of marginal_production_costs for all remaining production times used in the MC graph
+    import numpy as np  # NumPy is only needed when a session is created, importing it here keeps worker startup fast
+    x = np.arange(0, 3 * production_time, 1, dtype=float)
+    y = np.interp(x, [0, production_time, 2 * production_time], [min_mc, min_mc + step, min_mc + 2 * step])
+    return np.column_stack((x, y)).tolist()
+
+
+def marginal_utility_schedule(max_mu, step, consumption_time):
+    # Vectorized version of marginal_consumption_utility for all remaining consumption times used in the MU graph
+    import numpy as np
+    x = np.arange(0, 3 * consumption_time, 1, dtype=float)
+    y = np.interp(x, [0, consumption_time, 2 * consumption_time], [max_mu, max_mu - step, max_mu - 2 * step])
+    return np.column_stack((x, y)).tolist()
+
+
 # Define other general functions
 
 
-def flatten(list_of_lists):  # Python function to unlist lists
-    if len(list_of_lists) == 0:
-        return list_of_lists
-    if isinstance(list_of_lists[0], list):
-        return flatten(list_of_lists[0]) + flatten(list_of_lists[1:])
-    return list_of_lists[:1] + flatten(list_of_lists[1:])
+# The app reads the current time from app_clock. use_clock() runs it on another clock for a while, e.g. the bots of the
+# soak test on a simulated one (see tests.py), without touching the time and datetime modules.
+
+
+class SystemClock:
+
+    @staticmethod
+    def time():
+        return time.time()
+
+    @staticmethod
+    def today():
+        return datetime.today()
+
+
+app_clock = SystemClock()
+
+
+@contextmanager
+def use_clock(clock):  # clock needs time() and today() like SystemClock
+    global app_clock
+    previous, app_clock = app_clock, clock
+    try:
+        yield clock
+    finally:
+        app_clock = previous
+
+
+# Prices and money amounts are integers in cents, so that withdrawals match exactly and balances do not drift
+
+
+def to_cents(value):  # Amount entered by a participant or admin, e.g. "12.5", in cents
+    return int(round(float(value) * 100))
+
+
+def parse_cents(value):  # Price entered by a participant or admin in cents, None if it is not finite, e.g. "inf"
+    price = float(value)
+    return to_cents(price) if math.isfinite(price) else None
+
+
+def format_cents(cents):
+    return str('{:.2f}'.format(cents / 100))
+
+
+@functools.lru_cache(maxsize=None)
+def market_time(text):  # Timestamp of a date as written in the session config, e.g. '01 Aug 2022 09:00:00'
+    return time.mktime(time.strptime(text, "%d %b %Y %X"))
+
+
+# Market depth of one side of the book by price:
+#   depth    price in cents -> {id_in_group of trader: number of standing offers at this price}
+#   prices   prices with standing offers in ascending order, so that the best prices are found without sorting all
+#            price levels and the book stays small however wide the range between price floor and ceiling is
+
+
+def new_depth():
+    return dict(depth={}, prices=[])
+
+
+def add_to_depth(side, price, trader):  # Register a new standing offer
+    level = side['depth'].get(price)
+    if level is None:
+        level = side['depth'][price] = {}
+        bisect.insort(side['prices'], price)
+    level[trader] = level.get(trader, 0) + 1
+
+
+def remove_from_depth(side, price, trader):  # Unregister a standing offer that was traded or withdrawn
+    level = side['depth'].get(price)
+    if level is None or trader not in level:
+        return
+    level[trader] -= 1
+    if level[trader] == 0:
+        del level[trader]
+    if not level:
+        del side['depth'][price]
+        prices = side['prices']
+        del prices[bisect.bisect_left(prices, price)]
+
+
+def best_prices(side, count, highest_first):  # Prices of the best non-empty price levels, best first
+    prices = side['prices']
+    if highest_first:
+        return prices[:-count - 1:-1] if count else []
+    return prices[:count]
+
+
+def depth_ladder(side, levels, key, highest_first):  # Best price levels with total quantity and number of traders
+    depth = side['depth']
+    return [
+        {
+            key: format_cents(price),
+            "quantity": sum(depth[price].values()),
+            "traders": len(depth[price]),
+        }
+        for price in best_prices(side, levels, highest_first)
+    ]
+
+
+def record_trade(book, price, timestamp, seconds, buyer_tax, seller_tax):  # Update public trade statistics (in cents)
+    stats = book['stats']
+    stats['trades'] += 1
+    stats['turnover'] += price
+    stats['tax_revenue'] += buyer_tax + seller_tax
+    stats['highest_price'] = price if stats['highest_price'] is None else max(stats['highest_price'], price)
+    stats['lowest_price'] = price if stats['lowest_price'] is None else min(stats['lowest_price'], price)
+    book['recent_trades'].insert(0, {"price": format_cents(price),
+                                     "seconds": seconds,
+                                     "time": str(datetime.fromtimestamp(timestamp).ctime())})
+    del book['recent_trades'][C.SPECTATOR_TRADES:]
+
+
+def market_snapshot(session, book):  # Public market data shown to spectators
+    stats = book['stats']
+    return dict(
+        description=session.config['description'],
+        currency_unit=session.config['currency_unit'],
+        market_closing=session.config['market_closing'],
+        bids=depth_ladder(book['bids'], C.SPECTATOR_DEPTH, "bid", highest_first=True),
+        asks=depth_ladder(book['asks'], C.SPECTATOR_DEPTH, "ask", highest_first=False),
+        last_trades=book['recent_trades'],
+        trades=stats['trades'],
+        average_price=round(stats['turnover'] / stats['trades'] / 100, 2) if stats['trades'] else None,
+        highest_price=stats['highest_price'] / 100 if stats['trades'] else None,
+        lowest_price=stats['lowest_price'] / 100 if stats['trades'] else None,
+        tax_revenue=stats['tax_revenue'] / 100,
+        buyer_tax=round(session.buyer_tax * 100, 1),
+        seller_tax=round(session.seller_tax * 100, 1),
+        price_floor=session.price_floor,
+        price_ceiling=session.price_ceiling,
+        time=str(app_clock.today().ctime()),
+    )
+
+
+# Content hash of the chart bundle, appended to its URL so that browsers only refetch it after it has changed
+with open(os.path.join(os.path.dirname(__file__), os.pardir, '_static', 'global', 'charts.js'), 'rb') as f:
+    CHARTS_VERSION = hashlib.md5(f.read()).hexdigest()[:8]
 
 
 doc = "Double auction market"
@@ -60,6 +224,15 @@ class C(BaseConstants):
     # TIME_PER_UNIT = 600  # Time to produce/consume one unit is 10 minutes, i.e. 10*60=600 seconds
     MIN_TIMESTAMP = datetime(2000, 1, 1, 0, 0, 0, 0).timestamp()
     MAX_TIMESTAMP = datetime(3001, 1, 1, 0, 0, 0, 0).timestamp()
+    SPECTATOR_DEPTH = 10  # Number of price levels of asks and bids in the spectator feed
+    SPECTATOR_TRADES = 20  # Number of most recent trades in the spectator feed
+    EXPORT_CHUNK_SIZE = 500  # Number of players per query in custom_export
+    MAX_NOTIFICATIONS = 50  # Number of most recent notifications kept per participant, older ones are dropped
+    PRICE_SERIES_CACHE = 64  # Number of markets whose price series are kept in memory per process
+    REPORT_MINUTES = 60  # Number of most recent minutes with trades in the trading volume of the admin report
+    FOOTPRINT_INTERVAL = 60  # Seconds between two samples of the participant vars footprint
+    FOOTPRINT_SAMPLES = 240  # Number of most recent footprint samples kept for the admin report
+    FOOTPRINT_PARTICIPANTS = 20  # Number of participants whose vars are measured per footprint sample
 
 
 class Subsession(BaseSubsession):
@@ -67,77 +240,97 @@ class Subsession(BaseSubsession):
 
 
 def creating_session(subsession: Subsession):
+    import numpy as np
+    session = subsession.session
+    config = session.config
     players = subsession.get_players()
-    for p in players:
+    # Load all participants with one query instead of one lazy load per player
+    participants = {participant.id: participant for participant in session.get_participants()}
+    # Initialize session variables (once per session, not once per player)
+    session.buyer_tax = round(float(config['buyer_tax'] / 100), 3)
+    session.seller_tax = round(float(config['seller_tax'] / 100), 3)
+    session.price_floor = round(config['price_floor'], 2)
+    session.price_ceiling = round(config['price_ceiling'], 2)
+    session.vars_footprint = []
+    session.market_schedule = parse_market_schedule(config.get('market_schedule', ''),
+                                                    market_time(config['market_opening']))
+    session.schedule_position = 0  # Number of events of the schedule that have been applied
+    session.market_paused = False
+    session.spectator_token = secrets.token_urlsafe(16)  # Grants access to the spectator feed, see market_feed.py
+    # The first market epoch of each group starts with the parameters of the session config
+    for group in subsession.get_groups():
+        MarketEpoch.create(group=group, number=0, started=app_clock.time(), buyer_tax=session.buyer_tax,
+                           seller_tax=session.seller_tax, price_floor=session.price_floor,
+                           price_ceiling=session.price_ceiling)
+    # Randomize costs and utility functions of all players in one draw,
+    # set 'random_seed' in the session config to make a session reproducible
+    rng = np.random.default_rng(config.get('random_seed'))
+    min_mcs = rng.integers(low=config['lower_bound_minimum_mc'], high=config['upper_bound_minimum_mc'],
+                           size=len(players)).tolist()
+    max_mus = rng.integers(low=config['lower_bound_maximum_mu'], high=config['upper_bound_maximum_mu'],
+                           size=len(players)).tolist()
+    # Chart data only depends on min_mc/max_mu, so players with the same draw share one series
+    cost_chart_series = {}
+    utility_chart_series = {}
+    now = app_clock.time()
+    for p, min_mc, max_mu in zip(players, min_mcs, max_mus):
         # this means if the player's ID is a multiple of 2, they are a buyer.
         # for more buyers, change the 2 to 3
-        participant = p.participant
-        session = subsession.session
-        p.is_buyer = p.id_in_group % p.session.config['buyer_share'] == 0
+        p.is_buyer = p.id_in_group % config['buyer_share'] == 0
         p.is_admin = p.id_in_group == 1  # The first participant link is for admin use only!!!
         p.balance = 0
-        # Randomize costs and utility functions
-        p.min_mc = int(np.random.randint(
-            low=p.session.config['lower_bound_minimum_mc'],
-            high=p.session.config['upper_bound_minimum_mc'],
-            size=1, dtype=int
-        )[0])
-        p.max_mu = int(np.random.randint(
-            low=p.session.config['lower_bound_maximum_mu'],
-            high=p.session.config['upper_bound_maximum_mu'],
-            size=1, dtype=int)[0])
-        p.step_mu = p.session.config['mu_step_size']
-        p.step_mc = p.session.config['mc_step_size']
-        p.production_time = p.session.config['production_time']
-        p.consumption_time = p.session.config['consumption_time']
+        p.min_mc = min_mc
+        p.max_mu = max_mu
+        p.step_mu = config['mu_step_size']
+        p.step_mc = config['mc_step_size']
+        p.production_time = config['production_time']
+        p.consumption_time = config['consumption_time']
         p.current_offer_time = C.MAX_TIMESTAMP
         # Inherit market parameters from session configs
-        p.session_description = p.session.config['description']
-        p.currency_unit = p.session.config['currency_unit']
-        p.time_unit = 'seconds'  # p.session.config['time_unit']
-        p.market_opening = p.session.config['market_opening']
-        p.market_closing = p.session.config['market_closing']
+        p.session_description = config['description']
+        p.currency_unit = config['currency_unit']
+        p.time_unit = 'seconds'  # config['time_unit']
+        p.market_opening = config['market_opening']
+        p.market_closing = config['market_closing']
+        # Create data for the MU graph of buyers and the MC graph of sellers
         if p.is_buyer:
             p.current_offer = C.BID_MIN
-            participant.marginal_evaluation = marginal_consumption_utility(0, 0, 0, p.max_mu, p.step_mu,
-                                                                           p.consumption_time)
+            marginal_evaluation = marginal_consumption_utility(0, 0, 0, max_mu, p.step_mu, p.consumption_time)
+            if max_mu not in utility_chart_series:
+                utility_chart_series[max_mu] = pack_schedule(marginal_utility_schedule(max_mu, p.step_mu,
+                                                                                       p.consumption_time))
+            chart_series = utility_chart_series[max_mu]
         else:
             p.current_offer = C.ASK_MAX
-            participant.marginal_evaluation = marginal_production_costs(0, 0, 0, p.min_mc, p.step_mc, p.production_time)
-        # Initialize participant variables
-        participant.offers = []
-        participant.offer_times = []
-        participant.offer_history = []
-        participant.trading_history = []
-        participant.time_needed_1 = 0
-        participant.time_needed_2 = 0
-        participant.time_needed_3 = 0
-        participant.previous_timestamp = time.time()
-        participant.current_timestamp = time.time()
-        participant.error = None
-        participant.news = None
-        participant.notifications = []
-        # Initialize session variables
-        session.buyer_tax = round(float(p.session.config['buyer_tax'] / 100), 3)
-        session.seller_tax = round(float(p.session.config['seller_tax'] / 100), 3)
-        session.price_floor = round(p.session.config['price_floor'], 2)
-        session.price_ceiling = round(p.session.config['price_ceiling'], 2)
-        # Create data for MC/MU graphs
-        cost_x = np.arange(0, (3 * p.production_time + 1), 1)
-        cost_y = np.empty(shape=len(cost_x))
-        for x in range(0, len(cost_x) - 1):
-            cost_y[x] = marginal_production_costs(cost_x[x], 0, 0, p.min_mc, p.step_mc, p.production_time)
-        participant.cost_chart_series = np.array((cost_x, cost_y)).T[:-1].tolist()
-
-        utility_x = np.arange(0, (3 * p.consumption_time + 1), 1)
-        utility_y = np.empty(shape=len(utility_x))
-        for x in range(0, len(utility_x) - 1):
-            utility_y[x] = marginal_consumption_utility(utility_x[x], 0, 0, p.max_mu, p.step_mu, p.consumption_time)
-        participant.utility_chart_series = np.array((utility_x, utility_y)).T[:-1].tolist()
+            marginal_evaluation = marginal_production_costs(0, 0, 0, min_mc, p.step_mc, p.production_time)
+            if min_mc not in cost_chart_series:
+                cost_chart_series[min_mc] = pack_schedule(marginal_cost_schedule(min_mc, p.step_mc,
+                                                                                 p.production_time))
+            chart_series = cost_chart_series[min_mc]
+        # Initialize participant variables in bulk
+        participants[p.participant_id].vars.update(
+            marginal_evaluation=marginal_evaluation,
+            offer_times=pack_offers([]),
+            time_needed_1=0,
+            time_needed_2=0,
+            time_needed_3=0,
+            previous_timestamp=now,
+            current_timestamp=now,
+            error=None,
+            news=None,
+            notifications=[],
+            chart_series=chart_series,
+            market_epoch=0,
+        )
 
 
 class Group(BaseGroup):
     start_timestamp = models.IntegerField()
+    epoch = models.IntegerField(initial=0, doc="Number of the current market epoch, see MarketEpoch")
+    announced_epoch = models.IntegerField(initial=0, doc="Number of the last epoch announced to the players")
+    settled = models.BooleanField(initial=False, doc="Whether the payoffs have been set after market closing")
+    trades = models.IntegerField(doc="Number of trades, set at settlement")
+    tax_revenue = models.FloatField(doc="Taxes paid by buyers and sellers, set at settlement")
 
 
 class Player(BasePlayer):
@@ -150,694 +343,1176 @@ class Player(BasePlayer):
     is_buyer = models.BooleanField()
     current_offer = models.FloatField()
     current_offer_time = models.FloatField()
-    balance = models.FloatField()
+    balance = models.IntegerField(doc="Balance in cents")
     min_mc = models.FloatField()
     max_mu = models.FloatField()
     step_mc = models.FloatField()
     step_mu = models.FloatField()
     production_time = models.FloatField()
     consumption_time = models.FloatField()
+    trades = models.IntegerField(doc="Number of trades of this player, set at settlement")
+
+
+class MarketEpoch(ExtraModel):  # Market parameters of a group from one market update to the next
+    group = models.Link(Group)
+    number = models.IntegerField(doc="Number of market updates before this epoch, 0 at market opening")
+    started = models.FloatField(doc="Timestamp of the market update that started this epoch")
+    buyer_tax = models.FloatField(doc="Buyers pay this share of the trading price in taxes")
+    seller_tax = models.FloatField(doc="Sellers pay this share of the trading price in taxes.")
+    price_floor = models.FloatField(doc="Buyers are not allowed to bid lower than the price floor.")
+    price_ceiling = models.FloatField(doc="Sellers are not allowed to ask higher than the price ceiling.")
 
 
 class Transaction(ExtraModel):
+    # Indexes for the common filters, i.e. by group and time, by buyer and by seller. The columns of links are only
+    # added when the mappers are configured, so the indexes name them as text.
+    __table_args__ = (
+        Index('ix_double_auction_transaction_group_seconds', text('group_id'), text('seconds')),
+        Index('ix_double_auction_transaction_buyer', text('buyer_id')),
+        Index('ix_double_auction_transaction_seller', text('seller_id')),
+    )
     group = models.Link(Group)
     buyer = models.Link(Player)
     seller = models.Link(Player)
-    price = models.FloatField(doc="Price of this trade, excl. any taxes, i.e. amount of money exchanged between buyer"
-                                  " and seller")
+    epoch = models.Link(MarketEpoch)  # Taxes and price limits that applied to this trade
+    price = models.IntegerField(doc="Price of this trade in cents, excl. any taxes, i.e. amount of money exchanged "
+                                    "between buyer and seller")
     buyer_valuation = models.FloatField(doc="Buyer's valuation of the item purchased (i.e. marginal utility)")
     seller_costs = models.FloatField(doc="Seller's production cost of the item purchased (i.e. marginal costs)")
-    buyer_profits = models.FloatField(doc="Buyer's profit from this trade (if <0 then loss)")
-    seller_profits = models.FloatField(doc="Seller's profit from this trade (if <0 then loss)")
-    buyer_balance = models.FloatField(doc="Buyer's new balance after this trade")
-    seller_balance = models.FloatField(doc="Seller's new balance after this trade")
+    buyer_tax_paid = models.IntegerField(doc="Tax paid by the buyer on this trade in cents")
+    seller_tax_paid = models.IntegerField(doc="Tax paid by the seller on this trade in cents")
+    buyer_profits = models.IntegerField(doc="Buyer's profit from this trade in cents (if <0 then loss)")
+    seller_profits = models.IntegerField(doc="Seller's profit from this trade in cents (if <0 then loss)")
+    buyer_balance = models.IntegerField(doc="Buyer's new balance after this trade in cents")
+    seller_balance = models.IntegerField(doc="Seller's new balance after this trade in cents")
     seconds = models.IntegerField(doc="Timestamp (seconds since market opening)")
+    timestamp = models.FloatField(doc="Timestamp of this trade")
     description = models.StringField(doc="Description/Name of the Market given by experimenter")
-    buyer_tax = models.FloatField(doc="Buyers paid this share of the trading price in taxes")
-    seller_tax = models.FloatField(doc="Sellers paid this share of the trading price in taxes.")
-    price_floor = models.FloatField(doc="Buyers are not allowed to bid lower than the price floor.")
-    price_ceiling = models.FloatField(doc="Sellers are not allowed to ask higher than the price ceiling.")
 
 
-def find_match(buyers, sellers):
-    for buyer in buyers:
-        for seller in sellers:
-            if seller.current_offer <= buyer.current_offer:
-                # return as soon as we find a match (the rest of the loop will be skipped)
-                return [buyer, seller]
+# Aggregate queries on Transaction, computed by the database instead of loading every trade into Python
+
+
+def profit_totals(group):  # Number of trades and net profit per player (by id_in_group)
+    totals = {}
+    for trader_id, profits in [(Transaction.buyer_id, Transaction.buyer_profits),
+                               (Transaction.seller_id, Transaction.seller_profits)]:
+        rows = db.query(Player.id_in_group, func.count(Transaction.id), func.sum(profits)) \
+            .select_from(Transaction) \
+            .join(Player, trader_id == Player.id) \
+            .filter(Transaction.group_id == group.id) \
+            .group_by(Player.id_in_group)
+        for id_in_group, trades, profit in rows:
+            totals[id_in_group] = dict(trades=trades, profit=profit / 100)
+    return totals
+
+
+def volume_per_minute(group, limit=None):  # Number of trades and average price per minute since market opening
+    # Only minutes with trades are returned, the last limit of them if a limit is given
+    minute = Transaction.seconds - Transaction.seconds % 60
+    rows = db.query(minute, func.count(Transaction.id), func.avg(Transaction.price)) \
+        .filter(Transaction.group_id == group.id) \
+        .group_by(minute) \
+        .order_by(minute.desc()) \
+        .limit(limit)
+    return [dict(minute=start // 60, trades=trades, average_price=round(average_price / 100, 2))
+            for start, trades, average_price in reversed(rows.all())]
+
+
+def settle_market(group):  # Set the payoffs of all players of a group at once, when the first player leaves the market
+    if group.settled:
+        return
+    totals = profit_totals(group)
+    for p in group.get_players():
+        p.payoff = p.balance / 100
+        p.trades = totals.get(p.id_in_group, dict(trades=0))['trades']
+    taxes = tax_revenue(group)
+    group.trades = taxes['trades']
+    group.tax_revenue = taxes['total']
+    group.settled = True
+
+
+def tax_revenue(group):  # Taxes paid by buyers and sellers over all trades
+    trades, buyer_taxes, seller_taxes = db.query(
+        func.count(Transaction.id),
+        func.sum(Transaction.buyer_tax_paid),
+        func.sum(Transaction.seller_tax_paid),
+    ).filter(Transaction.group_id == group.id).one()
+    buyer_taxes = (buyer_taxes or 0) / 100
+    seller_taxes = (seller_taxes or 0) / 100
+    return dict(trades=trades, buyer_taxes=buyer_taxes, seller_taxes=seller_taxes, total=buyer_taxes + seller_taxes)
+
+
+# Hot market state of a group (order book, balances, production/consumption clocks) lives in a market store, see
+# market_store.py. live_method only loads the players a message is about instead of the whole group.
+market_store_instance = None
+
+
+def get_market_store():  # Store of this process, spectator snapshots published by any process reach its feed
+    global market_store_instance
+    if market_store_instance is None:
+        market_store_instance = create_store()
+        market_store_instance.load = reload_market
+        market_feed.register_routes()
+        market_store_instance.subscribe('market_feed', lambda message: market_feed.publish(*message))
+    return market_store_instance
+
+
+def market_key(group):
+    return group.session.code + ':' + str(group.id_in_subsession)
+
+
+# Order book of a group:
+#   offers                 id_in_group -> standing offers [(price in cents, timestamp), ...], best offer first
+#   bids, asks             market depth by price (see add_to_depth)
+#   epoch                  market epoch the standing offers belong to (see epoch_parameters)
+#   buyers, sellers        id_in_group of buyers/sellers in the order in which counterparties are searched
+#   stats, recent_trades   public trade statistics (see record_trade)
+
+
+def new_book(buyers, sellers, epoch):
+    return dict(offers={}, bids=new_depth(), asks=new_depth(), epoch=epoch,
+                buyers=buyers, sellers=sellers,
+                stats=dict(trades=0, turnover=0, tax_revenue=0, highest_price=None, lowest_price=None),
+                recent_trades=[])
+
+
+def best_offer(book, trader, is_buyer):  # (price, timestamp) of the best standing offer of a trader
+    offers = book['offers'].get(trader)
+    if offers:
+        return offers[0]
+    if is_buyer:
+        return C.BID_MIN, C.MAX_TIMESTAMP
+    return C.ASK_MAX, C.MAX_TIMESTAMP
+
+
+def submit_offer(book, trader, is_buyer, price, timestamp):
+    # Add an offer and execute a trade with the first crossing counterparty (by id_in_group), if there is one.
+    # Returns the matched (buyer, seller, price) or None.
+    offers = book['offers'].setdefault(trader, [])
+    offers.append((price, timestamp))
+    offers.sort(key=lambda x: x[0], reverse=is_buyer)  # Sort such that the best offer is the first list element
+    # The best price level of the other side tells in O(1) whether any counterparty crosses, only then the
+    # counterparties are searched in id order
+    if is_buyer:
+        add_to_depth(book['bids'], price, trader)
+        best_ask = best_prices(book['asks'], 1, highest_first=False)
+        if not best_ask or best_ask[0] > offers[0][0]:
+            return None
+        buyer = trader
+        seller = next(s for s in book['sellers'] if best_offer(book, s, False)[0] <= offers[0][0])
+    else:
+        add_to_depth(book['asks'], price, trader)
+        best_bid = best_prices(book['bids'], 1, highest_first=True)
+        if not best_bid or best_bid[0] < offers[0][0]:
+            return None
+        seller = trader
+        buyer = next(b for b in book['buyers'] if offers[0][0] <= best_offer(book, b, True)[0])
+    bid = book['offers'][buyer][0]
+    ask = book['offers'][seller][0]
+    # The earlier of both offers determines the price
+    if bid[1] < ask[1]:
+        trade_price = bid[0]
+    else:
+        trade_price = ask[0]
+    # Delete bids/asks of effected trade from bid/ask cue
+    remove_from_depth(book['bids'], bid[0], buyer)
+    remove_from_depth(book['asks'], ask[0], seller)
+    book['offers'][buyer] = book['offers'][buyer][1:]
+    book['offers'][seller] = book['offers'][seller][1:]
+    return buyer, seller, trade_price
+
+
+def price_limit_violation(is_buyer, price, price_floor, price_ceiling):
+    # Notification key if an offer (in cents) is outside the price limits of the market, otherwise None
+    if is_buyer and price < to_cents(price_floor):
+        return 'bid_below_floor'
+    elif is_buyer and price > to_cents(price_ceiling):
+        return 'bid_above_ceiling'
+    elif not is_buyer and price > to_cents(price_ceiling):
+        return 'ask_above_ceiling'
+    elif not is_buyer and price < to_cents(price_floor):
+        return 'ask_below_floor'
+    return None
+
+
+def trade_taxes(epoch, price):  # Taxes charged to the buyer and the seller of a trade, rounded to cents
+    return round(epoch['buyer_tax'] * price), round(epoch['seller_tax'] * price)
+
+
+def trade_profits(epoch, buyer_evaluation, seller_evaluation, price):  # Profits in cents
+    buyer_tax, seller_tax = trade_taxes(epoch, price)
+    buyer_profits = to_cents(buyer_evaluation) - price - buyer_tax
+    seller_profits = price - to_cents(seller_evaluation) - seller_tax
+    return buyer_profits, seller_profits
+
+
+def withdraw_offer(book, trader, is_buyer, price):  # Remove one standing offer at this price, if there is one
+    offers = book['offers'].get(trader, [])
+    if price in [i[0] for i in offers]:
+        del offers[([i[0] for i in offers]).index(price)]
+        remove_from_depth(book['bids'] if is_buyer else book['asks'], price, trader)
+
+
+# Market epochs: every market update that changes taxes or price limits starts a new epoch of the group's market.
+# The book is swapped for an empty one at once. The standing offers in the participant vars of the old epoch are
+# dropped, and the news on the market updates added, only when a player is next involved in a message (see
+# catch_up_epoch), so a market update does not load and save every participant.
+
+
+def epoch_parameters(epoch):  # MarketEpoch as kept in the book
+    return dict(id=epoch.id, number=epoch.number, buyer_tax=epoch.buyer_tax, seller_tax=epoch.seller_tax,
+                price_floor=epoch.price_floor, price_ceiling=epoch.price_ceiling)
+
+
+def current_epoch(group):
+    return db.query(MarketEpoch).filter(MarketEpoch.group_id == group.id, MarketEpoch.number == group.epoch).one()
+
+
+def start_market_epoch(group, session):  # New epoch of a group with the current market parameters of the session
+    epoch = MarketEpoch.create(group=group, number=group.epoch + 1, started=app_clock.time(),
+                               buyer_tax=session.buyer_tax, seller_tax=session.seller_tax,
+                               price_floor=session.price_floor, price_ceiling=session.price_ceiling)
+    db._db.flush()  # Assigns epoch.id
+    group.epoch = epoch.number
+    get_market(group).update_book(market_key(group), lambda book: start_epoch(book, epoch_parameters(epoch)))
+    return epoch
+
+
+def start_epoch(book, epoch):  # Delete all standing asks and bids
+    book['epoch'] = epoch
+    book['offers'] = {}
+    book['bids'] = new_depth()
+    book['asks'] = new_depth()
+
+
+def epoch_news(previous, epoch):  # Arguments of market_update_news for the market update that started an epoch
+    new_market_params = [previous.buyer_tax != epoch.buyer_tax, previous.seller_tax != epoch.seller_tax,
+                         previous.price_floor != epoch.price_floor, previous.price_ceiling != epoch.price_ceiling]
+    data = dict(buyer_tax_admin=str(round(epoch.buyer_tax * 100, 1)),
+                seller_tax_admin=str(round(epoch.seller_tax * 100, 1)),
+                price_floor_admin=str(epoch.price_floor),
+                price_ceiling_admin=str(epoch.price_ceiling))
+    return new_market_params, data
+
+
+def catch_up_epoch(participants, p):  # Bring the participant vars of a player to the current epoch of its group
+    participant = participants[p]
+    if participant.market_epoch == p.group.epoch:
+        return
+    epochs = db.query(MarketEpoch) \
+        .filter(MarketEpoch.group_id == p.group.id, MarketEpoch.number >= participant.market_epoch) \
+        .order_by(MarketEpoch.number).all()
+    for previous, epoch in zip(epochs, epochs[1:]):
+        notify(participant, 'market_news', *epoch_news(previous, epoch), timestamp=epoch.started)
+    participant.offer_times = pack_offers([])
+    participant.market_epoch = p.group.epoch
+    set_current_offer(p, [])
+
+
+# Clocks of a group, i.e. id_in_group -> remaining production/consumption times, marginal evaluation and the
+# parameters needed to update them. They are copied to the participant vars of the players a message is about.
+
+
+def new_clock(p, participant):
+    return dict(
+        is_buyer=p.is_buyer,
+        is_admin=p.is_admin,
+        min_mc=p.min_mc,
+        max_mu=p.max_mu,
+        step_mc=p.step_mc,
+        step_mu=p.step_mu,
+        production_time=p.production_time,
+        consumption_time=p.consumption_time,
+        time_needed_1=participant.time_needed_1,
+        time_needed_2=participant.time_needed_2,
+        time_needed_3=participant.time_needed_3,
+        previous_timestamp=participant.previous_timestamp,
+        current_timestamp=participant.current_timestamp,
+        marginal_evaluation=participant.marginal_evaluation,
+    )
+
+
+def advance_clocks(clocks, now):  # Update remaining time needed for production/consumption of all players
+    for c in clocks.values():
+        c['current_timestamp'] = now
+        if c['time_needed_1'] <= 1:
+            if c['is_buyer']:
+                c['time_needed_1'] += min(c['time_needed_2'], c['consumption_time'])
+                c['time_needed_2'] -= c['time_needed_1']
+            elif c['is_buyer'] == 0 and c['is_admin'] != 1:
+                c['time_needed_1'] += min(c['time_needed_2'], c['production_time'])
+                c['time_needed_2'] -= c['time_needed_1']
+        if c['time_needed_2'] <= 1:
+            if c['is_buyer']:
+                c['time_needed_2'] += min(c['time_needed_3'], c['consumption_time'])
+                c['time_needed_3'] -= c['time_needed_2']
+            elif c['is_buyer'] == 0 and c['is_admin'] != 1:
+                c['time_needed_2'] += min(c['time_needed_3'], c['production_time'])
+                c['time_needed_3'] -= c['time_needed_2']
+
+        c['time_needed_1'] = round(max(0, c['time_needed_1'] - (c['current_timestamp'] - c['previous_timestamp'])), 0)
+        c['time_needed_2'] = round(max(0, c['time_needed_2'] - (c['current_timestamp'] - c['previous_timestamp'])), 0)
+        c['time_needed_3'] = round(max(0, c['time_needed_3'] - (c['current_timestamp'] - c['previous_timestamp'])), 0)
+        c['previous_timestamp'] = c['current_timestamp']
+        # Update marginal utility/costs
+        if c['is_buyer']:
+            c['marginal_evaluation'] = marginal_consumption_utility(c['time_needed_1'], c['time_needed_2'],
+                                                                    c['time_needed_3'], c['max_mu'], c['step_mu'],
+                                                                    c['consumption_time'])
+        elif c['is_buyer'] == 0 and c['is_admin'] != 1:
+            c['marginal_evaluation'] = marginal_production_costs(c['time_needed_1'], c['time_needed_2'],
+                                                                 c['time_needed_3'], c['min_mc'], c['step_mc'],
+                                                                 c['production_time'])
+
+
+def add_traded_units(clocks, buyer, seller):  # Update remaining time needed for production/consumption after a trade
+    # For buyers
+    b = clocks[buyer]
+    if b['time_needed_1'] == 0:
+        b['time_needed_1'] += b['consumption_time']
+    elif b['time_needed_2'] == 0:
+        b['time_needed_2'] += b['consumption_time']
+    else:
+        b['time_needed_3'] += b['consumption_time']
+    # For sellers
+    s = clocks[seller]
+    if s['time_needed_1'] == 0:
+        s['time_needed_1'] += s['production_time']
+    elif s['time_needed_2'] == 0:
+        s['time_needed_2'] += s['consumption_time']
+    else:
+        s['time_needed_3'] += s['production_time']
+
+
+CLOCK_FIELDS = ['time_needed_1', 'time_needed_2', 'time_needed_3', 'previous_timestamp', 'current_timestamp',
+                'marginal_evaluation']
+
+
+def save_clock(participant, clock):  # Copy the clock of a player into its participant vars
+    participant.time_needed_1 = clock['time_needed_1']
+    participant.time_needed_2 = clock['time_needed_2']
+    participant.time_needed_3 = clock['time_needed_3']
+    participant.previous_timestamp = clock['previous_timestamp']
+    participant.current_timestamp = clock['current_timestamp']
+    participant.marginal_evaluation = clock['marginal_evaluation']
+
+
+def load_market(store, group):
+    # Rebuild the market state of a group from the database, e.g. after a restart of the in-process store.
+    # Clocks may be older than the last time update, the next time update catches up with the elapsed time.
+    players = group.get_players()
+    book = new_book(buyers=[p.id_in_group for p in players if p.is_buyer],
+                    sellers=[p.id_in_group for p in players if not p.is_buyer and p.is_admin != 1],
+                    epoch=epoch_parameters(current_epoch(group)))
+    clocks = {}
+    for p in players:
+        participant = VarsState(p.participant)  # Read only, so the participant vars are not saved again
+        # Offers of an older epoch are no longer standing, they are dropped when the player is next involved
+        offers = unpack_offers(participant.offer_times) if participant.market_epoch == group.epoch else []
+        for price, timestamp in offers:
+            book['offers'].setdefault(p.id_in_group, []).append((price, timestamp))
+            add_to_depth(book['bids'] if p.is_buyer else book['asks'], price, p.id_in_group)
+        clocks[p.id_in_group] = new_clock(p, participant)
+    trades, turnover, taxes, highest, lowest = db.query(
+        func.count(Transaction.id),
+        func.sum(Transaction.price),
+        func.sum(Transaction.buyer_tax_paid + Transaction.seller_tax_paid),
+        func.max(Transaction.price),
+        func.min(Transaction.price),
+    ).filter(Transaction.group_id == group.id).one()
+    book['stats'] = dict(trades=trades, turnover=turnover or 0, tax_revenue=taxes or 0,
+                         highest_price=highest, lowest_price=lowest)
+    recent = db.query(Transaction).filter(Transaction.group_id == group.id) \
+        .order_by(Transaction.id.desc()).limit(C.SPECTATOR_TRADES)
+    book['recent_trades'] = [{"price": format_cents(tx.price),
+                              "seconds": tx.seconds,
+                              "time": str(datetime.fromtimestamp(tx.timestamp).ctime())}
+                             for tx in recent]
+    store.load_market(market_key(group), book, {p.id_in_group: p.balance for p in players}, clocks)
+
+
+def get_market(group):  # Market store with the state of this group loaded
+    store = get_market_store()
+    if not store.has_market(market_key(group)):
+        load_market(store, group)
+    return store
+
+
+def reload_market(market):  # Load a market that is missing from the store, e.g. dropped by another process
+    from otree.models import Session
+    code, id_in_subsession = market.rsplit(':', 1)
+    group = db.query(Group).join(Session, Group.session_id == Session.id) \
+        .filter(Session.code == code, Group.id_in_subsession == int(id_in_subsession)).one()
+    load_market(get_market_store(), group)
+
+
+# The store is changed before the database transaction of a request commits. If the transaction is rolled back, the
+# markets this process has changed in it are dropped from the store, so that they are rebuilt from the database when
+# they are next used. Markets that were only read stay, so that other processes sharing the store keep them.
+
+
+@event.listens_for(DatabaseSession, 'after_commit')
+def keep_markets(session):
+    if market_store_instance is not None:
+        market_store_instance.changed_markets.clear()
+
+
+@event.listens_for(DatabaseSession, 'after_soft_rollback')
+def drop_markets(session, previous_transaction):
+    if market_store_instance is None:
+        return
+    for market in list(market_store_instance.changed_markets):
+        market_store_instance.drop_market(market)
+        price_series_cache.pop(market, None)
+    market_store_instance.changed_markets.clear()
+
+
+def set_current_offer(p, offers):  # Best standing offer of a player, or the placeholder if there is none
+    if len(offers) >= 1:
+        p.current_offer = offers[0][0] / 100
+        p.current_offer_time = offers[0][1]
+    elif p.is_buyer:
+        p.current_offer = C.BID_MIN
+        p.current_offer_time = C.MAX_TIMESTAMP
+    else:
+        p.current_offer = C.ASK_MAX
+        p.current_offer_time = C.MAX_TIMESTAMP
+
+
+def offer_history(offers, currency_unit):  # Current offer history, i.e. still standing offers
+    return [{"offer": format_cents(x[0]) + " " + currency_unit,
+             "offer_time": datetime.fromtimestamp(x[1]).ctime()}
+            for x in offers]
+
+
+def trading_history(player, currency_unit, limit=None):  # Trades of a player, newest first, read from Transaction
+    history = []
+    for tx, epoch in db.query(Transaction, MarketEpoch) \
+            .join(MarketEpoch, Transaction.epoch_id == MarketEpoch.id) \
+            .filter(or_(Transaction.buyer_id == player.id, Transaction.seller_id == player.id)) \
+            .order_by(Transaction.id.desc()) \
+            .limit(limit):
+        if tx.buyer_id == player.id:
+            profit = tx.buyer_profits
+        else:
+            profit = tx.seller_profits
+        history.append({"price": format_cents(tx.price) + " " + currency_unit,
+                        "time": str(datetime.fromtimestamp(tx.timestamp).ctime()),
+                        "tax_on_buyer": str(epoch.buyer_tax * 100) + " %",
+                        "tax_on_seller": str(epoch.seller_tax * 100) + " %",
+                        "price_floor": str('{:.2f}'.format(round(epoch.price_floor, 2))) + " " + currency_unit,
+                        "price_ceiling": str('{:.2f}'.format(round(epoch.price_ceiling, 2))) + " " + currency_unit,
+                        "profit_from_trade": format_cents(profit) + " " + currency_unit,
+                        })
+    return history
+
+
+# Price series of the markets for the price chart (see price_history.py). Each process keeps the series of the
+# PRICE_SERIES_CACHE markets whose charts were requested last, with the number of trades they contain. Trades matched
+# in this process are added as they happen; if the count of the market's book differs (trades of other processes, a
+# rolled back trade) or the market is not cached, the series is rebuilt from the Transaction table.
+price_series_cache = OrderedDict()  # Market key -> (number of trades, PriceSeries), least recently used first
+
+
+def add_price_tick(group, trades, seconds, price):  # Trade number trades of the market, price in cents
+    market = market_key(group)
+    if market in price_series_cache and price_series_cache[market][0] == trades - 1:
+        series = price_series_cache[market][1]
+        series.add(seconds, price)
+        price_series_cache[market] = (trades, series)
+
+
+def price_series(group, trades, zoom):  # Price chart of a group at a zoom level, prices in currency units
+    market = market_key(group)
+    if market in price_series_cache and price_series_cache[market][0] == trades:
+        series = price_series_cache[market][1]
+        price_series_cache.move_to_end(market)
+    else:
+        series = price_history.PriceSeries()
+        trades = 0
+        for seconds, price in db.query(Transaction.seconds, Transaction.price) \
+                .filter(Transaction.group_id == group.id) \
+                .order_by(Transaction.seconds, Transaction.id):
+            series.add(seconds, price)
+            trades += 1
+        price_series_cache[market] = (trades, series)
+        if len(price_series_cache) > C.PRICE_SERIES_CACHE:
+            price_series_cache.popitem(last=False)
+    if zoom in price_history.RESOLUTIONS:
+        return dict(zoom=zoom, max_values=price_history.MAX_VALUES[zoom], resolution=price_history.RESOLUTIONS[zoom],
+                    candles=[[start] + [price / 100 for price in prices] + [trades]
+                             for start, *prices, trades in series.zoom(zoom)])
+    return dict(zoom=zoom, max_values=price_history.MAX_VALUES[zoom],
+                points=[[seconds, price / 100] for seconds, price in series.zoom(zoom)])
+
+
+# Compact participant vars, so that the participant rows stay small in long markets:
+#   offer_times and the MC/MU schedules are packed into arrays of floats
+#   notifications only keep a template key, its arguments and a timestamp, the sentences are created when sending
+
+
+def pack_offers(offers):  # [(price in cents, timestamp), ...] -> array of price, timestamp, price, timestamp, ...
+    return array('d', [x for offer in offers for x in offer])
+
+
+def unpack_offers(packed):
+    return [(int(price), timestamp) for price, timestamp in zip(packed[0::2], packed[1::2])]
+
+
+def pack_schedule(series):  # Marginal costs/utilities at 0, 1, 2, ... seconds of remaining production/consumption
+    return array('d', [y for x, y in series])
+
+
+def unpack_schedule(packed):  # Points of the MC/MU graph
+    return [[float(x), y] for x, y in enumerate(packed)]
+
+
+NOTIFICATIONS = {
+    'bid_below_floor': ("You are not allowed to bid below the price floor.", "error"),
+    'bid_above_ceiling': ("You are not allowed to bid above the price ceiling.", "error"),
+    'ask_above_ceiling': ("You are not allowed to ask above the price ceiling.", "error"),
+    'ask_below_floor': ("You are not allowed to ask below the price floor.", "error"),
+    'market_not_open': ("The market is not open.", "error"),
+    'invalid_number': ("Please enter a valid number.", "error"),
+    'bought': ("You bought one unit at price {0:.2f} {currency_unit}", "news"),
+    'sold': ("You sold one unit at price {0:.2f} {currency_unit}", "news"),
+    'bought_from': ("You bought one unit at price {0:.2f} {currency_unit} from Seller {1}", "news"),
+    'sold_to': ("You sold one unit at price {0:.2f} {currency_unit} to Buyer {1}", "news"),
+    # 'market_news' is created by market_update_news
+}
+
+
+def notify(participant, key, *args, timestamp=None):  # Add a notification, newest first, keep the most recent ones
+    notification = (key, args, timestamp or app_clock.time())
+    participant.notifications = [notification] + participant.notifications[:C.MAX_NOTIFICATIONS - 1]
+
+
+def render_notifications(notifications, currency_unit):
+    rendered = []
+    for key, args, timestamp in notifications:
+        if key == 'market_news':
+            message = market_update_news(*args, currency_unit)['message']
+            kind = 'market_news'
+        else:
+            template, kind = NOTIFICATIONS[key]
+            message = template.format(*args, currency_unit=currency_unit)
+        rendered.append({"message": message, "time": str(datetime.fromtimestamp(timestamp).ctime()), "type": kind})
+    return rendered
+
+
+def vars_footprint(participant):  # Pickled size in bytes of each participant var
+    # Reads participant._vars, because participant.vars marks the vars as changed and would make oTree save them
+    return {field: len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) for field, value in participant._vars.items()}
+
+
+def record_footprint(session):  # Sample the participant vars footprint of a session, at most once per interval
+    # A sample is taken during a time update of the admin page, so it only measures FOOTPRINT_PARTICIPANTS
+    # participants, the next ones by id_in_session for every interval, instead of loading the whole session
+    from otree.models import Participant
+    samples = session.vars_footprint
+    now = app_clock.time()
+    if samples and now - samples[-1]['timestamp'] < C.FOOTPRINT_INTERVAL:
+        return
+    count = session.num_participants
+    start = int(now // C.FOOTPRINT_INTERVAL) * C.FOOTPRINT_PARTICIPANTS
+    ids = {(start + i) % count + 1 for i in range(min(C.FOOTPRINT_PARTICIPANTS, count))}
+    sizes = {}
+    for participant in db.query(Participant).filter(Participant.session_id == session.id,
+                                                    Participant.id_in_session.in_(ids)):
+        for field, size in vars_footprint(participant).items():
+            sizes.setdefault(field, []).append(size)
+    sample = dict(timestamp=now, fields={field: [round(sum(values) / len(values)), max(values)]
+                                         for field, values in sizes.items()})
+    session.vars_footprint = (samples + [sample])[-C.FOOTPRINT_SAMPLES:]
+
+
+MARKET_UPDATE_FIELDS = ['buyer_tax_admin', 'seller_tax_admin', 'price_floor_admin', 'price_ceiling_admin']
+
+
+def market_update_news(new_market_params, data, currency_unit):
+    # Message on a market update, new_market_params tells which of buyer tax, seller tax, price floor and price
+    # ceiling have changed, data holds their new values as sent by the admin
+    if new_market_params == [True, False, False, False]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 1)) + " %. All standing bids and asks have "
+                                                                      "been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [False, True, False, False]:
+        market_news = dict(
+            message="A market intervention took place! The tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1)) + " %. All standing bids and asks have"
+                                                                       " been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [False, False, True, False]:
+        market_news = dict(
+            message="A market intervention took place! The price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [False, False, False, True]:
+        market_news = dict(
+            message="A market intervention took place! The price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [True, True, False, False]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 1))
+                    + " % and the tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1)) + " %. All standing bids and asks have"
+                                                                       " been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [True, False, True, False]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 1))
+                    + " % and the price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [True, False, False, True]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 1))
+                    + " % and the price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [False, True, True, False]:
+        market_news = dict(
+            message="A market intervention took place! The tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1))
+                    + " % and the price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [False, True, False, True]:
+        market_news = dict(
+            message="A market intervention took place! The tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1))
+                    + " % and the price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [False, False, True, True]:
+        market_news = dict(
+            message="A market intervention took place! The price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit
+                    + " and the price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [True, True, True, False]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 1))
+                    + " %, the tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1))
+                    + " % and the price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [True, False, True, True]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 1))
+                    + " %, the price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit
+                    + " and the price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [True, True, False, True]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 1))
+                    + " %, the tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1))
+                    + " % and the price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [False, True, True, True]:
+        market_news = dict(
+            message="A market intervention took place! The tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1))
+                    + " %, the price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit
+                    + " and the price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    elif new_market_params == [True, True, True, True]:
+        market_news = dict(
+            message="A market intervention took place! The tax on buyers has changed to "
+                    + str(round(float(data['buyer_tax_admin']), 11))
+                    + " %, the tax on sellers has changed to "
+                    + str(round(float(data['seller_tax_admin']), 1))
+                    + " %, the price floor has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
+                    + currency_unit
+                    + " and the price ceiling has changed to "
+                    + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
+                    + currency_unit + ". All standing bids and asks have been deleted.",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    else:
+        market_news = dict(
+            message="The market has been updated",
+            time=str(app_clock.today().ctime()),
+            type="market_news"
+        )
+    return market_news
+
+
+# Market schedule: events of the session config market_schedule that change the market at set times, e.g.
+#   market_schedule='+3600 -> buyer_tax=10, price_floor=5; 02 Aug 2022 12:00:00 -> pause; +90000 -> resume'
+# Times are seconds after market opening (+...) or dates as for market_opening, taxes are given in percent. Events
+# that are due together are applied as one market update. The schedule and the number of applied events are kept in
+# the session, so a restarted process puts the remaining events into its timer wheel again and events that were
+# missed in the meantime are applied at once.
+SCHEDULE_PARAMETERS = {
+    'buyer_tax': lambda value: round(float(value) / 100, 3),
+    'seller_tax': lambda value: round(float(value) / 100, 3),
+    'price_floor': lambda value: round(float(value), 2),
+    'price_ceiling': lambda value: round(float(value), 2),
+}
+
+
+def parse_market_schedule(text, market_opening):  # Events sorted by time, raises ValueError for invalid entries
+    events = []
+    for entry in filter(None, (entry.strip() for entry in text.split(';'))):
+        when, _, actions = (part.strip() for part in entry.partition('->'))
+        event = dict(time=market_opening + float(when[1:]) if when.startswith('+') else market_time(when),
+                     parameters={}, paused=None)
+        for action in actions.replace(',', ' ').split():
+            name, _, value = action.partition('=')
+            if action in ['pause', 'resume']:
+                event['paused'] = action == 'pause'
+            elif name in SCHEDULE_PARAMETERS and value:
+                event['parameters'][name] = SCHEDULE_PARAMETERS[name](value)
+            else:
+                raise ValueError("Invalid action in market_schedule: " + action)
+        if not event['parameters'] and event['paused'] is None:
+            raise ValueError("No action in market_schedule entry: " + entry)
+        events.append(event)
+    return sorted(events, key=lambda event: event['time'])
+
+
+scheduler_instance = None
+scheduled_sessions = set()  # Codes of the sessions whose pending events are in the timer wheel of this process
+
+
+def get_scheduler():
+    global scheduler_instance
+    if scheduler_instance is None:
+        scheduler_instance = TimerWheel()
+    return scheduler_instance
+
+
+def schedule_market_events(session):
+    # Called on every request of the trading page. Due events are applied right away, in the database transaction of
+    # the request. Once per process, called from a live message, the pending events are also put into the timer wheel,
+    # whose thread hands them over to the event loop when they are due (oTree has one database session, which must not
+    # be used from other threads), so they also take effect while nobody sends a message.
+    apply_market_schedule(session, app_clock.time())
+    if session.code in scheduled_sessions:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:  # Not on the event loop, e.g. in vars_for_template or in bots
+        return
+    scheduled_sessions.add(session.code)
+    state = VarsState(session)
+    code = session.code
+    for event in state.market_schedule[state.schedule_position:]:
+        get_scheduler().schedule(event['time'],
+                                 lambda: asyncio.run_coroutine_threadsafe(run_market_schedule(code), loop))
+
+
+async def run_market_schedule(session_code):  # Runs on the event loop in a database transaction of its own
+    from otree.database import session_scope
+    from otree.middleware import lock2
+    from otree.models import Session
+    async with lock2:  # Like a message of the live socket, see otree.channels.consumers
+        with session_scope():
+            # The row lock keeps several processes from applying the same events (on databases that support it)
+            session = db.query(Session).filter(Session.code == session_code).with_for_update().one()
+            apply_market_schedule(session, app_clock.time())
+
+
+def apply_market_schedule(session, now):  # Apply all due events of the schedule as one market update
+    state = VarsState(session)
+    position = state.schedule_position
+    due = [event for event in state.market_schedule[position:] if event['time'] <= now]
+    if not due:
+        return
+    state.schedule_position = position + len(due)
+    changed = False
+    for event in due:
+        for name, value in event['parameters'].items():
+            if getattr(state, name) != value:
+                changed = True
+            setattr(state, name, value)
+        if event['paused'] is not None:
+            state.market_paused = event['paused']
+    if changed:
+        # Players are told with the next message to their group, see the announcement in live_method
+        for group in session.get_subsessions()[0].get_groups():
+            start_market_epoch(group, state)
+            book = get_market_store().read_book(market_key(group))
+            get_market_store().publish('market_feed', (session.code, state.spectator_token,
+                                                       market_snapshot(state, book)))
+    state.flush()
 
 
 def live_method(player: Player, data):
     group = player.group
-    players = group.get_players()
-    buyers = [p for p in players if p.is_buyer]
-    sellers = [p for p in players if not p.is_buyer and p.is_admin != 1]
-    player.participant.news = None
+    store = get_market(group)
+    market = market_key(group)
+    # Participant fields are read and written through a unit of work, only changed fields are saved at the end
+    participants = ParticipantStates(deferred=CLOCK_FIELDS, window=player.session.config.get('clock_flush_window', 0))
+    schedule_market_events(player.session)
+    session = VarsState(player.session)
+    participants[player].news = None
     market_news = None
     # Details on market structure
     currency_unit = str(player.session.config['currency_unit'])
-    seller_tax = float(player.subsession.session.seller_tax)
-    buyer_tax = float(player.subsession.session.buyer_tax)
-    price_floor = float(player.subsession.session.price_floor)
-    price_ceiling = float(player.subsession.session.price_ceiling)
+    seller_tax = float(session.seller_tax)
+    buyer_tax = float(session.buyer_tax)
+    price_floor = float(session.price_floor)
+    price_ceiling = float(session.price_ceiling)
     # Details on participants
-    participant = player.participant
-    # offers = participant.offers
-    offer_times = participant.offer_times  # List of tuples of offers and respective timestamp
+    participant = participants[player]
     participant.error = None  # Empty all error messages
+    catch_up_epoch(participants, player)
+    involved = {player.id_in_group: player}  # Players whose own data (offers, balance, messages) is sent
+    traded = []  # Players whose trading history has changed
+    all_clocks = False  # Whether all players are sent their clocks or only the involved players
+    market_event = False  # Whether the spectator feed is refreshed
+    broadcast = True  # Whether market data goes to the whole group or only to the requesting player
+    price_tick = None  # [seconds since market opening, price] of a new trade, added to open price charts
+    price_chart = None  # Price series requested by the player
     if data:
-        if data['type'] == 'offer':
+        if data['type'] in ['offer', 'withdrawal'] and not market_is_open(session):
+            # Pages advance staggered around opening and closing, so the market may not be open yet or anymore
+            participant.error = dict(
+                message="The market is not open.",
+                time=str(app_clock.today().ctime())
+            )
+            notify(participant, 'market_not_open')
+        elif data['type'] == 'offer':
             # Check if offer violates price restrictions
-            if player.is_buyer \
-                    and round(float(data['offer']), 2) < price_floor:
-                player.participant.error = dict(
-                    message="You are not allowed to bid below the price floor.",
-                    time=str(datetime.today().ctime())
-                )
-                player.participant.notifications.insert(0,
-                                                        {"message": "You are not allowed to bid below the price floor.",
-                                                         "time": str(datetime.today().ctime()),
-                                                         "type": "error"})
-            elif player.is_buyer \
-                    and round(float(data['offer']), 2) > price_ceiling:
-                player.participant.error = dict(
-                    message="You are not allowed to bid above the price ceiling.",
-                    time=str(datetime.today().ctime())
-                )
-                player.participant.notifications.insert(0,
-                                                        {
-                                                            "message": "You are not allowed to bid above the price "
-                                                                       "ceiling.",
-                                                            "time": str(datetime.today().ctime()),
-                                                            "type": "error"})
-            elif player.is_buyer == 0 \
-                    and round(float(data['offer']), 2) > price_ceiling:
-                player.participant.error = dict(
-                    message="You are not allowed to ask above the price ceiling.",
-                    time=str(datetime.today().ctime())
-                )
-                player.participant.notifications.insert(0,
-                                                        {
-                                                            "message": "You are not allowed to ask above the price "
-                                                                       "ceiling.",
-                                                            "time": str(datetime.today().ctime()),
-                                                            "type": "error"})
-            elif player.is_buyer == 0 \
-                     and round(float(data['offer']), 2) < price_floor:
-                player.participant.error = dict(
-                    message="You are not allowed to ask below the price floor.",
-                    time=str(datetime.today().ctime())
-                )
-                player.participant.notifications.insert(0,
-                                                        {
-                                                            "message": "You are not allowed to ask below the price "
-                                                                       "floor.",
-                                                            "time": str(datetime.today().ctime()),
-                                                            "type": "error"})
-            # Process offer
+            offer = parse_cents(data['offer'])
+            if offer is None:
+                violation = 'invalid_number'
             else:
-                offer_times.append((round(float(data['offer']), 2), datetime.today().timestamp()))
-                if player.is_buyer:
-                    offer_times.sort(key=lambda x: x[0],
-                                     reverse=True)  # Sort such that highest bid is first list element
-                    player.current_offer = offer_times[0][0]
-                elif player.is_buyer == 0 and player.is_admin != 1:
-                    offer_times.sort(key=lambda x: x[0],
-                                     reverse=False)  # Sort such that lowest ask is first list element
-                    player.current_offer = offer_times[0][0]
-                participant.offer_times = offer_times
-                player.current_offer_time = offer_times[0][1]
-                # Search for matching offers
-                if player.is_buyer:
-                    match = find_match(buyers=[player], sellers=sellers)
-                elif player.is_buyer == 0 and player.is_admin != 1:
-                    match = find_match(buyers=buyers, sellers=[player])
+                violation = price_limit_violation(player.is_buyer, offer, price_floor, price_ceiling)
+            if violation:
+                participants[player].error = dict(
+                    message=NOTIFICATIONS[violation][0],
+                    time=str(app_clock.today().ctime())
+                )
+                notify(participants[player], violation)
+            # Process offer (the admin does not trade)
+            elif player.is_admin != 1:
+                offer_time = app_clock.today().timestamp()
+                trade_timestamp = app_clock.time()
+                trade_seconds = int(trade_timestamp - market_time(player.session.config['market_opening']))
+
+                def match_offer(book):  # Atomic in the store: add the offer, match it and record the trade
+                    match = submit_offer(book, player.id_in_group, player.is_buyer, offer, offer_time)
+                    traders = [player.id_in_group]
+                    if match:
+                        record_trade(book, match[2], trade_timestamp, trade_seconds,
+                                     *trade_taxes(book['epoch'], match[2]))
+                        traders = match[:2]
+                    return match, {t: list(book['offers'].get(t, [])) for t in traders}, book['epoch'], \
+                        book['stats']['trades']
+
+                # The trade belongs to the epoch of the book it was matched in, even if a market update came in between
+                match, offers, epoch, trades = store.update_book(market, match_offer)
+                market_event = True
                 if match:
-                    [buyer, seller] = match
-                    if buyer.current_offer_time < seller.current_offer_time:
-                        price = buyer.current_offer
+                    buyer_id, seller_id, price_cents = match
+                    price = price_cents / 100
+                    price_tick = [trade_seconds, price]
+                    add_price_tick(group, trades, trade_seconds, price_cents)
+                    if player.is_buyer:
+                        buyer, seller = player, group.get_player_by_id(seller_id)
+                        involved[seller_id] = seller
                     else:
-                        price = seller.current_offer
-                    buyer_trading_history = buyer.participant.trading_history
-                    seller_trading_history = seller.participant.trading_history
-                    trade_time = str(datetime.today().ctime())
+                        buyer, seller = group.get_player_by_id(buyer_id), player
+                        involved[buyer_id] = buyer
+                    catch_up_epoch(participants, buyer)
+                    catch_up_epoch(participants, seller)
+
+                    def add_units(clocks):
+                        add_traded_units(clocks, buyer_id, seller_id)
+                        return dict(clocks[buyer_id]), dict(clocks[seller_id])
+
+                    buyer_clock, seller_clock = store.update_clocks(market, add_units)
+                    save_clock(participants[buyer], buyer_clock)
+                    save_clock(participants[seller], seller_clock)
+                    traded = [buyer_id, seller_id]
+                    # Calculate new balances
+                    buyer_profits, seller_profits = trade_profits(epoch, participants[buyer].marginal_evaluation,
+                                                                  participants[seller].marginal_evaluation,
+                                                                  price_cents)
+                    buyer_tax_paid, seller_tax_paid = trade_taxes(epoch, price_cents)
+                    buyer.balance = store.add_balance(market, buyer_id, buyer_profits)
+                    seller.balance = store.add_balance(market, seller_id, seller_profits)
                     Transaction.create(
                         description=player.session.config['description'],
                         group=group,
                         buyer=buyer,
                         seller=seller,
-                        price=price,
-                        seconds=int(time.time() - time.mktime(
-                            time.strptime(player.session.config['market_opening'], "%d %b %Y %X"))),
-                        buyer_valuation=buyer.participant.marginal_evaluation,
-                        seller_costs=seller.participant.marginal_evaluation,
-                        buyer_profits=buyer.participant.marginal_evaluation - price - (buyer_tax * price),
-                        seller_profits=price - seller.participant.marginal_evaluation - (seller_tax * price),
-                        buyer_balance=buyer.balance + buyer.participant.marginal_evaluation - price - (
-                                buyer_tax * price),
-                        seller_balance=seller.balance + price - seller.participant.marginal_evaluation - (
-                                seller_tax * price),
-                        buyer_tax=buyer_tax,
-                        seller_tax=seller_tax,
-                        price_floor=price_floor,
-                        price_ceiling=price_ceiling,
+                        price=price_cents,
+                        seconds=trade_seconds,
+                        timestamp=trade_timestamp,
+                        buyer_valuation=participants[buyer].marginal_evaluation,
+                        seller_costs=participants[seller].marginal_evaluation,
+                        buyer_tax_paid=buyer_tax_paid,
+                        seller_tax_paid=seller_tax_paid,
+                        buyer_profits=buyer_profits,
+                        seller_profits=seller_profits,
+                        buyer_balance=buyer.balance,
+                        seller_balance=seller.balance,
+                        epoch_id=epoch['id'],
                     )
-                    # Calculate new balances
-                    buyer.balance += buyer.participant.marginal_evaluation - price - (buyer_tax * price)
-                    seller.balance += price - seller.participant.marginal_evaluation - (seller_tax * price)
                     # Create message about effected trade
                     if player.session.config['anonymity']:
-                        buyer.participant.news = dict(
+                        participants[buyer].news = dict(
                             message="You bought one unit at price "
                                     + str('{:.2f}'.format((round(float(price), 2))))
                                     + " "
                                     + currency_unit,
-                            time=str(datetime.today().ctime())
+                            time=str(app_clock.today().ctime())
                         )
-                        buyer.participant.notifications.insert(0,
-                                                               {"message": "You bought one unit at price "
-                                                                           + str(
-                                                                   '{:.2f}'.format((round(float(price), 2))))
-                                                                           + " "
-                                                                           + currency_unit,
-                                                                "time": str(datetime.today().ctime()),
-                                                                "type": "news"})
-
-                        seller.participant.news = dict(
+                        notify(participants[buyer], 'bought', price)
+
+                        participants[seller].news = dict(
                             message="You sold one unit at price "
                                     + str('{:.2f}'.format((round(float(price), 2))))
                                     + " "
                                     + currency_unit,
-                            time=str(datetime.today().ctime())
+                            time=str(app_clock.today().ctime())
                         )
-                        seller.participant.notifications.insert(0,
-                                                                {"message": "You sold one unit at price "
-                                                                            + str(
-                                                                    '{:.2f}'.format((round(float(price), 2))))
-                                                                            + " "
-                                                                            + currency_unit,
-                                                                 "time": str(datetime.today().ctime()),
-                                                                 "type": "news"})
+                        notify(participants[seller], 'sold', price)
                     else:
-                        buyer.participant.news = dict(
+                        participants[buyer].news = dict(
                             message="You bought one unit at price "
                                     + str('{:.2f}'.format((round(float(price), 2))))
                                     + " "
                                     + currency_unit
                                     + " from Seller "
                                     + str(seller.id_in_group),
-                            time=str(datetime.today().ctime())
+                            time=str(app_clock.today().ctime())
                         )
-                        buyer.participant.notifications.insert(0,
-                                                               {"message": "You bought one unit at price "
-                                                                           + str(
-                                                                   '{:.2f}'.format((round(float(price), 2))))
-                                                                           + " "
-                                                                           + currency_unit
-                                                                           + " from Seller "
-                                                                           + str(seller.id_in_group),
-                                                                "time": str(datetime.today().ctime()),
-                                                                "type": "news"})
-
-                        seller.participant.news = dict(
+                        notify(participants[buyer], 'bought_from', price, seller.id_in_group)
+
+                        participants[seller].news = dict(
                             message="You sold one unit at price "
                                     + str('{:.2f}'.format((round(float(price), 2))))
                                     + " "
                                     + currency_unit
                                     + " to Buyer "
                                     + str(buyer.id_in_group),
-                            time=str(datetime.today().ctime())
+                            time=str(app_clock.today().ctime())
                         )
-                        seller.participant.notifications.insert(0,
-                                                                {"message": "You sold one unit at price "
-                                                                            + str(
-                                                                    '{:.2f}'.format((round(float(price), 2))))
-                                                                            + " "
-                                                                            + currency_unit
-                                                                            + " to Buyer "
-                                                                            + str(buyer.id_in_group),
-                                                                 "time": str(datetime.today().ctime()),
-                                                                 "type": "news"})
-
-                    # Delete bids/asks of effected trade from bid/ask cue
-                    buyer.participant.offer_times = buyer.participant.offer_times[1:]
-                    seller.participant.offer_times = seller.participant.offer_times[1:]
-                    if len(buyer.participant.offer_times) >= 1:
-                        buyer.current_offer = buyer.participant.offer_times[0][0]
-                        buyer.current_offer_time = buyer.participant.offer_times[0][1]
-                    else:
-                        buyer.current_offer = C.BID_MIN
-                        buyer.current_offer_time = C.MAX_TIMESTAMP
-                    if len(seller.participant.offer_times) >= 1:
-                        seller.current_offer = seller.participant.offer_times[0][0]
-                        seller.current_offer_time = seller.participant.offer_times[0][1]
-                    else:
-                        seller.current_offer = C.ASK_MAX
-                        seller.current_offer_time = C.MAX_TIMESTAMP
-                    # Trading history
-                    buyer_trading_history.insert(0, {"price": str('{:.2f}'.format((round(float(price), 2)))) + " "
-                                                              + currency_unit,
-                                                     "time": trade_time,
-                                                     "tax_on_buyer": str(buyer_tax * 100) + " %",
-                                                     "tax_on_seller": str(seller_tax * 100) + " %",
-                                                     "price_floor": str('{:.2f}'.format(round(price_floor, 2))) + " "
-                                                                    + currency_unit,
-                                                     "price_ceiling": str('{:.2f}'.format(round(price_ceiling, 2)))
-                                                                      + " " + currency_unit,
-                                                     "profit_from_trade": str('{:.2f}'.format(round(
-                                                         buyer.participant.marginal_evaluation - price -
-                                                         (buyer_tax * price), 2))) + " " + currency_unit,
-                                                     }),
-                    buyer.participant.trading_history = buyer_trading_history
-                    seller_trading_history.insert(0, {"price": str('{:.2f}'.format(round(float(price), 2))) + " "
-                                                               + currency_unit,
-                                                      "time": trade_time,
-                                                      "tax_on_buyer": str(buyer_tax * 100) + " %",
-                                                      "tax_on_seller": str(seller_tax * 100) + " %",
-                                                      "price_floor": str('{:.2f}'.format(round(price_floor, 2))) + " "
-                                                                     + currency_unit,
-                                                      "price_ceiling": str('{:.2f}'.format(round(price_ceiling, 2)))
-                                                                       + " " + currency_unit,
-                                                      "profit_from_trade": str('{:.2f}'.format(round(
-                                                          price - seller.participant.marginal_evaluation -
-                                                          (seller_tax * price), 2))) + " " + currency_unit,
-                                                      }),
-                    seller.participant.trading_history = seller_trading_history
-
-                    # Update remaining time needed for production/consumption
-                    # For buyers
-                    if buyer.participant.time_needed_1 == 0:
-                        buyer.participant.time_needed_1 += buyer.consumption_time
-                    elif buyer.participant.time_needed_2 == 0:
-                        buyer.participant.time_needed_2 += buyer.consumption_time
-                    else:
-                        buyer.participant.time_needed_3 += buyer.consumption_time
-                    # For sellers
-                    if seller.participant.time_needed_1 == 0:
-                        seller.participant.time_needed_1 += seller.production_time
-                    elif seller.participant.time_needed_2 == 0:
-                        seller.participant.time_needed_2 += seller.consumption_time
-                    else:
-                        seller.participant.time_needed_3 += seller.production_time
-
-                    # Update current offer history, i.e. still standing offers after trade
-                    buyer.participant.offer_history = []  # Empty offer history before recreating based on most recent info
-                    for x in buyer.participant.offer_times:
-                        buyer.participant.offer_history.insert(0,
-                                                               {"offer": str('{:.2f}'.format(round(x[0], 2))) + " "
-                                                                         + currency_unit,
-                                                                "offer_time": datetime.fromtimestamp(x[1]).ctime()})
-                    seller.participant.offer_history = []  # Empty offer history before recreating based on most recent info
-                    for x in seller.participant.offer_times:
-                        seller.participant.offer_history.append({"offer": str('{:.2f}'.format(round(x[0], 2))) + " " +
-                                                                          currency_unit,
-                                                                 "offer_time": datetime.fromtimestamp(x[1]).ctime()})
-            # Update current offer history, i.e. standing offers after new offer has been made
-            player.participant.offer_history = []  # Empty offer history before recreating based on most recent info
-            for x in player.participant.offer_times:
-                player.participant.offer_history.append({"offer": str('{:.2f}'.format(round(x[0], 2))) + " " +
-                                                                  currency_unit,
-                                                         "offer_time": datetime.fromtimestamp(x[1]).ctime()})
-        elif data['type'] == 'withdrawal':
-            withdrawal = data['withdrawal'].split(" ", 1)[0]
-            if float(withdrawal) in [i[0] for i in offer_times]:
-                del offer_times[([i[0] for i in offer_times]).index(float(withdrawal))]
-                # offer_times = [x for x in offer_times if x[0] in offers]
-            # participant.offers = offers
-            participant.offer_times = offer_times
-            if player.is_buyer:
-                offer_times.sort(key=lambda x: x[0], reverse=True)  # Sort such that highest bid is first list element
-                if len(offer_times) >= 1:
-                    player.current_offer = offer_times[0][0]
-                    player.current_offer_time = offer_times[0][1]
-                else:
-                    player.current_offer = C.BID_MIN
-                    player.current_offer_time = C.MAX_TIMESTAMP
-            elif player.is_buyer == 0 and player.is_admin != 1:
-                offer_times.sort(key=lambda x: x[0], reverse=False)  # Sort such that lowest ask is first list element
-                if len(offer_times) >= 1:
-                    player.current_offer = offer_times[0][0]
-                    player.current_offer_time = offer_times[0][1]
+                        notify(participants[seller], 'sold_to', price, buyer.id_in_group)
+
+                    # Standing offers after the trade
+                    participants[buyer].offer_times = pack_offers(offers[buyer_id])
+                    participants[seller].offer_times = pack_offers(offers[seller_id])
+                    set_current_offer(buyer, offers[buyer_id])
+                    set_current_offer(seller, offers[seller_id])
                 else:
-                    player.current_offer = C.ASK_MAX
-                    player.current_offer_time = C.MAX_TIMESTAMP
-            # Current offer history, i.e. still standing offers
-            player.participant.offer_history = []  # Empty offer history before recreating based on most recent info
-            for x in player.participant.offer_times:
-                player.participant.offer_history.append({"offer": str('{:.2f}'.format(round(x[0], 2))) + " " +
-                                                                  currency_unit,
-                                                         "offer_time": datetime.fromtimestamp(x[1]).ctime()})
+                    participant.offer_times = pack_offers(offers[player.id_in_group])
+                    set_current_offer(player, offers[player.id_in_group])
+        elif data['type'] == 'withdrawal' and parse_cents(data['withdrawal'].split(" ", 1)[0]) is None or \
+                data['type'] == 'market_update' and not all(math.isfinite(float(data[field]))
+                                                            for field in MARKET_UPDATE_FIELDS):
+            # Values that are not finite, e.g. "inf", are rejected like prices outside the limits
+            participant.error = dict(
+                message=NOTIFICATIONS['invalid_number'][0],
+                time=str(app_clock.today().ctime())
+            )
+            notify(participant, 'invalid_number')
+        elif data['type'] == 'withdrawal':
+            withdrawal = parse_cents(data['withdrawal'].split(" ", 1)[0])
+
+            def withdraw(book):
+                withdraw_offer(book, player.id_in_group, player.is_buyer, withdrawal)
+                return list(book['offers'].get(player.id_in_group, []))
+
+            offers = store.update_book(market, withdraw)
+            participant.offer_times = pack_offers(offers)
+            set_current_offer(player, offers)
+            market_event = True
         elif data['type'] == 'time_update':
-            for p in players:
-                # Update remaining time needed for production/consumption
-                p.participant.current_timestamp = time.time()
-                if p.participant.time_needed_1 <= 1:
-                    if p.is_buyer:
-                        p.participant.time_needed_1 += min(p.participant.time_needed_2, p.consumption_time)
-                        p.participant.time_needed_2 -= p.participant.time_needed_1
-                    elif p.is_buyer == 0 and p.is_admin != 1:
-                        p.participant.time_needed_1 += min(p.participant.time_needed_2, p.production_time)
-                        p.participant.time_needed_2 -= p.participant.time_needed_1
-                if p.participant.time_needed_2 <= 1:
-                    if p.is_buyer:
-                        p.participant.time_needed_2 += min(p.participant.time_needed_3, p.consumption_time)
-                        p.participant.time_needed_3 -= p.participant.time_needed_2
-                    elif p.is_buyer == 0 and p.is_admin != 1:
-                        p.participant.time_needed_2 += min(p.participant.time_needed_3, p.production_time)
-                        p.participant.time_needed_3 -= p.participant.time_needed_2
-
-                p.participant.time_needed_1 = round(max(0, p.participant.time_needed_1 -
-                                                        (p.participant.current_timestamp -
-                                                         p.participant.previous_timestamp)), 0)
-                p.participant.time_needed_2 = round(max(0, p.participant.time_needed_2 -
-                                                        (p.participant.current_timestamp -
-                                                         p.participant.previous_timestamp)), 0)
-                p.participant.time_needed_3 = round(max(0, p.participant.time_needed_3 -
-                                                        (p.participant.current_timestamp -
-                                                         p.participant.previous_timestamp)), 0)
-                p.participant.previous_timestamp = p.participant.current_timestamp
-                # Update marginal utility/costs
-                if p.is_buyer:
-                    p.participant.marginal_evaluation = marginal_consumption_utility(
-                        p.participant.time_needed_1,
-                        p.participant.time_needed_2,
-                        p.participant.time_needed_3,
-                        p.max_mu,
-                        p.step_mu,
-                        p.consumption_time
-                    )
-                elif p.is_buyer == 0 and p.is_admin != 1:
-                    p.participant.marginal_evaluation = marginal_production_costs(p.participant.time_needed_1,
-                                                                                  p.participant.time_needed_2,
-                                                                                  p.participant.time_needed_3,
-                                                                                  p.min_mc,
-                                                                                  p.step_mc,
-                                                                                  p.production_time
-                                                                                  )
+            now = app_clock.time()
+            store.update_clocks(market, lambda clocks: advance_clocks(clocks, now))
+            all_clocks = True
+            record_footprint(session)
         # Admin update of market structure
         elif data['type'] == 'market_update':
             # Check which parameters are updated
             new_market_params = [
-                player.subsession.session.buyer_tax != round(float(data['buyer_tax_admin']) / 100, 3),
-                player.subsession.session.seller_tax != round(float(data['seller_tax_admin']) / 100, 3),
-                player.subsession.session.price_floor != round(float(data['price_floor_admin']), 2),
-                player.subsession.session.price_ceiling != round(float(data['price_ceiling_admin']), 2)
+                session.buyer_tax != round(float(data['buyer_tax_admin']) / 100, 3),
+                session.seller_tax != round(float(data['seller_tax_admin']) / 100, 3),
+                session.price_floor != round(float(data['price_floor_admin']), 2),
+                session.price_ceiling != round(float(data['price_ceiling_admin']), 2)
             ]
             # Write updated parameters into session variable
-            player.subsession.session.buyer_tax = round(float(data['buyer_tax_admin']) / 100, 3)
-            player.subsession.session.seller_tax = round(float(data['seller_tax_admin']) / 100, 3)
-            player.subsession.session.price_floor = round(float(data['price_floor_admin']), 2)
-            player.subsession.session.price_ceiling = round(float(data['price_ceiling_admin']), 2)
+            session.buyer_tax = round(float(data['buyer_tax_admin']) / 100, 3)
+            session.seller_tax = round(float(data['seller_tax_admin']) / 100, 3)
+            session.price_floor = round(float(data['price_floor_admin']), 2)
+            session.price_ceiling = round(float(data['price_ceiling_admin']), 2)
             # Check whether there really was a change
             if new_market_params == [False, False, False, False]:
                 market_news = None
             else:
-                # Clear all standing asks and bids
-                for p in players:
-                    p.participant.offer_history = []
-                    p.participant.offer_times = []
-                    p.participant.offers = []
-                    if p.is_buyer:
-                        offer_times.sort(key=lambda x: x[0],
-                                         reverse=True)  # Sort such that highest bid is first list element
-                        if len(offer_times) >= 1:
-                            p.current_offer = offer_times[0][0]
-                            p.current_offer_time = offer_times[0][1]
-                        else:
-                            p.current_offer = C.BID_MIN
-                            p.current_offer_time = C.MAX_TIMESTAMP
-                    elif p.is_buyer == 0 and p.is_admin != 1:
-                        offer_times.sort(key=lambda x: x[0],
-                                         reverse=False)  # Sort such that lowest ask is first list element
-                        if len(offer_times) >= 1:
-                            p.current_offer = offer_times[0][0]
-                            p.current_offer_time = offer_times[0][1]
-                        else:
-                            p.current_offer = C.ASK_MAX
-                            p.current_offer_time = C.MAX_TIMESTAMP
-
+                # Start a new epoch, i.e. swap in an empty book. Players learn about it from the epoch event below,
+                # their participant vars are brought up to date when they are next involved (see catch_up_epoch).
+                start_market_epoch(group, session)
+                catch_up_epoch(participants, player)
                 # Create messages on market updates
-                if new_market_params == [True, False, False, False]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 1)) + " %. All standing bids and asks have "
-                                                                                  "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [False, True, False, False]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1)) + " %. All standing bids and asks have"
-                                                                                   " been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [False, False, True, False]:
-                    market_news = dict(
-                        message="A market intervention took place! The price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [False, False, False, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [True, True, False, False]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 1))
-                                + " % and the tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1)) + " %. All standing bids and asks have"
-                                                                                   " been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [True, False, True, False]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 1))
-                                + " % and the price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [True, False, False, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 1))
-                                + " % and the price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [False, True, True, False]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1))
-                                + " % and the price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [False, True, False, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1))
-                                + " % and the price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [False, False, True, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit'])
-                                + " and the price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [True, True, True, False]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 1))
-                                + " %, the tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1))
-                                + " % and the price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [True, False, True, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 1))
-                                + " %, the price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit'])
-                                + " and the price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [True, True, False, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 1))
-                                + " %, the tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1))
-                                + " % and the price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [False, True, True, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1))
-                                + " %, the price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit'])
-                                + " and the price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                elif new_market_params == [True, True, True, True]:
-                    market_news = dict(
-                        message="A market intervention took place! The tax on buyers has changed to "
-                                + str(round(float(data['buyer_tax_admin']), 11))
-                                + " %, the tax on sellers has changed to "
-                                + str(round(float(data['seller_tax_admin']), 1))
-                                + " %, the price floor has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_floor_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit'])
-                                + " and the price ceiling has changed to "
-                                + str('{:.2f}'.format(round(float(data['price_ceiling_admin']), 2))) + " "
-                                + str(player.session.config['currency_unit']) + ". All standing bids and asks have "
-                                                                                "been deleted.",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                else:
-                    market_news = dict(
-                        message="The market has been updated",
-                        time=str(datetime.today().ctime()),
-                        type="market_news"
-                    )
-                for p in players:
-                    p.participant.notifications.insert(0, market_news)
+                market_news = market_update_news(new_market_params, data, currency_unit)
+            market_event = True
         elif data['type'] == 'notification_deletion':
-            notifications = player.participant.notifications
+            notifications = list(participants[player].notifications)
             # reversed_notifications = list(reversed(notifications))
             deletion = data['deletion']
             del notifications[deletion]
             # notifications = list(reversed(reversed_notifications))
-            player.participant.notifications = notifications
-
-    # Create lists of all asks/bids by all sellers/buyers
-    raw_bids = [[i[0] for i in p.participant.offer_times] for p in buyers]  # Collect bids from all buyers
-    raw_bidders = [[p.id_in_group for i in p.participant.offer_times] for p in buyers]  # Collect bidders
-    bids = flatten(raw_bids)  # Unnest list of bids
-    bidders = flatten(raw_bidders)  # Unnest list of bidders
-    # Dictionary of bid amount and bidder
-    bid_keys = ["bid" for i in range(len(bids))]
-    bidder_keys = ["bidder" for i in range(len(bidders))]
-    overall_bids_dict_list = [[bid_keys[i], bids[i], bidder_keys[i], bidders[i]] for i in range(len(bids))]
-    overall_bids = [
-        {
-            overall_bids_dict_list[i][0]: str('{:.2f}'.format(round(overall_bids_dict_list[i][1], 2))),
-            overall_bids_dict_list[i][2]: overall_bids_dict_list[i][3]
-        }
-        for i in range(len(overall_bids_dict_list))
-    ]
-    bids.sort(reverse=True)
-
-    # Collect asks from all sellers
-    raw_asks = [[i[0] for i in p.participant.offer_times] for p in sellers]  # Collect asks from all sellers
-    raw_askers = [[p.id_in_group for i in p.participant.offer_times] for p in sellers]  # Collect sellers
-    asks = flatten(raw_asks)  # Unnest list
-    askers = flatten(raw_askers)  # Unnest list of sellers
-    # Dictionary of ask amount and asker
-    ask_keys = ["ask" for i in range(len(asks))]
-    asker_keys = ["asker" for i in range(len(askers))]
-    overall_asks_dict_list = [[ask_keys[i], asks[i], asker_keys[i], askers[i]] for i in range(len(asks))]
-    overall_asks = [
-        {
-            overall_asks_dict_list[i][0]: str('{:.2f}'.format(round(overall_asks_dict_list[i][1], 2))),
-            overall_asks_dict_list[i][2]: overall_asks_dict_list[i][3]
-        }
-        for i in range(len(overall_asks_dict_list))
-    ]
-    asks.sort(reverse=False)
+            participants[player].notifications = notifications
+        elif data['type'] == 'price_history':  # Zoom level of the price chart, only the requesting player is answered
+            zoom = data.get('zoom') if data.get('zoom') in price_history.ZOOM_LEVELS else 'recent'
+            price_chart = price_series(group, store.read_book(market)['stats']['trades'], zoom)
+            broadcast = False
+
+    # Aggregated order book, i.e. best price levels of all asks/bids by all sellers/buyers
+    book = store.read_book(market)
+    overall_bids = depth_ladder(book['bids'], player.session.config['market_depth'], "bid",
+                                highest_first=True)
+    overall_asks = depth_ladder(book['asks'], player.session.config['market_depth'], "ask",
+                                highest_first=False)
+    # Refresh the cached snapshot of the spectator feed once per market event, in every process
+    if market_event:
+        store.publish('market_feed', (player.session.code, session.spectator_token, market_snapshot(session, book)))
+    clocks = store.read_clocks(market)
+    for p in involved.values():
+        save_clock(participants[p], clocks[p.id_in_group])
 
+    # A new epoch, started by the admin or by the market schedule, is announced with the next message that goes to the
+    # whole group: the page drops the player's standing offers and shows the news
+    announcement = None
+    if data and broadcast and group.announced_epoch != group.epoch:
+        group.announced_epoch = group.epoch
+        if market_news is None:
+            previous, epoch = db.query(MarketEpoch) \
+                .filter(MarketEpoch.group_id == group.id, MarketEpoch.number >= group.epoch - 1) \
+                .order_by(MarketEpoch.number).all()
+            market_news = market_update_news(*epoch_news(previous, epoch), currency_unit)
+        announcement = dict(market_news, time=str(app_clock.today().ctime()))
+
+    # Market data goes to every player of the group, own data only to the players it has changed for.
+    # An empty message (sent when the page is loaded) returns the complete data of the requesting player only.
+    market_data = dict(
+        bids=overall_bids,  # json.dumps(overall_bids_dict),
+        asks=overall_asks,  # json.dumps(overall_asks_dict),
+        buyer_tax=str('{:.1f}'.format(buyer_tax * 100)) + " " + str('%'),
+        seller_tax=str('{:.1f}'.format(seller_tax * 100)) + " " + str('%'),
+        price_floor=str('{:.2f}'.format(round(price_floor, 2))) + " " + str(
+            player.session.config['currency_unit']),
+        price_ceiling=str('{:.2f}'.format(round(price_ceiling, 2))) + " " + str(
+            player.session.config['currency_unit']),
+        buyer_tax_admin=buyer_tax * 100,
+        seller_tax_admin=seller_tax * 100,
+        price_floor_admin=round(price_floor, 2),
+        price_ceiling_admin=round(price_ceiling, 2),
+        currency_unit=currency_unit,
+        time_unit='seconds',  # str(player.session.config['time_unit']),
+        market_news=market_news,
+        epoch=group.epoch,
+    )
+    if announcement:
+        market_data['epoch_news'] = announcement
+    if price_tick:
+        market_data['price_tick'] = price_tick
     live_data = {}
-    for p in players:
-        live_data[p.id_in_group] = dict(
+    for i in (clocks if data and broadcast else [player.id_in_group]):
+        live_data[i] = dict(market_data)
+        if all_clocks or i in involved:
+            c = clocks[i]
+            live_data[i].update(
+                chart_point=[[(c['time_needed_1'] + c['time_needed_2'] + c['time_needed_3']),
+                              c['marginal_evaluation']]],
+                time_needed_1=c['time_needed_1'],
+                time_needed_2=c['time_needed_2'],
+                time_needed_3=c['time_needed_3'],
+                marginal_evaluation=str('{:.2f}'.format(round(c['marginal_evaluation'], 2))) + " " + str(
+                    player.session.config['currency_unit']),
+            )
+    for p in involved.values():
+        catch_up_epoch(participants, p)
+        offers = unpack_offers(participants[p].offer_times)
+        live_data[p.id_in_group].update(
             current_offer=str('{:.2f}'.format(round(p.current_offer, 2))) + " " + str(
                 player.session.config['currency_unit']),
             current_offer_time=datetime.fromtimestamp(p.current_offer_time).ctime(),
-            balance=str('{:.2f}'.format(round(p.balance, 2))) + " " + str(player.session.config['currency_unit']),
-            bids=overall_bids,  # json.dumps(overall_bids_dict),
-            asks=overall_asks,  # json.dumps(overall_asks_dict),
-            cost_chart_series=p.participant.cost_chart_series,
-            utility_chart_series=p.participant.utility_chart_series,
-            chart_point=[
-                [(p.participant.time_needed_1 + p.participant.time_needed_2 + p.participant.time_needed_3), p.participant.marginal_evaluation]],
-            offers=[str('{:.2f}'.format(round(i[0], 2))) for i in p.participant.offer_times],
-            offer_times=[datetime.fromtimestamp(tup[1]).ctime() for tup in p.participant.offer_times],
-            offer_history=p.participant.offer_history,  # json.dumps(dict(offers=p.participant.offer_history)),
-            time_needed_1=p.participant.time_needed_1,
-            time_needed_2=p.participant.time_needed_2,
-            time_needed_3=p.participant.time_needed_3,
-            marginal_evaluation=str('{:.2f}'.format(round(p.participant.marginal_evaluation, 2))) + " " + str(
-                player.session.config['currency_unit']),
-            trading_history=p.participant.trading_history,  # json.dumps(dict(trades=p.participant.trading_history)),
-            buyer_tax=str('{:.1f}'.format(buyer_tax * 100)) + " " + str('%'),
-            seller_tax=str('{:.1f}'.format(seller_tax * 100)) + " " + str('%'),
-            price_floor=str('{:.2f}'.format(round(price_floor, 2))) + " " + str(
-                player.session.config['currency_unit']),
-            price_ceiling=str('{:.2f}'.format(round(price_ceiling, 2))) + " " + str(
-                player.session.config['currency_unit']),
-            buyer_tax_admin=buyer_tax * 100,
-            seller_tax_admin=seller_tax * 100,
-            price_floor_admin=round(price_floor, 2),
-            price_ceiling_admin=round(price_ceiling, 2),
-            currency_unit=currency_unit,
-            time_unit='seconds',  # str(player.session.config['time_unit']),
-            error=p.participant.error,
-            market_news=market_news,
-            news=p.participant.news,
-            notifications=p.participant.notifications,
+            balance=format_cents(p.balance) + " " + str(player.session.config['currency_unit']),
+            offers=[format_cents(i[0]) for i in offers],
+            offer_times=[datetime.fromtimestamp(tup[1]).ctime() for tup in offers],
+            offer_history=offer_history(offers, currency_unit),
+            error=participants[p].error,
+            news=participants[p].news,
+            notifications=render_notifications(participants[p].notifications, currency_unit),
         )
+        # The trading history is read from the Transaction table. It is sent in full when the page is loaded, after a
+        # trade only the new trade is sent and added in front by the page, so trades do not get slower over time.
+        if not data:
+            live_data[p.id_in_group]['trading_history'] = trading_history(p, currency_unit)
+        elif p.id_in_group in traded:
+            live_data[p.id_in_group]['new_trades'] = trading_history(p, currency_unit, limit=1)
+    if price_chart:
+        live_data[player.id_in_group]['price_history'] = price_chart
 
     # return {
     #     p.id_in_group: dict(
@@ -877,19 +1552,41 @@ def live_method(player: Player, data):
     #     for p in players  # if p.is_admin is False
     # }
 
+    participants.flush()
+    session.flush()
     return live_data
 
 
+# Page advancement around market opening and closing is spread over the page_stagger seconds (session config), so
+# that not all participants load a page at the same instant: the trading page is loaded up to page_stagger seconds
+# before the market opens, and left up to page_stagger seconds after it has closed. Offers are only accepted while
+# the market is open.
+def market_hours(session):  # Timestamps of market opening and closing
+    return (market_time(session.config['market_opening']),
+            market_time(session.config['market_closing']))
+
+
+def market_is_open(session):
+    opening, closing = market_hours(session)
+    return opening <= app_clock.time() < closing and not session.market_paused
+
+
+def page_stagger(player):  # Seconds by which the page advancement of a player is shifted, evenly spread over players
+    stagger = player.session.config.get('page_stagger', 0)
+    return stagger * (player.id_in_subsession - 1) / player.session.num_participants
+
+
 # PAGES
 class WaitToStart(Page):
 
     @staticmethod
     def is_displayed(player: Player):
-        return time.time() < time.mktime(time.strptime(player.session.config['market_opening'], "%d %b %Y %X"))
+        return app_clock.time() < market_time(player.session.config['market_opening'])
 
     @staticmethod
     def get_timeout_seconds(player):
-        return time.mktime(time.strptime(player.session.config['market_opening'], "%d %b %Y %X")) - time.time()
+        opening, closing = market_hours(player.session)
+        return opening - page_stagger(player) - app_clock.time()
 
     @staticmethod
     def vars_for_template(player):
@@ -903,7 +1600,7 @@ class Trading(Page):
 
     @staticmethod
     def get_timeout_seconds(player):
-        return time.mktime(time.strptime(player.session.config['market_closing'], "%d %b %Y %X")) - time.time()
+        return market_time(player.session.config['market_closing']) - app_clock.time()
 
     @staticmethod
     def js_vars(player: Player):
@@ -912,7 +1609,9 @@ class Trading(Page):
             is_buyer=player.is_buyer,
             is_admin=player.is_admin,
             currency_unit=player.currency_unit,
-            time_unit=player.time_unit
+            time_unit=player.time_unit,
+            # The MC/MU schedule does not change during the market, so it is sent once instead of with every update
+            chart_series=unpack_schedule(VarsState(player.participant).chart_series),
         )
 
     @staticmethod
@@ -920,37 +1619,58 @@ class Trading(Page):
         import time
 
         group = player.group
-        market_opening_timestamp = time.mktime(time.strptime(player.session.config['market_opening'], "%d %b %Y %X"))
+        market_opening_timestamp = market_time(player.session.config['market_opening'])
         group.start_timestamp = int(market_opening_timestamp)
-        market_closing_timestamp = time.mktime(time.strptime(player.session.config['market_closing'], "%d %b %Y %X"))
-        # return (group.start_timestamp + 5 * 60) - time.time()
-        return market_closing_timestamp - time.time()
+        market_closing_timestamp = market_time(player.session.config['market_closing'])
+        # return (group.start_timestamp + 5 * 60) - app_clock.time()
+        return market_closing_timestamp + page_stagger(player) - app_clock.time()
 
     @staticmethod
     def vars_for_template(player: Player):
+        # Apply due market events and make the spectator feed available again after a server restart
+        schedule_market_events(player.session)
+        session = VarsState(player.session)
+        if session.code not in market_feed.snapshots:
+            book = get_market(player.group).read_book(market_key(player.group))
+            market_feed.publish(session.code, session.spectator_token, market_snapshot(session, book))
         return dict(
             market_opening=player.session.config['market_opening'],
             market_closing=player.session.config['market_closing'],
+            charts_version=CHARTS_VERSION,
         )
 
     @staticmethod
     def before_next_page(player: Player, timeout_happened):
-        player.payoff = player.balance
+        opening, closing = market_hours(player.session)
+        if app_clock.time() < closing:  # Left the market early, e.g. advanced by the experimenter, also during a pause
+            player.payoff = player.balance / 100
+        else:
+            settle_market(player.group)
 
 
 class Results(Page):
 
     @staticmethod
     def is_displayed(player: Player):
-        return time.time() > time.mktime(time.strptime(player.session.config['market_closing'], "%d %b %Y %X"))
+        return app_clock.time() > market_time(player.session.config['market_closing'])
 
     @staticmethod
     def vars_for_template(player):
+        group = player.group
+        settle_market(group)  # Results are computed once per group and then read from the group
+        if player.is_admin:
+            return dict(
+                title_text="The market has closed at " + str(player.session.config['market_closing']),
+                body_text=str(group.trades) + " trades took place, the tax revenue is "
+                          + str('{:.2f}'.format(round(group.tax_revenue, 2)))
+                          + " " + str(player.session.config['currency_unit'])
+            )
         return dict(
             title_text="The market has closed at " + str(player.session.config['market_closing']),
             body_text="Your final profit is "
-                      + str('{:.2f}'.format(round(player.balance, 2)))
+                      + format_cents(player.balance)
                       + " " + str(player.session.config['currency_unit'])
+                      + " from " + str(player.trades) + (" trade" if player.trades == 1 else " trades")
         )
 
 
@@ -961,12 +1681,54 @@ page_sequence = [
 ]
 
 
+def vars_for_admin_report(subsession):  # Spectator link, trading volume and participant vars footprint (Reports tab)
+    session = subsession.session
+    sizes = {}
+    for participant in session.get_participants():
+        for field, size in vars_footprint(participant).items():
+            sizes.setdefault(field, []).append(size)
+    names = sorted(sizes, key=lambda field: -sum(sizes[field]))  # Largest fields first
+    return dict(
+        fields=[dict(name=field, mean=round(sum(sizes[field]) / len(sizes[field])), max=max(sizes[field]),
+                     total=sum(sizes[field]))
+                for field in names],
+        names=names,
+        samples=[dict(time=datetime.fromtimestamp(sample['timestamp']).ctime(),
+                      total=sum(mean for mean, _ in sample['fields'].values()),
+                      sizes=[sample['fields'].get(field, [0, 0])[0] for field in names])
+                 for sample in reversed(session.vars_footprint)],
+        interval=C.FOOTPRINT_INTERVAL,
+        sampled=C.FOOTPRINT_PARTICIPANTS,
+        volume=[dict(row, group=group.id_in_subsession)
+                for group in subsession.get_groups() for row in volume_per_minute(group, C.REPORT_MINUTES)],
+        minutes=C.REPORT_MINUTES,
+        spectator_url='/static/double_auction/spectator.html?session={}&token={}'.format(
+            session.code, VarsState(session).spectator_token),
+    )
+
+
 def custom_export(players):
     yield ['session', 'description', 'buyer', 'seller', 'price', 'seconds',
            'buyer_valuation', 'seller_costs', 'buyer_profits', 'seller_profits', 'buyer_balance', 'seller_balance',
            'seller_tax', 'buyer_tax', 'price_floor', 'price_ceiling']
-    for p in players:
-        for tx in Transaction.filter(seller=p):
-            yield [p.session.code, tx.description, tx.buyer.id_in_group, tx.seller.id_in_group, tx.price, tx.seconds,
-                   tx.buyer_valuation, tx.seller_costs, tx.buyer_profits, tx.seller_profits, tx.buyer_balance,
-                   tx.seller_balance, tx.seller_tax, tx.buyer_tax, tx.price_floor, tx.price_ceiling]
+    # One joined query per chunk of sellers instead of one query per player plus lazy loads of buyer and seller
+    buyer = aliased(Player)
+    seller = aliased(Player)
+    players = list(players)
+    for i in range(0, len(players), C.EXPORT_CHUNK_SIZE):
+        chunk = players[i:i + C.EXPORT_CHUNK_SIZE]
+        session_codes = {p.id: p.session.code for p in chunk}
+        position = {p.id: n for n, p in enumerate(chunk)}
+        rows = db.query(Transaction, buyer.id_in_group, seller.id_in_group, MarketEpoch) \
+            .join(buyer, Transaction.buyer_id == buyer.id) \
+            .join(seller, Transaction.seller_id == seller.id) \
+            .join(MarketEpoch, Transaction.epoch_id == MarketEpoch.id) \
+            .filter(Transaction.seller_id.in_(list(position))) \
+            .order_by(Transaction.id)
+        for tx, buyer_id_in_group, seller_id_in_group, epoch in sorted(rows,
+                                                                       key=lambda row: position[row[0].seller_id]):
+            # Money is stored in cents and exported in currency units
+            yield [session_codes[tx.seller_id], tx.description, buyer_id_in_group, seller_id_in_group,
+                   tx.price / 100, tx.seconds, tx.buyer_valuation, tx.seller_costs, tx.buyer_profits / 100,
+                   tx.seller_profits / 100, tx.buyer_balance / 100, tx.seller_balance / 100, epoch.seller_tax,
+                   epoch.buyer_tax, epoch.price_floor, epoch.price_ceiling]
@@ -0,0 +1,101 @@
+# Read-only market data feed for spectators and projectors.
+#
+# live_method publishes one snapshot (book, last trades, aggregate stats) per market event through the market store,
+# whose pub/sub delivers it to every process. Viewers read that cached snapshot through their own HTTP routes, so any
+# number of them can watch without taking part in the live_method fan-out of the trading page:
+#   /market_data/<session code>?token=<spectator token>          JSON snapshot (supports If-None-Match, so polling
+#                                                                clients get 304s)
+#   /market_data/<session code>/stream?token=<spectator token>   server-sent events, one message per new snapshot
+# The spectator token is created per session and shown with the link to
+# _static/double_auction/spectator.html?session=<session code>&token=<spectator token> in the Reports tab of the
+# session admin.
+import asyncio
+import hmac
+import json
+import sys
+from collections import defaultdict
+
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+STREAM_KEEPALIVE = 15  # Seconds after which an idle stream receives a comment line to keep proxies from closing it
+
+snapshots = {}  # Session code -> (version, spectator token, snapshot serialized as JSON)
+streams = defaultdict(set)  # Session code -> (event loop, asyncio.Event) of every open stream of the session
+
+
+def publish(session_code, token, snapshot):  # Called once per market event, from any thread, replaces the snapshot
+    version = snapshots[session_code][0] + 1 if session_code in snapshots else 1
+    snapshots[session_code] = (version, token, json.dumps(dict(snapshot, version=version)))
+    # Wake up the open streams of the session, each on the event loop it is served from
+    for loop, update in list(streams[session_code]):
+        loop.call_soon_threadsafe(update.set)
+
+
+def access_error(request, session_code):  # Response for unknown sessions and wrong tokens, None if access is granted
+    if session_code not in snapshots:
+        return JSONResponse({"error": "No market data for this session yet"}, status_code=404)
+    token = snapshots[session_code][1]
+    if not hmac.compare_digest(request.query_params.get('token', ''), token):
+        return JSONResponse({"error": "Invalid spectator token"}, status_code=403)
+    return None
+
+
+async def market_data(request):
+    session_code = request.path_params['session_code']
+    error = access_error(request, session_code)
+    if error:
+        return error
+    version, _, body = snapshots[session_code]
+    etag = '"' + str(version) + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def market_data_stream(request):
+    session_code = request.path_params['session_code']
+    error = access_error(request, session_code)
+    if error:
+        return error
+    update = asyncio.Event()
+    stream = (asyncio.get_event_loop(), update)
+
+    async def events():
+        # Sends the current snapshot, then waits until publish() reports a new one or the keepalive is due
+        streams[session_code].add(stream)
+        try:
+            sent_version = None
+            while not await request.is_disconnected():
+                version, _, body = snapshots[session_code]
+                if version != sent_version:
+                    sent_version = version
+                    yield "id: " + str(version) + "\ndata: " + body + "\n\n"
+                try:
+                    await asyncio.wait_for(update.wait(), STREAM_KEEPALIVE)
+                    update.clear()
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            streams[session_code].discard(stream)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+routes = [
+    Route('/market_data/{session_code}', market_data, name='market_data'),
+    Route('/market_data/{session_code}/stream', market_data_stream, name='market_data_stream'),
+]
+
+
+def register_routes():
+    # oTree has no hook for the routes of an app, so they are added to its ASGI app once per process, when the process
+    # sets up its market store. Processes without a web server (bots, benchmarks) have not loaded otree.asgi and get
+    # no routes. Returns whether the routes have been added.
+    asgi = sys.modules.get('otree.asgi')
+    if asgi is None:
+        return False
+    for route in routes:
+        asgi.app.add_route(route.path, route.endpoint, name=route.name)
+    return True
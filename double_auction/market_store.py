@@ -0,0 +1,199 @@
+# Stores for the hot market state of a group: the order book, the balances and the production/consumption clocks.
+#
+# live_method reads and changes this state through the store instead of loading every player of the group per
+# message. Every change is an atomic read-modify-write, so several web processes can share one market:
+#   InProcessStore  default, keeps the state in memory of the current process (one web process only)
+#   RedisStore      shares the state between processes through Redis (set MARKET_STORE_URL=redis://...), changes
+#                   are optimistic transactions (WATCH/MULTI) and published messages reach every process (pub/sub)
+# RedisStore works with any client object that offers the redis-py API, e.g. fakeredis as a local stand-in.
+#
+# The markets that a store has changed are collected in changed_markets, so that the caller can drop them if its
+# database transaction is rolled back (and clear the set once it has committed). A market that is missing when it is
+# read or changed, e.g. because another process has dropped it, is loaded again by calling load(market), which the
+# caller sets to a function that loads the market from the database with load_market().
+import os
+import pickle
+import threading
+from collections import defaultdict
+
+
+class InProcessStore:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.markets = {}
+        self.subscribers = defaultdict(list)
+        self.changed_markets = set()
+        self.load = None
+
+    def has_market(self, market):
+        return market in self.markets
+
+    def load_market(self, market, book, balances, clocks):  # Only the first of several concurrent loads is kept
+        with self.lock:
+            if market not in self.markets:
+                self.markets[market] = dict(book=book, balances=dict(balances), clocks=clocks)
+
+    def drop_market(self, market):
+        with self.lock:
+            self.markets.pop(market, None)
+
+    def market(self, market):  # State of a market, loaded first if it is missing
+        if market not in self.markets:
+            self.load(market)
+        return self.markets[market]
+
+    def read_book(self, market):
+        return self.market(market)['book']
+
+    def update_book(self, market, change):  # Applies change(book) atomically and returns its result
+        state = self.market(market)
+        with self.lock:
+            self.changed_markets.add(market)
+            return change(state['book'])
+
+    def read_clocks(self, market):
+        return self.market(market)['clocks']
+
+    def update_clocks(self, market, change):  # Applies change(clocks) atomically and returns its result
+        state = self.market(market)
+        with self.lock:
+            self.changed_markets.add(market)
+            return change(state['clocks'])
+
+    def add_balance(self, market, trader, amount):  # Returns the new balance
+        state = self.market(market)
+        with self.lock:
+            self.changed_markets.add(market)
+            balances = state['balances']
+            balances[trader] = balances.get(trader, 0) + amount
+            return balances[trader]
+
+    def read_balances(self, market):
+        return dict(self.market(market)['balances'])
+
+    def publish(self, channel, message):
+        for callback in list(self.subscribers[channel]):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self.subscribers[channel].append(callback)
+
+
+class RedisStore:
+
+    def __init__(self, client, prefix='double_auction'):
+        self.client = client
+        self.prefix = prefix
+        self.subscriptions = []
+        self.changed_markets = set()
+        self.load = None
+
+    @classmethod
+    def from_url(cls, url):
+        import redis  # Optional dependency, only needed if the market state is shared between processes
+        return cls(redis.Redis.from_url(url))
+
+    def key(self, market, part):
+        return '{}:{}:{}'.format(self.prefix, market, part)
+
+    def has_market(self, market):
+        return bool(self.client.exists(self.key(market, 'book')))
+
+    def load_market(self, market, book, balances, clocks):  # Only the first of several concurrent loads is kept
+        from redis.exceptions import WatchError
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.key(market, 'book'))
+                if pipe.exists(self.key(market, 'book')):
+                    return
+                pipe.multi()
+                pipe.set(self.key(market, 'book'), pickle.dumps(book))
+                pipe.set(self.key(market, 'clocks'), pickle.dumps(clocks))
+                pipe.delete(self.key(market, 'balances'))
+                if balances:
+                    pipe.hset(self.key(market, 'balances'), mapping={str(k): int(v) for k, v in balances.items()})
+                pipe.execute()
+            except WatchError:
+                pass  # Another process loaded the market in the meantime
+
+    def drop_market(self, market):
+        self.client.delete(self.key(market, 'book'), self.key(market, 'clocks'), self.key(market, 'balances'))
+
+    def read(self, market, part):
+        value = self.client.get(self.key(market, part))
+        if value is None:
+            self.load(market)
+            value = self.client.get(self.key(market, part))
+        return pickle.loads(value)
+
+    def update(self, market, part, change):  # Optimistic transaction, retried if another process changed the value
+        from redis.exceptions import WatchError
+        key = self.key(market, part)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    if value is None:
+                        pipe.reset()
+                        self.load(market)
+                        continue
+                    value = pickle.loads(value)
+                    result = change(value)
+                    pipe.multi()
+                    pipe.set(key, pickle.dumps(value))
+                    pipe.execute()
+                    self.changed_markets.add(market)
+                    return result
+                except WatchError:
+                    continue
+
+    def read_book(self, market):
+        return self.read(market, 'book')
+
+    def update_book(self, market, change):
+        return self.update(market, 'book', change)
+
+    def read_clocks(self, market):
+        return self.read(market, 'clocks')
+
+    def update_clocks(self, market, change):
+        return self.update(market, 'clocks', change)
+
+    def add_balance(self, market, trader, amount):
+        # The balances are watched, so that a market dropped in the meantime is loaded before the amount is added
+        from redis.exceptions import WatchError
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.key(market, 'balances'))
+                    if not pipe.exists(self.key(market, 'book')):
+                        pipe.reset()
+                        self.load(market)
+                        continue
+                    pipe.multi()
+                    pipe.hincrby(self.key(market, 'balances'), str(trader), amount)
+                    balance = int(pipe.execute()[0])
+                    self.changed_markets.add(market)
+                    return balance
+                except WatchError:
+                    continue
+
+    def read_balances(self, market):
+        return {int(k): int(v) for k, v in self.client.hgetall(self.key(market, 'balances')).items()}
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + ':' + channel, pickle.dumps(message))
+
+    def subscribe(self, channel, callback):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.prefix + ':' + channel: lambda message: callback(pickle.loads(message['data']))})
+        self.subscriptions.append(pubsub.run_in_thread(sleep_time=0.1, daemon=True))
+
+
+def create_store():  # Store configured by the MARKET_STORE_URL environment variable
+    url = os.environ.get('MARKET_STORE_URL')
+    if url:
+        return RedisStore.from_url(url)
+    return InProcessStore()
@@ -0,0 +1,83 @@
+# Unit of work for the participant and session fields that live_method reads and writes.
+#
+# oTree keeps all participant fields in one pickled column (participant.vars), the session fields likewise. Every
+# access of a field through the participant or session, even a read, marks that column as changed, so oTree pickles
+# and writes it back at the end of the request. VarsState reads the fields without marking them, collects the fields
+# set during a live_method call and writes back only those that really differ from the stored value, once in
+# flush(). Lists and dicts must be assigned, changes in place are not tracked. Attributes that are not fields (e.g.
+# session.config or participant.code) are read from the object itself.
+#
+# Deferred fields (live_method uses the production/consumption clocks, whose current values are kept by the market
+# store anyway) are written at most once per flush window of a participant. A window of 0 writes them on every
+# flush. Deferred values that are not written yet are still returned while the unit of work lasts. The time of the
+# last write is kept with the fields, in the participant var DEFERRED_FLUSH, so every process sees it and it goes away
+# with the participant.
+import time
+
+DEFERRED_FLUSH = 'deferred_flush'
+
+
+class VarsState:  # Fields of a participant or session
+
+    def __init__(self, obj):
+        object.__setattr__(self, 'obj', obj)
+        object.__setattr__(self, 'changes', {})
+
+    def __getattr__(self, field):  # Only called for fields, the attributes above are found directly
+        if field in self.changes:
+            return self.changes[field]
+        stored = self.obj._vars
+        if field in stored:
+            return stored[field]
+        return getattr(self.obj, field)
+
+    def __setattr__(self, field, value):
+        self.changes[field] = value
+
+    def changed_fields(self):
+        stored = self.obj._vars
+        return {field: value for field, value in self.changes.items()
+                if field not in stored or not equal(stored[field], value)}
+
+    def write(self, changes):
+        if changes:
+            self.obj.vars.update(changes)  # obj.vars marks the column as changed
+        self.changes.clear()
+        return bool(changes)
+
+    def flush(self):  # Write the changed fields, returns whether anything was written
+        return self.write(self.changed_fields())
+
+
+def equal(a, b):
+    try:
+        return type(a) is type(b) and bool(a == b)
+    except ValueError:  # Comparisons without a single truth value, e.g. of arrays
+        return False
+
+
+class ParticipantStates:
+
+    def __init__(self, deferred=(), window=0):
+        self.deferred = set(deferred)
+        self.window = window
+        self.states = {}
+
+    def __getitem__(self, player):  # State of the participant of a player
+        state = self.states.get(player.participant_id)
+        if state is None:
+            state = self.states[player.participant_id] = VarsState(player.participant)
+        return state
+
+    def flush(self):  # Write the changed fields, returns the number of participants written
+        written = 0
+        now = time.time()
+        for state in self.states.values():
+            changes = state.changed_fields()
+            if self.window and self.deferred & set(changes):
+                if now - state.obj._vars.get(DEFERRED_FLUSH, 0) < self.window:
+                    changes = {field: value for field, value in changes.items() if field not in self.deferred}
+                else:
+                    changes[DEFERRED_FLUSH] = now
+            written += state.write(changes)
+        return written
@@ -0,0 +1,82 @@
+# Multi-resolution price series of a market, for the price chart of the trading page.
+#
+# The chart payload has the same size however long the market has been open:
+#   recent   the last WINDOW trades at full resolution
+#   all      all trades as a line: the recent window plus the older trades downsampled to about POINTS points with
+#            Largest-Triangle-Three-Buckets, which keeps peaks and dips that averaging would flatten
+#   minute, quarter_hour, hour, day
+#            open/high/low/close/number of trades per bucket of that length, the most recent BUCKETS buckets
+# Points are [seconds since market opening, price in cents], candles [start, open, high, low, close, trades].
+# Trades have to be added in order. Older trades are downsampled again whenever twice POINTS have piled up, so adding
+# a trade costs O(1) amortized.
+from collections import deque
+
+WINDOW = 200
+POINTS = 300
+BUCKETS = 500
+RESOLUTIONS = dict(minute=60, quarter_hour=15 * 60, hour=60 * 60, day=24 * 60 * 60)  # Bucket length in seconds
+ZOOM_LEVELS = ['recent', 'all'] + list(RESOLUTIONS)
+# Number of points or candles a zoom level keeps, so that the chart drops the oldest ones after new trades like the
+# series does. 'all' keeps every trade, its older part is only downsampled.
+MAX_VALUES = dict(recent=WINDOW, all=None, **{zoom: BUCKETS for zoom in RESOLUTIONS})
+
+
+class PriceSeries:
+
+    def __init__(self):
+        self.recent = deque()
+        self.older = []  # Trades before the recent window, downsampled
+        self.candles = {zoom: deque(maxlen=BUCKETS) for zoom in RESOLUTIONS}
+
+    def add(self, seconds, price):
+        self.recent.append([seconds, price])
+        if len(self.recent) > WINDOW:
+            self.older.append(self.recent.popleft())
+            if len(self.older) > 2 * POINTS:
+                self.older = lttb(self.older, POINTS)
+        for zoom, resolution in RESOLUTIONS.items():
+            candles = self.candles[zoom]
+            start = seconds - seconds % resolution
+            if candles and candles[-1][0] >= start:  # Trades of several processes may arrive slightly out of order
+                candle = candles[-1]
+                candle[2] = max(candle[2], price)
+                candle[3] = min(candle[3], price)
+                candle[4] = price
+                candle[5] += 1
+            else:
+                candles.append([start, price, price, price, price, 1])
+
+    def zoom(self, level):  # Points or candles of a zoom level
+        if level == 'recent':
+            return [list(point) for point in self.recent]
+        if level == 'all':
+            return [list(point) for point in self.older] + [list(point) for point in self.recent]
+        return [list(candle) for candle in self.candles[level]]
+
+
+def lttb(points, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from each of threshold - 2 buckets, the point
+    # that spans the largest triangle with the point kept before it and the average of the next bucket
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    size = (len(points) - 2) / (threshold - 2)
+    kept = 0
+    for i in range(threshold - 2):
+        start = int(i * size) + 1
+        end = int((i + 1) * size) + 1
+        next_start = end
+        next_end = min(int((i + 2) * size) + 1, len(points))
+        next_points = points[next_start:next_end] or [points[-1]]
+        average_x = sum(p[0] for p in next_points) / len(next_points)
+        average_y = sum(p[1] for p in next_points) / len(next_points)
+        kept_x, kept_y = points[kept]
+        best, best_area = start, -1
+        for j in range(start, end):
+            area = abs((kept_x - average_x) * (points[j][1] - kept_y) - (kept_x - points[j][0]) * (average_y - kept_y))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        kept = best
+    sampled.append(points[-1])
+    return sampled
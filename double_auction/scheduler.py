@@ -0,0 +1,70 @@
+# Timer wheel for the scheduled events of a market (policy changes, pause and resume).
+#
+# Timers are kept in a ring of slots, one slot per tick (one second by default), so adding a timer and running the
+# due ones costs O(1) per timer no matter how many are pending. Timers further away than one rotation stay in their
+# slot until their tick has come. A daemon thread runs the due callbacks. It sleeps until the earliest pending timer
+# is due, or until a timer is added, and does not wake up while nothing is due. Callbacks run on that thread, so they
+# should only hand their work over, e.g. to the event loop of the web server, and must not use the database
+# themselves. The wheel lives in the memory of its process: whatever has to survive a restart (the schedule itself
+# and how far it has been applied) is kept in the database by the caller, which schedules the pending events again
+# when a process first serves the session.
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int(time.time() // tick)  # Last tick whose timers have run
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def schedule(self, deadline, callback):  # Run callback() at the timestamp deadline, or at the next tick if past
+        with self.condition:
+            tick = max(int(math.ceil(deadline / self.tick)), self.current + 1)
+            self.slots[tick % len(self.slots)].append((tick, callback))
+            self.pending += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='market-schedule', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def expire(self, now):  # Remove and return the callbacks that are due at the timestamp now
+        due = []
+        with self.condition:
+            target = int(now // self.tick)
+            # After a long sleep every slot is visited once, not once per elapsed tick
+            for tick in range(max(self.current + 1, target - len(self.slots) + 1), target + 1):
+                slot = self.slots[tick % len(self.slots)]
+                if slot:
+                    due += [callback for timer_tick, callback in slot if timer_tick <= target]
+                    slot[:] = [timer for timer in slot if timer[0] > target]
+            self.current = max(self.current, target)
+            self.pending -= len(due)
+        return due
+
+    def next_tick(self):  # Tick of the earliest pending timer, None if there is none
+        if not self.pending:
+            return None
+        return min(tick for slot in self.slots for tick, _ in slot)
+
+    def run(self):
+        while True:
+            with self.condition:
+                tick = self.next_tick()
+                while tick is None or time.time() // self.tick < tick:
+                    # schedule() wakes the thread up when a timer is added, which may be due earlier
+                    self.condition.wait(None if tick is None else tick * self.tick - time.time())
+                    tick = self.next_tick()
+            for callback in self.expire(time.time()):
+                try:
+                    callback()
+                except Exception:
+                    logger.exception('Scheduled market event failed')
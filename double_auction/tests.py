@@ -0,0 +1,358 @@
+from otree.api import Currency as c, currency_range, expect, Bot, Submission
+from otree.database import db
+from sqlalchemy import text
+from . import NOTIFICATIONS, Results, Trading, Transaction, WaitToStart, format_cents, market_feed, market_time, \
+    new_book, profit_totals, submit_offer, tax_revenue, use_clock, vars_for_admin_report, vars_footprint, \
+    volume_per_minute
+from . import price_history
+from .market_store import RedisStore
+import asyncio
+import inspect
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime
+
+
+# `otree test double_auction` checks the outcomes of trading an hour after market opening (check_trading): a market
+# update that starts a new epoch, offers outside the price limits, a withdrawal and a trade with taxes. It also tests
+# RedisStore against fakeredis, a local stand-in for Redis, if fakeredis is installed (check_redis_store).
+#
+# Soak test of the trading page: `SOAK_TEST=1 otree test double_auction_soak` simulates several days of trading on
+# compressed time (see the double_auction_soak session config, only defined with SOAK_TEST set). Every simulated step
+# the admin page sends a time update and the traders make or withdraw offers near their marginal costs/utilities.
+# Latency, participant vars size, RSS and database size are sampled every few simulated hours, and the test fails if
+# one of them grows faster per simulated day than its soak_max_* bound.
+#
+# Both run the app on a SimulatedClock. Verified with oTree 5.6 (the version in requirements.txt) and oTree 6.0.
+
+
+class PlayerBot(Bot):
+
+    def play_round(self):
+        if WaitToStart.is_displayed(self.player):
+            yield Submission(WaitToStart, timeout_happened=True, check_html=False)
+        yield Submission(Trading, timeout_happened=True, check_html=False)
+        if Results.is_displayed(self.player) and self.player.is_admin != 1:  # After check_trading, see below
+            expect(' from 1 trade' if self.player.id_in_group in [2, 3] else ' from 0 trades', 'in', self.html)
+
+
+def call_live_method(method, group, **kwargs):
+    config = group.session.config
+    method = live_responses(method)
+    if config.get('soak_days'):
+        clock = SimulatedClock(time.time())
+        with use_clock(clock):
+            samples = soak(method, group, config, clock)
+        check_growth(samples, config)
+    else:
+        clock = SimulatedClock(market_time(config['market_opening']) + 60 * 60)
+        with use_clock(clock):
+            check_trading(method, group, clock)
+        check_redis_store()
+
+
+def live_responses(method):  # method returning the response of live_method, whichever way the oTree version gives it
+    loop = asyncio.new_event_loop()
+
+    async def collect(responses):
+        return [response async for response in responses]
+
+    def call(id_in_group, data):
+        response = method(id_in_group, data)
+        if inspect.isasyncgen(response):  # oTree 6 yields the responses of live_method
+            return loop.run_until_complete(collect(response))[-1]
+        return response
+
+    return call
+
+
+class SimulatedClock:  # Clock for use_clock(), so that days pass in minutes
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def today(self):
+        return datetime.fromtimestamp(self.now)
+
+
+def check_trading(method, group, clock):
+    currency_unit = ' ' + group.session.config['currency_unit']
+    players = {p.id_in_group: p for p in group.get_players()}
+    admin, buyer, seller, other_buyer = 1, 2, 3, 4
+    expect(players[admin].is_admin, True)
+    expect([players[i].is_buyer for i in [buyer, seller, other_buyer]], [True, False, True])
+    for i in players:  # Every player loads the trading page
+        method(i, {})
+
+    # A market update starts a new epoch with an empty book
+    response = method(other_buyer, dict(type='offer', offer='10'))
+    expect(response[other_buyer]['offers'], ['10.00'])
+    expect(response[admin]['bids'], [dict(bid='10.00', quantity=1, traders=1)])
+    response = method(admin, dict(type='market_update', buyer_tax_admin='10', seller_tax_admin='5',
+                                  price_floor_admin='0', price_ceiling_admin='100'))
+    for i in players:
+        expect(response[i]['epoch'], 1)
+        expect(response[i]['bids'], [])
+    expect(method(other_buyer, {})[other_buyer]['offers'], [])
+
+    # Offers outside the price limits are rejected
+    response = method(seller, dict(type='offer', offer='150'))
+    expect(response[seller]['error']['message'], NOTIFICATIONS['ask_above_ceiling'][0])
+    expect(response[seller]['offers'], [])
+    response = method(buyer, dict(type='offer', offer='-5'))
+    expect(response[buyer]['error']['message'], NOTIFICATIONS['bid_below_floor'][0])
+    expect(response[buyer]['bids'], [])
+
+    # Values that are not finite are rejected, also in withdrawals and market updates
+    for offer in ['inf', '-inf', 'nan']:
+        response = method(buyer, dict(type='offer', offer=offer))
+        expect(response[buyer]['error']['message'], NOTIFICATIONS['invalid_number'][0])
+        expect(response[buyer]['offers'], [])
+    response = method(buyer, dict(type='withdrawal', withdrawal='nan'))
+    expect(response[buyer]['error']['message'], NOTIFICATIONS['invalid_number'][0])
+    response = method(admin, dict(type='market_update', buyer_tax_admin='10', seller_tax_admin='5',
+                                  price_floor_admin='0', price_ceiling_admin='inf'))
+    expect(response[admin]['error']['message'], NOTIFICATIONS['invalid_number'][0])
+    expect((response[admin]['epoch'], response[admin]['price_ceiling_admin']), (1, 100))
+
+    # A withdrawn offer leaves the book
+    response = method(other_buyer, dict(type='offer', offer='20'))
+    expect(response[other_buyer]['offers'], ['20.00'])
+    response = method(other_buyer, dict(type='withdrawal', withdrawal='20.00'))
+    expect(response[other_buyer]['offers'], [])
+    expect(response[other_buyer]['bids'], [])
+
+    # The bid comes first, so the trade is at its price. Taxes are 10 % for the buyer and 5 % for the seller.
+    method(buyer, dict(type='offer', offer='60'))
+    clock.now += 1
+    response = method(seller, dict(type='offer', offer='55'))
+    buyer_balance = round(players[buyer].max_mu * 100) - 6000 - 600
+    seller_balance = 6000 - round(players[seller].min_mc * 100) - 300
+    expect(response[buyer]['balance'], format_cents(buyer_balance) + currency_unit)
+    expect(response[seller]['balance'], format_cents(seller_balance) + currency_unit)
+    expect((players[buyer].balance, players[seller].balance), (buyer_balance, seller_balance))
+    expect((response[buyer]['offers'], response[seller]['offers']), ([], []))
+    trades = Transaction.filter(group=group)
+    expect([(tx.price, tx.buyer_tax_paid, tx.seller_tax_paid) for tx in trades], [(6000, 600, 300)])
+    expect(tax_revenue(group)['total'], 9.0)
+    expect(profit_totals(group), {buyer: dict(trades=1, profit=buyer_balance / 100),
+                                  seller: dict(trades=1, profit=seller_balance / 100)})
+    expect(volume_per_minute(group), [dict(minute=60, trades=1, average_price=60.0)])
+    expect(vars_for_admin_report(group.subsession)['volume'], [dict(group=1, minute=60, trades=1, average_price=60.0)])
+    response = method(buyer, dict(type='price_history', zoom='recent'))
+    expect([price for _, price in response[buyer]['price_history']['points']], [60.0])
+    expect(response[buyer]['price_history']['max_values'], price_history.WINDOW)  # Cap of the chart on the page
+
+    # The time update of the admin page takes a sample of the participant vars footprint
+    method(admin, dict(type='time_update'))
+    samples = group.session.vars_footprint
+    expect(len(samples), 1)
+    expect('notifications', 'in', samples[0]['fields'])
+
+
+def check_redis_store():  # Two processes sharing one Redis server, simulated with two clients of one fakeredis server
+    try:
+        import fakeredis
+    except ImportError:
+        print('fakeredis is not installed, RedisStore is not tested')
+        return
+    server = fakeredis.FakeServer()
+    store = RedisStore(fakeredis.FakeStrictRedis(server=server), prefix='test')
+    other = RedisStore(fakeredis.FakeStrictRedis(server=server), prefix='test')
+    market = 'test:1'
+    epoch = dict(id=1, number=0, buyer_tax=0, seller_tax=0, price_floor=0, price_ceiling=100000)
+    loads = []
+
+    def load(market):  # Stands in for loading the market from the database
+        loads.append(market)
+        store.load_market(market, new_book(buyers=[2], sellers=[3], epoch=epoch), {2: 0, 3: 0}, {2: 0, 3: 0})
+
+    store.load = load
+    store.read_book(market)
+    expect(loads, [market])
+
+    # The other process changes the book while the bid is matched, so the bid is matched again against the new book
+    attempts = []
+
+    def bid(book):
+        attempts.append(book)
+        if len(attempts) == 1:
+            other.update_book(market, lambda book: submit_offer(book, 3, False, 5000, 1.0))
+        return submit_offer(book, 2, True, 6000, 2.0)
+
+    expect(store.update_book(market, bid), (2, 3, 5000))
+    expect(len(attempts), 2)
+    expect(other.read_book(market)['offers'], {2: [], 3: []})
+
+    # Likewise for the clocks, neither change is lost
+    attempts.clear()
+
+    def add_second(clocks):
+        attempts.append(clocks)
+        if len(attempts) == 1:
+            other.update_clocks(market, lambda clocks: clocks.update({3: clocks[3] + 10}))
+        clocks[2] += 1
+
+    store.update_clocks(market, add_second)
+    expect(len(attempts), 2)
+    expect(other.read_clocks(market), {2: 1, 3: 10})
+    expect(store.changed_markets, {market})
+
+    # A market dropped by the other process is loaded again when it is next changed
+    other.drop_market(market)
+    expect(store.add_balance(market, 2, 150), 150)
+    other.drop_market(market)
+    expect(store.update_book(market, lambda book: len(book['offers'])), 0)
+    expect(loads, [market] * 3)
+
+    # Snapshots published by one process reach the spectator feed of the other one
+    other.subscribe('market_feed', lambda message: market_feed.publish(*message))
+    store.publish('market_feed', ('test-session', 'token', dict(trades=1)))
+    deadline = time.time() + 5
+    while 'test-session' not in market_feed.snapshots and time.time() < deadline:
+        time.sleep(0.05)
+    for subscription in other.subscriptions:
+        subscription.stop()
+    expect('test-session', 'in', market_feed.snapshots)
+    version, token, snapshot = market_feed.snapshots.pop('test-session')
+    expect((token, json.loads(snapshot)), ('token', dict(trades=1, version=1)))
+
+
+def soak(method, group, config, clock):  # Play soak_days of trading, returns the samples taken
+    rng = random.Random(config.get('random_seed'))
+    players = group.get_players()
+    traders = [p.id_in_group for p in players if p.is_admin != 1]
+    is_buyer = {p.id_in_group: p.is_buyer for p in players}
+    admin = next(p.id_in_group for p in players if p.is_admin == 1)
+    evaluations = {}  # id_in_group -> marginal costs/utility, as last sent to the player
+    offers = {}  # id_in_group -> standing offers, as last sent to the player
+    latencies = []
+    trades = 0
+
+    def send(id_in_group, data):
+        nonlocal trades
+        start = time.perf_counter()
+        response = method(id_in_group, data)
+        latencies.append(time.perf_counter() - start)
+        for i, values in response.items():
+            if 'marginal_evaluation' in values:
+                evaluations[i] = float(values['marginal_evaluation'].split(" ", 1)[0])
+            if 'offers' in values:
+                offers[i] = values['offers']
+        if data.get('type') == 'offer' and 'new_trades' in response[id_in_group]:  # Only sent after trades
+            trades += 1
+
+    for p in players:  # Every player loads the trading page
+        send(p.id_in_group, {})
+    start = clock.now
+    end = start + config['soak_days'] * 24 * 60 * 60
+    step = config['soak_step']
+    offers_per_step = config['soak_offers_per_step']
+    next_sample = start + config['soak_sample_hours'] * 60 * 60
+    next_market_update = start + 24 * 60 * 60
+    samples = []
+    while clock.now < end:
+        clock.now += step / (offers_per_step + 1)
+        send(admin, {'type': 'time_update'})
+        for _ in range(offers_per_step):
+            clock.now += step / (offers_per_step + 1)
+            trader = rng.choice(traders)
+            if len(offers.get(trader, [])) >= config['soak_standing_offers']:
+                send(trader, {'type': 'withdrawal', 'withdrawal': rng.choice(offers[trader])})
+            elif trader in evaluations:
+                spread = rng.uniform(0, 15)
+                price = evaluations[trader] - spread if is_buyer[trader] else evaluations[trader] + spread
+                send(trader, {'type': 'offer', 'offer': '{:.2f}'.format(max(price, config['price_floor']))})
+        if clock.now >= next_market_update:  # One policy change per simulated day, which starts a new epoch
+            next_market_update += 24 * 60 * 60
+            session = group.session
+            send(admin, dict(type='market_update',
+                             buyer_tax_admin=str(5 - round(session.buyer_tax * 100)),
+                             seller_tax_admin=str(round(session.seller_tax * 100)),
+                             price_floor_admin=str(session.price_floor),
+                             price_ceiling_admin=str(session.price_ceiling)))
+            offers.clear()
+        if clock.now >= next_sample:
+            next_sample += config['soak_sample_hours'] * 60 * 60
+            samples.append(dict(
+                day=(clock.now - start) / (24 * 60 * 60),
+                calls=len(latencies),
+                trades=trades,
+                latency=statistics.median(latencies) * 1000,
+                p95=sorted(latencies)[int(0.95 * len(latencies))] * 1000,
+                vars=statistics.mean(sum(vars_footprint(p.participant).values()) for p in players),
+                rss=rss_mb(),
+                db=database_mb(),
+            ))
+            print_sample(samples[-1], header=len(samples) == 1)
+            latencies = []
+    return samples
+
+
+def print_sample(sample, header=False):
+    if header:
+        print('   day    calls   trades  median ms  p95 ms  vars bytes  RSS MB  DB MB')
+    print('{day:6.2f} {calls:8} {trades:8} {latency:10.2f} {p95:7.2f} {vars:11.0f} {rss:>7} {db:>6}'.format(
+        **dict(sample, rss=format_mb(sample['rss']), db=format_mb(sample['db']))))
+
+
+def format_mb(value):
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+def rss_mb():  # Resident set size of this process, None where /proc is not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def database_mb():  # Size of the database, None for databases other than SQLite and PostgreSQL
+    dialect = db._db.get_bind().dialect.name
+    if dialect == 'sqlite':
+        pages = db._db.execute(text('PRAGMA page_count')).scalar()
+        return pages * db._db.execute(text('PRAGMA page_size')).scalar() / 2 ** 20
+    if dialect == 'postgresql':
+        return db._db.execute(text('SELECT pg_database_size(current_database())')).scalar() / 2 ** 20
+    return None
+
+
+def growth_per_day(samples, key):  # Least-squares slope of a sampled value over the simulated days
+    points = [(s['day'], s[key]) for s in samples if s[key] is not None]
+    if len(points) < 2:
+        return None
+    mean_day = statistics.mean(day for day, _ in points)
+    mean_value = statistics.mean(value for _, value in points)
+    variance = sum((day - mean_day) ** 2 for day, _ in points)
+    return sum((day - mean_day) * (value - mean_value) for day, value in points) / variance
+
+
+def relative_growth_per_day(samples, key):
+    growth = growth_per_day(samples, key)
+    return None if growth is None else growth / samples[0][key]
+
+
+def check_growth(samples, config):
+    # Latencies are compared relative to the first sample, so that the bounds do not depend on the machine
+    growths = [
+        ('median latency (share of the first sample)', relative_growth_per_day(samples, 'latency'),
+         config['soak_max_latency_growth']),
+        ('p95 latency (share of the first sample)', relative_growth_per_day(samples, 'p95'),
+         config['soak_max_p95_growth']),
+        ('participant vars (bytes)', growth_per_day(samples, 'vars'), config['soak_max_vars_growth']),
+        ('RSS (MB)', growth_per_day(samples, 'rss'), config['soak_max_rss_growth']),
+        ('database (MB)', growth_per_day(samples, 'db'), config['soak_max_db_growth']),
+    ]
+    for name, growth, bound in growths:
+        if growth is not None:
+            print('Growth per simulated day of {}: {:.3f}, bound {}'.format(name, growth, bound))
+    for name, growth, bound in growths:
+        if growth is not None:
+            expect(growth, '<=', bound)
@@ -9,6 +9,31 @@ SESSION_CONFIGS = [
     ),
 ]
 
+# Soak test of the trading page (see double_auction/tests.py), only defined when SOAK_TEST is set so that it is not
+# offered on the session creation page: SOAK_TEST=1 otree test double_auction_soak
+if environ.get('SOAK_TEST'):
+    SESSION_CONFIGS.append(
+        dict(
+            name='double_auction_soak',
+            display_name="Double auction market (soak test)",
+            app_sequence=['double_auction'],
+            num_demo_participants=20,
+            market_closing='31 Dec 2099 18:00:00',  # Open while the bots simulate days of trading
+            random_seed=42,
+            soak_days=3,  # Simulated days of trading
+            soak_step=60,  # Simulated seconds between two time updates of the admin page
+            soak_offers_per_step=4,  # Offers or withdrawals per step
+            soak_standing_offers=3,  # Traders withdraw one of their offers before making more than this many
+            soak_sample_hours=6,  # Simulated hours between two samples
+            # Bounds on the growth per simulated day, the test fails if one is exceeded
+            soak_max_latency_growth=0.25,  # Median latency, as a share of the first sample
+            soak_max_p95_growth=0.5,  # 95th percentile latency, as a share of the first sample
+            soak_max_vars_growth=500,  # Mean participant vars size in bytes
+            soak_max_rss_growth=20,  # Resident memory in MB
+            soak_max_db_growth=10,  # Database size in MB
+        )
+    )
+
 # if you set a property in SESSION_CONFIG_DEFAULTS, it will be inherited by all configs
 # in SESSION_CONFIGS, except those that explicitly override it.
 # the session config can be accessed from methods in your apps as self.session.config,
@@ -28,7 +53,12 @@ SESSION_CONFIG_DEFAULTS = dict(
     seller_tax=0.0,
     buyer_tax=0.0,
     anonymity=True,
+    market_depth=3,  # Number of best price levels of asks and bids shown to traders
+    page_stagger=10,  # Seconds over which participants enter and leave the market around opening and closing
+    market_schedule='',  # Scheduled policy changes and pauses, e.g. '+3600 -> buyer_tax=10; +7200 -> pause'
+    clock_flush_window=0,  # Seconds between two saves of a participant's clock, 0 saves every change
     # target_equilibrium_price=60,
+    # random_seed=42,  # Fix the seed to reproduce the randomized costs and utilities of a session
     lower_bound_minimum_mc=30,
     upper_bound_minimum_mc=44,
     lower_bound_maximum_mu=66,
@@ -60,22 +90,19 @@ SECRET_KEY = '4387860144726'
 INSTALLED_APPS = ['otree']
 
 PARTICIPANT_FIELDS = [
-    'offers',
     'offer_times',
-    'offer_history',
     'time_needed_1',
     'time_needed_2',
     'time_needed_3',
     'marginal_evaluation',
-    'cost_chart_series',
-    'utility_chart_series',
-    'trading_history',
+    'chart_series',
     'previous_timestamp',
     'current_timestamp',
-    'refresh_counter',
     'error',
     'news',
-    'notifications'
+    'notifications',
+    'market_epoch',
+    'deferred_flush',
 ]
 
 SESSION_FIELDS = [
@@ -83,5 +110,10 @@ SESSION_FIELDS = [
     'buyer_tax',
     'seller_tax',
     'price_floor',
-    'price_ceiling'
+    'price_ceiling',
+    'vars_footprint',
+    'market_schedule',
+    'schedule_position',
+    'market_paused',
+    'spectator_token',
 ]